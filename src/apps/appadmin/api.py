@@ -1,10 +1,33 @@
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .serializers import UserSerializer
 
+from apps.customer.app import app
+from apps.customer.app.command.onboard_customers import OnboardError
+
 
 class CurrentUser(APIView):
 
     def get(self, *args, **kwargs):
         serializer = UserSerializer(self.request.user)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class OnboardCustomers(APIView):
+    """Internal staff bulk onboarding of customers and users from an uploaded file"""
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, *args, **kwargs):
+        file_field = self.request.data.get('file', None)
+        if file_field is None:
+            return Response({'message': 'A file upload is required'}, status=400)
+        try:
+            result = app.command.onboard_customers(file_field)
+        except OnboardError as e:
+            return Response({'message': str(e), 'rows': e.rows}, status=400)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=400)
+        return Response(result._asdict(), status=201)
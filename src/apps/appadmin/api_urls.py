@@ -1,6 +1,7 @@
 from django.urls import path
-from .api import CurrentUser
+from .api import CurrentUser, OnboardCustomers
 
 urlpatterns = [
     path('current_user/', CurrentUser.as_view(), name="current_user"),
+    path('onboard_customers/', OnboardCustomers.as_view(), name="onboard_customers"),
 ]
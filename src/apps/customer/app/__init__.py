@@ -1,8 +1,9 @@
 from collections import namedtuple
 
 from .command import command
+from .query import query
 
 App = namedtuple("App", ['command', 'query'])
 
 
-app = App(command=command, query=None)
+app = App(command=command, query=query)
@@ -1,12 +1,20 @@
 from collections import namedtuple
 
 from .create_customer import create_customer
+from .onboard_customers import onboard_customers
+from .record_usage import flush_usage, record_usage
 
 Command = namedtuple("Command", [
-    'create_customer'
+    'create_customer',
+    'onboard_customers',
+    'record_usage',
+    'flush_usage',
 ])
 
 
 command = Command(
-    create_customer=create_customer
+    create_customer=create_customer,
+    onboard_customers=onboard_customers,
+    record_usage=record_usage,
+    flush_usage=flush_usage,
 )
@@ -3,6 +3,10 @@ from apps.customer.models import Customer
 from hashlib import sha1
 
 
+def get_name_hash(name: str) -> str:
+    return f"cust_{sha1(str(name).encode('utf-8')).hexdigest()[0:14]}"
+
+
 def create_customer(name: str,
                     customer_primary_email: str,
                     trail_account: bool = True) -> Customer:
@@ -11,7 +15,7 @@ def create_customer(name: str,
         raise ValueError("Customer Name must be less than 100 characters")
 
     # Generate Name Hash
-    name_hash = f"cust_{sha1(str(name).encode('utf-8')).hexdigest()[0:14]}"
+    name_hash = get_name_hash(name)
 
     # Create Customer
     # TODO: Additional Steps?
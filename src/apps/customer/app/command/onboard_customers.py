@@ -0,0 +1,186 @@
+"""
+Bulk customer and user onboarding from a CSV/JSON/Excel file, one row per user:
+
+    customer_name, customer_primary_email, email[, first_name, last_name,
+    trail_account, customer_admin, password]
+
+Customers, users and auth tokens are created with `bulk_create` in batches, the
+per row `post_save` receivers are skipped. Only new rows are inserted, so there
+is no cached config or serializer data to invalidate. Existing customers (by
+name) and users (by email) are kept.
+
+The file is validated before anything is written, rows with a missing or invalid
+email, or a customer primary email used by another customer, reject the file
+with an `OnboardError` listing the rows.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from rest_framework.authtoken.models import Token
+
+from apps.customer.models import Customer
+from utils.yahp.file_io import read_file_to_df
+from utils.yahp.parser import parse_bool_series, parse_varchar_series
+
+from .create_customer import get_name_hash
+
+from collections import namedtuple
+from uuid import uuid4
+
+User = get_user_model()
+
+ONBOARD_BATCH_SIZE = 1000
+ONBOARD_REQUIRED_COLUMNS = ('customer_name', 'customer_primary_email', 'email')
+
+OnboardResult = namedtuple("OnboardResult", [
+    'customers_created', 'customers_existing', 'users_created', 'users_existing'
+])
+
+
+class OnboardError(ValueError):
+    """
+    Rejected onboarding file, `rows` lists `{"row": ..., "message": ...}` errors
+    where row is the 1 based data row of the file (header excluded)
+    """
+
+    def __init__(self, message: str, rows: list = None):
+        super().__init__(message)
+        self.rows = rows or []
+
+
+def _is_valid_email(email: str) -> bool:
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def _validate_rows(df, names, name_hashes, primary_emails, emails) -> list:
+    existing_hashes = set(
+        Customer.objects.filter(name_hash__in=name_hashes.values()).values_list('name_hash', flat=True)
+    )
+    # Customer (name hash) of each primary email, existing and new in the file
+    email_customers = dict(
+        Customer.objects.filter(customer_primary_email__in=set(primary_emails.dropna()))
+        .values_list('customer_primary_email', 'name_hash')
+    )
+    customer_emails = {}
+    errors = []
+    for row, name, primary_email, email in zip(df.index, names, primary_emails, emails):
+        name_hash = name_hashes[name]
+        if not _is_valid_email(email):
+            message = f"Invalid email `{email}`"
+        elif name_hash in existing_hashes:
+            # Existing customers are kept as is
+            continue
+        elif primary_email is None:
+            message = "Customer primary email is required"
+        elif not _is_valid_email(primary_email):
+            message = f"Invalid customer primary email `{primary_email}`"
+        elif email_customers.setdefault(primary_email, name_hash) != name_hash:
+            message = f"Customer primary email `{primary_email}` belongs to another customer"
+        elif customer_emails.setdefault(name_hash, primary_email) != primary_email:
+            message = f"Customer `{name}` has another primary email `{customer_emails[name_hash]}`"
+        else:
+            continue
+        errors.append({'row': int(row) + 1, 'message': message})
+    return errors
+
+
+def _optional_column(df, column, parser, default):
+    if column not in df.columns:
+        return [default] * len(df)
+    values, _ = parser(df[column], nullable=False, default=default)
+    return values.tolist()
+
+
+def onboard_customers(file_field, batch_size: int = ONBOARD_BATCH_SIZE) -> OnboardResult:
+    df = read_file_to_df(file_field)
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    missing_columns = [column for column in ONBOARD_REQUIRED_COLUMNS if column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Onboarding file is missing columns: {', '.join(missing_columns)}")
+
+    df = df[df['customer_name'].notna() & df['email'].notna()]
+    names = df['customer_name'].astype(str).str.strip()
+    if (names.str.len() > 100).any():
+        raise ValueError("Customer Name must be less than 100 characters")
+
+    # Name Hash computed once per customer
+    name_hashes = {name: get_name_hash(name) for name in names.unique()}
+    emails = df['email'].astype(str).str.strip().map(User.objects.normalize_email)
+    # Missing (NaN) or blank primary emails as None
+    primary_emails = df['customer_primary_email'].map(lambda x: (x.strip() or None) if isinstance(x, str) else None)
+    errors = _validate_rows(df, names, name_hashes, primary_emails, emails)
+    if errors:
+        raise OnboardError(f"Onboarding file has {len(errors)} invalid rows", rows=errors)
+
+    trail_accounts = _optional_column(df, 'trail_account', parse_bool_series, True)
+    customer_admins = _optional_column(df, 'customer_admin', parse_bool_series, False)
+    first_names = _optional_column(df, 'first_name', parse_varchar_series, None)
+    last_names = _optional_column(df, 'last_name', parse_varchar_series, None)
+    passwords = _optional_column(df, 'password', parse_varchar_series, None)
+
+    try:
+        with transaction.atomic():
+            # Customers
+            customer_ids = dict(
+                Customer.objects.filter(name_hash__in=name_hashes.values()).values_list('name_hash', 'id')
+            )
+            customers_existing = len(customer_ids)
+            customers = []
+            for name, primary_email, trail_account in zip(names, primary_emails, trail_accounts):
+                name_hash = name_hashes[name]
+                if name_hash in customer_ids:
+                    continue
+                customer = Customer(
+                    id=uuid4(),
+                    name=name,
+                    name_hash=name_hash,
+                    customer_primary_email=primary_email,
+                    trail_account=trail_account,
+                    # Set up front, `get_or_create_integration_key` would save per customer
+                    integration=settings.CURRENT_CUSTOMER_INTEGRATION,
+                )
+                customer_ids[name_hash] = customer.id
+                customers.append(customer)
+            Customer.objects.bulk_create(customers, batch_size=batch_size)
+
+            # Users and Auth Tokens
+            existing_emails = set(User.objects.filter(email__in=set(emails)).values_list('email', flat=True))
+            users, tokens = [], []
+            for name, email, first_name, last_name, customer_admin, password in zip(
+                names, emails, first_names, last_names, customer_admins, passwords
+            ):
+                if email in existing_emails:
+                    continue
+                existing_emails.add(email)
+                user = User(
+                    id=uuid4(),
+                    email=email,
+                    customer_id=customer_ids[name_hashes[name]],
+                    first_name=first_name,
+                    last_name=last_name,
+                    customer_staff=customer_admin,
+                    customer_admin=customer_admin,
+                    password=make_password(password or None),
+                )
+                users.append(user)
+                tokens.append(Token(key=Token.generate_key(), user=user))
+            User.objects.bulk_create(users, batch_size=batch_size)
+            Token.objects.bulk_create(tokens, batch_size=batch_size)
+    except IntegrityError as e:
+        # Customers or users inserted concurrently since the validation
+        raise OnboardError(f"Onboarding conflicts with existing customers or users: {e}")
+
+    return OnboardResult(
+        customers_created=len(customers),
+        customers_existing=customers_existing,
+        users_created=len(users),
+        users_existing=len(emails) - len(users),
+    )
@@ -0,0 +1,189 @@
+"""
+Buffered CustomerUsage ingestion. Usage events are coalesced per customer,
+unit type and minute in a Redis hash (one HINCRBY, no INSERT on the request)
+and flushed to `cust_usage` in batches by the `consume_usage` command.
+
+Flushed batches are staged under their own key and their id is recorded in
+`cust_usage_flush` in the transaction writing them, a batch retried after a
+crash between the commit and the staged key removal is not written twice.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from apps.customer.models import CustomerUsage, CustomerUsageFlush
+from .rollup_usage import rollup_usage
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain, islice
+import logging
+from typing import Dict, Iterator, Tuple
+from uuid import uuid4
+
+logger = logging.getLogger('service')
+
+USAGE_BUFFER_KEY = 'usage_buffer'
+USAGE_FLUSHING_KEY = 'usage_buffer:flushing' # Buffer swapped out for the flush in progress
+USAGE_BATCHES_KEY = 'usage_buffer:batches' # Ids of the batches staged for writing
+USAGE_BATCH_KEY = 'usage_buffer:batch:{}' # Staged batch by id
+USAGE_FLUSH_LOCK = 'usage_buffer:lock'
+USAGE_FLUSH_LOCK_TIMEOUT = 60*5 # Seconds, renewed per batch
+USAGE_FLUSH_BATCH_SIZE = 1000
+USAGE_FLUSH_RETENTION = timedelta(days=7) # Written batch ids kept to skip retried batches
+
+# Renew or release the flush lock only while it is held by the same consumer
+EXTEND_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# (customer_id, unit_type, epoch minute) -> units
+UsageBatch = Dict[Tuple[str, str, int], int]
+
+
+def record_usage(customer_id: str,
+                 unit_type: str,
+                 units: int = 1,
+                 observation_datetime: datetime = None) -> None:
+    """Buffer a usage event, coalesced with the customer/unit type/minute events"""
+    observation_datetime = observation_datetime or timezone.now()
+    minute = int(observation_datetime.timestamp() // 60)
+    get_redis_connection('default').hincrby(
+        cache.make_key(USAGE_BUFFER_KEY), f"{customer_id}|{unit_type}|{minute}", units
+    )
+
+
+def _parse_batch(fields: Dict[bytes, bytes]) -> UsageBatch:
+    batch = {}
+    for field, units in fields.items():
+        customer_id, unit_type, minute = field.decode().split('|')
+        batch[(customer_id, unit_type, int(minute))] = int(units)
+    return batch
+
+
+def _stage_batches(redis, batch_size: int) -> Iterator[str]:
+    """
+    Swap out the usage buffer and move it to staged batches, yields the batch ids.
+    Each batch is moved in one MULTI/EXEC, a buffer field is staged exactly once.
+    """
+    flushing_key = cache.make_key(USAGE_FLUSHING_KEY)
+    if not redis.exists(flushing_key):
+        try:
+            redis.rename(cache.make_key(USAGE_BUFFER_KEY), flushing_key)
+        except ResponseError:
+            # Empty buffer, no key to rename
+            return
+
+    # HGETALL rather than HSCAN, which may return a field twice
+    fields = iter(redis.hgetall(flushing_key).items())
+    while True:
+        staged = dict(islice(fields, batch_size))
+        if not staged:
+            return
+        batch_id = uuid4().hex
+        pipe = redis.pipeline()
+        pipe.hset(cache.make_key(USAGE_BATCH_KEY.format(batch_id)), mapping=staged)
+        pipe.sadd(cache.make_key(USAGE_BATCHES_KEY), batch_id)
+        pipe.hdel(flushing_key, *staged)
+        pipe.execute()
+        yield batch_id
+
+
+def _flush_batch(redis, batch_id: str, batch_size: int) -> int:
+    """Write a staged batch unless already written, then drop it from Redis"""
+    batch_key = cache.make_key(USAGE_BATCH_KEY.format(batch_id))
+    batch = _parse_batch(redis.hgetall(batch_key))
+    if batch:
+        batch = write_usage(batch, batch_size=batch_size, batch_id=batch_id)
+    pipe = redis.pipeline()
+    pipe.delete(batch_key)
+    pipe.srem(cache.make_key(USAGE_BATCHES_KEY), batch_id)
+    pipe.execute()
+    return len(batch)
+
+
+def write_usage(batch: UsageBatch, batch_size: int = USAGE_FLUSH_BATCH_SIZE, batch_id: str = None) -> UsageBatch:
+    """
+    Add coalesced usage to the customer/unit type/minute rows, creating missing rows,
+    and to the hourly, daily and monthly rollups. A `batch_id` is recorded in the
+    same transaction, a batch already recorded is skipped and an empty batch returned.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if batch_id is not None:
+            _, created = CustomerUsageFlush.objects.get_or_create(id=batch_id)
+            if not created:
+                logger.info(f"Usage batch `{batch_id}` already written", extra={'task': 'flush_usage'})
+                return {}
+
+        existing = {
+            (str(usage.customer_id), usage.unit_type, int(usage.observation_datetime.timestamp() // 60)): usage
+            for usage in CustomerUsage.objects.select_for_update().filter(
+                customer_id__in={customer_id for customer_id, _, _ in batch},
+                unit_type__in={unit_type for _, unit_type, _ in batch},
+                observation_datetime__in={
+                    datetime.fromtimestamp(minute*60, tz=dt_timezone.utc) for _, _, minute in batch
+                },
+            )
+        }
+
+        creates, updates = [], []
+        for (customer_id, unit_type, minute), units in batch.items():
+            usage = existing.get((customer_id, unit_type, minute), None)
+            if usage is None:
+                creates.append(CustomerUsage(
+                    customer_id=customer_id,
+                    unit_type=unit_type,
+                    units=units,
+                    observation_datetime=datetime.fromtimestamp(minute*60, tz=dt_timezone.utc),
+                ))
+            else:
+                usage.units = (usage.units or 0) + units
+                usage.modified_on = now
+                updates.append(usage)
+
+        CustomerUsage.objects.bulk_create(creates, batch_size=batch_size)
+        CustomerUsage.objects.bulk_update(updates, ['units', 'modified_on'], batch_size=batch_size)
+        rollup_usage(batch)
+    return batch
+
+
+def flush_usage(batch_size: int = USAGE_FLUSH_BATCH_SIZE) -> int:
+    """
+    Flush the usage buffer to `cust_usage`, single consumer. Returns the number of
+    coalesced rows written. Batches staged by an interrupted flush are resumed
+    first, each batch is written at most once (see `write_usage`).
+    """
+    redis = get_redis_connection('default')
+    lock_key = cache.make_key(USAGE_FLUSH_LOCK)
+    token = uuid4().hex
+    if not redis.set(lock_key, token, nx=True, ex=USAGE_FLUSH_LOCK_TIMEOUT):
+        return 0
+
+    extend_lock = redis.register_script(EXTEND_LOCK_SCRIPT)
+    try:
+        staged = [batch_id.decode() for batch_id in redis.smembers(cache.make_key(USAGE_BATCHES_KEY))]
+        count = 0
+        for batch_id in chain(staged, _stage_batches(redis, batch_size)):
+            if not extend_lock(keys=[lock_key], args=[token, USAGE_FLUSH_LOCK_TIMEOUT]):
+                # Staged batches are left for the next flush
+                logger.warning("Usage flush lock lost, stopping flush", extra={'task': 'flush_usage'})
+                break
+            count += _flush_batch(redis, batch_id, batch_size)
+
+        CustomerUsageFlush.objects.filter(created_on__lt=timezone.now() - USAGE_FLUSH_RETENTION).delete()
+        return count
+    finally:
+        redis.register_script(RELEASE_LOCK_SCRIPT)(keys=[lock_key], args=[token])
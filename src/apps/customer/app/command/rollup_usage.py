@@ -0,0 +1,128 @@
+"""
+Hourly, daily and monthly CustomerUsage rollups, periods start in the local
+timezone to align with `utils.yahp.datetime` month boundaries.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.customer.models import (
+    CustomerUsage, CustomerUsageDaily, CustomerUsageHourly, CustomerUsageMonthly
+)
+from utils.yahp.datetime import beginning_of_month, date_to_tz_datetime
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from dateutil.relativedelta import relativedelta
+from itertools import islice
+from typing import Dict, Tuple
+from uuid import uuid4
+
+ROLLUP_UPSERT_BATCH_SIZE = 500
+
+
+def hour_start(dt: datetime) -> datetime:
+    return timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+
+
+def next_hour(dt: datetime) -> datetime:
+    return dt + timedelta(hours=1)
+
+
+def day_start(dt: datetime) -> datetime:
+    return date_to_tz_datetime(timezone.localtime(dt).date())
+
+
+def next_day(dt: datetime) -> datetime:
+    return date_to_tz_datetime(timezone.localtime(dt).date() + timedelta(days=1))
+
+
+def month_start(dt: datetime) -> datetime:
+    return date_to_tz_datetime(beginning_of_month(timezone.localtime(dt)))
+
+
+def next_month(dt: datetime) -> datetime:
+    return date_to_tz_datetime(beginning_of_month(timezone.localtime(dt)) + relativedelta(months=1))
+
+
+# Coarsest first: (rollup model, period start, next period start)
+ROLLUPS = (
+    (CustomerUsageMonthly, month_start, next_month),
+    (CustomerUsageDaily, day_start, next_day),
+    (CustomerUsageHourly, hour_start, next_hour),
+)
+
+TRUNCATE_PERIODS = {
+    CustomerUsageMonthly: 'month',
+    CustomerUsageDaily: 'day',
+    CustomerUsageHourly: 'hour',
+}
+
+
+def _upsert(model, deltas: Dict[Tuple[str, str, datetime], int]):
+    # Add units to existing periods in one statement per batch
+    table = model._meta.db_table
+    rows = iter(deltas.items())
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, ROLLUP_UPSERT_BATCH_SIZE))
+            if not batch:
+                return
+            params = []
+            for (customer_id, unit_type, period_start), units in batch:
+                params += [uuid4(), customer_id, unit_type, period_start, units]
+            cursor.execute(
+                f"INSERT INTO {table} (id, customer_id, unit_type, period_start, units) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT (customer_id, unit_type, period_start) "
+                f"DO UPDATE SET units = {table}.units + EXCLUDED.units",
+                params
+            )
+
+
+def rollup_usage(batch: Dict[Tuple[str, str, int], int]):
+    """
+    Add a flushed usage batch, units by (customer_id, unit_type, epoch minute),
+    to the hourly, daily and monthly rollups. Run in the flush transaction.
+    """
+    minutes = {minute: datetime.fromtimestamp(minute*60, tz=dt_timezone.utc) for _, _, minute in batch}
+    for model, period_start, _ in ROLLUPS:
+        periods = {minute: period_start(observation) for minute, observation in minutes.items()}
+        deltas = defaultdict(int)
+        for (customer_id, unit_type, minute), units in batch.items():
+            deltas[(customer_id, unit_type, periods[minute])] += units
+        _upsert(model, deltas)
+
+
+def rebuild_usage_rollups(start: datetime = None, end: datetime = None):
+    """
+    Recompute the rollups from `cust_usage` for periods starting in the range,
+    backfills usage saved outside of `record_usage`
+    """
+    start = month_start(start) if start is not None else None
+    end = next_month(end) if end is not None else None
+    tz_name = timezone.get_current_timezone_name()
+    usage_table = CustomerUsage._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, _, _ in ROLLUPS:
+            table = model._meta.db_table
+            rollups = model.objects.all()
+            where, params = ["units IS NOT NULL"], [TRUNCATE_PERIODS[model], tz_name, tz_name]
+            if start is not None:
+                rollups = rollups.filter(period_start__gte=start)
+                where.append("observation_datetime >= %s")
+                params.append(start)
+            if end is not None:
+                rollups = rollups.filter(period_start__lt=end)
+                where.append("observation_datetime < %s")
+                params.append(end)
+            rollups.delete()
+            cursor.execute(
+                f"INSERT INTO {table} (id, customer_id, unit_type, period_start, units) "
+                f"SELECT md5(random()::text || clock_timestamp()::text)::uuid, customer_id, unit_type, period, SUM(units) "
+                f"FROM (SELECT customer_id, unit_type, units, "
+                f"date_trunc(%s, observation_datetime AT TIME ZONE %s) AT TIME ZONE %s AS period "
+                f"FROM {usage_table} WHERE {' AND '.join(where)}) usage "
+                f"GROUP BY customer_id, unit_type, period",
+                params
+            )
@@ -0,0 +1,14 @@
+from collections import namedtuple
+
+from .get_usage import get_monthly_usage, get_usage
+
+Query = namedtuple("Query", [
+    'get_usage',
+    'get_monthly_usage',
+])
+
+
+query = Query(
+    get_usage=get_usage,
+    get_monthly_usage=get_monthly_usage,
+)
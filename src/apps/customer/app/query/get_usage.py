@@ -0,0 +1,93 @@
+"""
+CustomerUsage query API over the hourly, daily and monthly rollups. A range is
+split into the coarsest rollup periods it fully covers, the partial periods at
+its edges fall back to finer rollups and to raw `cust_usage` rows.
+"""
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.customer.app.command.rollup_usage import ROLLUPS
+from apps.customer.models import CustomerUsage
+from utils.yahp.datetime import beginning_of_month, date_to_tz_datetime
+
+from collections import defaultdict
+from datetime import date, datetime
+from dateutil.relativedelta import relativedelta
+from typing import Dict, List, Tuple
+
+
+def _usage_segments(start: datetime, end: datetime, rollups: Tuple = ROLLUPS) -> List[Tuple]:
+    """Split [start, end) into (model, start, end) segments, coarsest rollup first"""
+    if start >= end:
+        return []
+    if not rollups:
+        return [(CustomerUsage, start, end)]
+
+    model, period_start, next_period = rollups[0]
+    first = period_start(start)
+    if first != start:
+        first = next_period(first)
+    last = period_start(end)
+    if first >= last:
+        return _usage_segments(start, end, rollups[1:])
+    return (
+        _usage_segments(start, first, rollups[1:])
+        + [(model, first, last)]
+        + _usage_segments(last, end, rollups[1:])
+    )
+
+
+def get_usage(customer_id: str,
+              start: datetime,
+              end: datetime = None,
+              unit_type: str = None) -> Dict[str, int]:
+    """
+    Usage units by unit type for a customer in [start, end), end defaults to now.
+    Usage still buffered by `record_usage` is not included until flushed.
+    """
+    end = end or timezone.now()
+    usage = defaultdict(int)
+    for model, segment_start, segment_end in _usage_segments(start, end):
+        if model is CustomerUsage:
+            queryset = CustomerUsage.objects.filter(
+                observation_datetime__gte=segment_start, observation_datetime__lt=segment_end
+            )
+        else:
+            queryset = model.objects.filter(
+                period_start__gte=segment_start, period_start__lt=segment_end
+            )
+        queryset = queryset.filter(customer_id=customer_id)
+        if unit_type is not None:
+            queryset = queryset.filter(unit_type=unit_type)
+
+        for row in queryset.order_by().values('unit_type').annotate(total=Sum('units')):
+            usage[row['unit_type']] += row['total'] or 0
+    return dict(usage)
+
+
+def get_monthly_usage(customer_id: str,
+                      lookback_months: int,
+                      unit_type: str = None) -> Dict[date, Dict[str, int]]:
+    """
+    Usage units by unit type per month for the trailing months from the monthly
+    rollup, and the current partial month to now. Months are local dates, as the
+    rollup periods.
+    """
+    current_month = beginning_of_month(timezone.localdate())
+    months = [current_month - relativedelta(months=n) for n in range(lookback_months, 0, -1)]
+    usage = {month: defaultdict(int) for month in months}
+    if months:
+        rollups = ROLLUPS[0][0].objects.filter(
+            customer_id=customer_id,
+            period_start__gte=date_to_tz_datetime(months[0]),
+            period_start__lt=date_to_tz_datetime(current_month),
+        )
+        if unit_type is not None:
+            rollups = rollups.filter(unit_type=unit_type)
+        for rollup in rollups:
+            usage[timezone.localtime(rollup.period_start).date()][rollup.unit_type] += rollup.units
+
+    usage[current_month] = get_usage(
+        customer_id=customer_id, start=date_to_tz_datetime(current_month), unit_type=unit_type
+    )
+    return {month: dict(units) for month, units in usage.items()}
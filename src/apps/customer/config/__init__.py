@@ -1 +1 @@
-from .config import get_or_set_customer_user_config, Config
\ No newline at end of file
+from .config import get_or_set_customer_user_config, load_request_config, Config
\ No newline at end of file
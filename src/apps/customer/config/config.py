@@ -2,17 +2,20 @@
 Customer Config including User Permissions, Customer Configuration (Subscription etc),
 and Desired Config items
 """
-from django.core.cache import cache
 from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
 
 from apps.customer.models import Customer
+from utils.yahp.local_cache import TWO_TIER_CACHE
 
 from typing import Dict, Tuple
 
 User = get_user_model()
 
+CONFIG_CACHE_DURATION = 86400
 
-def get_or_set_customer_user_config(customer_id: str, user_id: str) -> Tuple[Dict, Dict]:    
+
+def get_or_set_customer_user_config(customer_id: str, user_id: str, user: User = None) -> Tuple[Dict, Dict]:
     """
     Cache to Get or Set User and Customer Config
 
@@ -22,6 +25,9 @@ def get_or_set_customer_user_config(customer_id: str, user_id: str) -> Tuple[Dic
             Customer ID
         user_id int
             User ID
+        user User
+            Loaded user of `user_id`, e.g. `request.user`, skips the user query
+            on a miss. Its customer is loaded (and kept) on a customer miss
     Returns
     -----------
         customer_config dict
@@ -29,34 +35,73 @@ def get_or_set_customer_user_config(customer_id: str, user_id: str) -> Tuple[Dic
         user_config dict
             User Config Object
     """
-    # Get Customer Config
+    # Get Customer and User Config
     customer_cache_key = f"customer_config:{customer_id}"
-    customer_config = cache.get(customer_cache_key, None)
+    user_cache_key = f"user_config:{user_id}"
+    configs = TWO_TIER_CACHE.get_many([customer_cache_key, user_cache_key])
+    customer_config = configs.get(customer_cache_key, None)
+    user_config = configs.get(user_cache_key, None)
+    if customer_config is not None and user_config is not None:
+        return customer_config, user_config
+
+    # Fill misses from the loaded user or with one joined query
+    if user is not None and str(user.pk) == str(user_id):
+        user_obj = user
+    else:
+        user_obj = User.objects.select_related('customer').get(pk=user_id)
+    if str(user_obj.customer_id) != str(customer_id):
+        raise Customer.DoesNotExist(f"User `{user_id}` is not a user of customer `{customer_id}`")
+
+    missing = {}
     if customer_config is None:
-        customer_obj = Customer.objects.get(pk=customer_id)
+        customer_obj = user_obj.customer
         customer_config = {
             'trial': customer_obj.trail_account,
             'active': customer_obj.integration_payment_active and customer_obj.has_active_subscription,
             'integration_key': customer_obj.get_or_create_integration_key()
         }
-        ## Set Customer Config
-        cache.set(customer_cache_key, customer_config, 86400)
-
-    # Get User Config
-    user_cache_key = f"user_config:{user_id}"
-    user_config = cache.get(user_cache_key, None)
+        missing[customer_cache_key] = customer_config
     if user_config is None:
-        user_obj = User.objects.get(pk=user_id)
         user_config = {
             'customer_staff': user_obj.customer_staff,
             'customer_admin': user_obj.customer_admin,
         }
-        ## Set Customer Config
-        cache.set(user_cache_key, user_config, 86400)
+        missing[user_cache_key] = user_config
 
+    ## Set Customer and User Config
+    TWO_TIER_CACHE.set_many(missing, CONFIG_CACHE_DURATION)
     return customer_config, user_config
 
 
+def load_request_config(request) -> 'Config':
+    """
+    Attach the customer and app config of an authenticated user to the request,
+    memoized on the underlying Django request so the middleware and the API
+    view share a single load. Works with Django and Rest Framework requests.
+
+    The config is built from `request.user`, `request.customer` is the user's
+    customer loaded on first access (already loaded by a config cache miss).
+    """
+    http_request = getattr(request, '_request', request)
+    app_config = getattr(http_request, 'app_config', None)
+    if app_config is None:
+        customer_config, user_config = get_or_set_customer_user_config(
+            customer_id=request.user.customer_id,
+            user_id=request.user.id,
+            user=request.user
+        )
+        app_config = Config(
+            customer_config=customer_config, user_config=user_config
+        )
+        user = request.user
+        http_request.customer = SimpleLazyObject(lambda: user.customer)
+        http_request.app_config = app_config
+
+    request.customer = http_request.customer
+    request.app_config = app_config
+    return app_config
+
+
 class Config(object):
     def __init__(self, customer_config, user_config):
         self._customer_config = customer_config
@@ -0,0 +1,72 @@
+"""
+Benchmark per cell date parsing against column level format inference.
+
+Example usage:
+
+    manage.py benchmark_date_parsing --rows 500000 --format %m%d%y
+"""
+from django.core.management.base import BaseCommand
+
+from utils.yahp.parser import clear_date_format_cache, parse_date, parse_date_series
+
+import numpy as np
+import pandas as pd
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per cell parse_date against parse_date_series format inference'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', dest='rows', type=int, default=100000,
+            help='Number of rows in the generated column.',
+        )
+        parser.add_argument(
+            '--format', dest='format', type=str, default='%m%d%y',
+            help='strftime format of the generated column.',
+        )
+        parser.add_argument(
+            '--outlier-rate', dest='outlier_rate', type=float, default=0.01,
+            help='Share of rows written in a different (ISO) format.',
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = np.random.default_rng(seed=0)
+
+        # Generate column of dates with a share of outliers in another format
+        dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(
+            rng.integers(0, 365 * 10, size=rows), unit='D'
+        )
+        values = pd.Series(dates.strftime(options['format']))
+        outliers = rng.random(rows) < options['outlier_rate']
+        values[outliers] = pd.Series(dates.strftime('%Y-%m-%d'))[outliers]
+        # Drop leading zeros like spreadsheet exports (072121 -> 72121)
+        values = values.str.lstrip('0')
+
+        start = time.perf_counter()
+        per_cell = [parse_date(x) for x in values]
+        per_cell_runtime = time.perf_counter() - start
+
+        clear_date_format_cache()
+        start = time.perf_counter()
+        series, fallback_count = parse_date_series(values, cache_key='benchmark')
+        series_runtime = time.perf_counter() - start
+
+        # Second run uses the memoized format
+        start = time.perf_counter()
+        parse_date_series(values, cache_key='benchmark')
+        cached_runtime = time.perf_counter() - start
+        clear_date_format_cache('benchmark')
+
+        mismatches = sum(a != b for a, b in zip(per_cell, series))
+        self.stdout.write(
+            f'rows={rows} format={options["format"]} outliers={int(outliers.sum())}\n'
+            f'per_cell runtime={per_cell_runtime:.4f}s\n'
+            f'series runtime={series_runtime:.4f}s '
+            f'speedup={per_cell_runtime / series_runtime:.1f}x fallback_count={fallback_count}\n'
+            f'series (memoized format) runtime={cached_runtime:.4f}s '
+            f'speedup={per_cell_runtime / cached_runtime:.1f}x\n'
+            f'mismatches={mismatches}\n'
+        )
@@ -0,0 +1,95 @@
+"""
+Benchmark task envelope encode/decode cost and bytes on the wire per codec.
+
+Example usage:
+
+    manage.py benchmark_queue_codec --iterations 2000 --rows 200
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from utils.queue_codec import COMPRESSORS, SERIALIZERS, MessageCodec
+
+from decimal import Decimal
+import json
+import time
+from uuid import uuid4
+
+
+class Command(BaseCommand):
+    help = 'Benchmark queue message codecs, encode/decode runtime and message size'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', dest='iterations', type=int, default=2000,
+            help='Number of encode/decode round trips per codec.',
+        )
+        parser.add_argument(
+            '--rows', dest='rows', type=int, default=200,
+            help='Number of records in the sample task params.',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        envelope = {
+            "task": "benchmark",
+            "params": {
+                "customer_id": uuid4(),
+                "records": [
+                    {
+                        "id": uuid4(),
+                        "observation_datetime": timezone.now(),
+                        "unit_type": "<>",
+                        "units": i,
+                        "amount": Decimal('10.25'),
+                        "description": f"Benchmark record {i}",
+                    }
+                    for i in range(options['rows'])
+                ]
+            }
+        }
+
+        # Previous envelope, json.dumps with DjangoJSONEncoder
+        encode_runtime, decode_runtime = 0, 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            body = json.dumps(envelope, cls=DjangoJSONEncoder).encode('utf-8')
+            encode_runtime += time.perf_counter() - start
+
+            start = time.perf_counter()
+            json.loads(body)
+            decode_runtime += time.perf_counter() - start
+        self._report('legacy_json', len(body), iterations, encode_runtime, decode_runtime)
+
+        for serializer in SERIALIZERS.keys():
+            for compression in [None, *COMPRESSORS.keys()]:
+                try:
+                    codec = MessageCodec(
+                        serializer=serializer, compression=compression, compression_threshold=0
+                    )
+                except ImproperlyConfigured as e:
+                    self.stdout.write(f'{serializer}+{compression}: skipped ({e})\n')
+                    continue
+
+                encode_runtime, decode_runtime = 0, 0
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    body, content_type, content_encoding = codec.encode(envelope)
+                    encode_runtime += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    codec.decode(body, content_type=content_type, content_encoding=content_encoding)
+                    decode_runtime += time.perf_counter() - start
+
+                self._report(
+                    f'{serializer}+{compression}', len(body), iterations, encode_runtime, decode_runtime
+                )
+
+    def _report(self, name: str, size: int, iterations: int, encode_runtime: float, decode_runtime: float):
+        self.stdout.write(
+            f'{name}: bytes={size} '
+            f'encode={encode_runtime / iterations * 1e6:.1f}us '
+            f'decode={decode_runtime / iterations * 1e6:.1f}us\n'
+        )
@@ -0,0 +1,77 @@
+"""
+Benchmark publish throughput of a connection per message against the pooled
+publisher, run against a local RabbitMQ (docker-compose `rabbitmq` service).
+
+Example usage:
+
+    manage.py benchmark_queue_publish --messages 2000 --threads 4
+"""
+from django.core.management.base import BaseCommand
+
+from utils.queue import QueueConnection
+
+from concurrent.futures import ThreadPoolExecutor
+import pika
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark RabbitMQ publish throughput, connection per message vs pooled publisher'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages', dest='messages', type=int, default=2000,
+            help='Number of messages published per run.',
+        )
+        parser.add_argument(
+            '--threads', dest='threads', type=int, default=4,
+            help='Number of publishing threads for the concurrent pooled run.',
+        )
+        parser.add_argument(
+            '--queue', dest='queue', type=str, default='benchmark_publish',
+            help='Queue published to, purged and deleted after the run.',
+        )
+
+    def _report(self, name: str, messages: int, runtime: float):
+        self.stdout.write(
+            f'{name}: messages={messages} runtime={runtime:.4f}s '
+            f'rate={messages / runtime:.0f} msg/s\n'
+        )
+
+    def handle(self, *args, **options):
+        messages = options['messages']
+        queue = options['queue']
+        body = '{"task": "benchmark", "params": {}}'
+        connection = QueueConnection(queues=[])
+
+        # Connection per message (previous behaviour)
+        start = time.perf_counter()
+        for _ in range(messages):
+            legacy_connection = pika.BlockingConnection(connection._get_connection_params())
+            channel = legacy_connection.channel()
+            channel.queue_declare(queue=queue, durable=True)
+            channel.basic_publish(
+                exchange='', routing_key=queue, body=body,
+                properties=pika.BasicProperties(delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE)
+            )
+            legacy_connection.close()
+        self._report('connection_per_message', messages, time.perf_counter() - start)
+
+        # Pooled publisher, single thread
+        start = time.perf_counter()
+        for _ in range(messages):
+            connection._send_message(queue=queue, message=body)
+        self._report('pooled', messages, time.perf_counter() - start)
+
+        # Pooled publisher, concurrent threads
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(
+                lambda _: connection._send_message(queue=queue, message=body), range(messages)
+            ))
+        self._report(f'pooled_threads={options["threads"]}', messages, time.perf_counter() - start)
+
+        # Clean up benchmark queue
+        with connection.publisher_pool.channel() as publisher:
+            publisher.channel.queue_delete(queue=queue)
+        connection.publisher_pool.close()
@@ -0,0 +1,43 @@
+"""
+Background consumer running queued tasks with the handlers registered in
+`settings.RABBITMQ_TASKS`, e.g. `refresh_pagination_count`.
+
+Example usage:
+
+    manage.py consume_tasks --queue default --workers 4
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.queue import QUEUE_CONNECTION, run_task
+
+import os
+
+
+class Command(BaseCommand):
+    help = 'Consume task messages with a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue', dest='queue', type=str, default='default',
+            help='Queue to consume.',
+        )
+        parser.add_argument(
+            '--workers', dest='workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes, defaults to the number of CPUs.',
+        )
+        parser.add_argument(
+            '--prefetch-count', dest='prefetch_count', type=int, default=None,
+            help='Max unacknowledged messages, defaults to twice the number of workers.',
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        QUEUE_CONNECTION.consume(
+            run_task,
+            queue=kwargs['queue'],
+            prefetch_count=kwargs['prefetch_count'],
+            workers=kwargs['workers'],
+            worker_type='process',
+            decode=True,
+        )
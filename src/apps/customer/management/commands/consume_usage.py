@@ -0,0 +1,40 @@
+"""
+Background consumer flushing the buffered CustomerUsage events to `cust_usage`.
+
+Example usage:
+
+    manage.py consume_usage --interval 5
+"""
+from django.core.management.base import BaseCommand
+
+from apps.customer.app.command.record_usage import USAGE_FLUSH_BATCH_SIZE, flush_usage
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered CustomerUsage events with batched bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', dest='interval', type=float, default=5,
+            help='Seconds between flushes.',
+        )
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=USAGE_FLUSH_BATCH_SIZE,
+            help='Coalesced rows written per transaction.',
+        )
+        parser.add_argument(
+            '--once', dest='once', action='store_true',
+            help='Flush once and exit.',
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            start = time.monotonic()
+            count = flush_usage(batch_size=kwargs['batch_size'])
+            if count:
+                self.stdout.write(f'Flushed {count} usage rows in {time.monotonic() - start:.3f}s\n')
+            if kwargs['once']:
+                return
+            time.sleep(max(kwargs['interval'] - (time.monotonic() - start), 0))
@@ -0,0 +1,97 @@
+"""
+Pre-create future monthly `cust_usage` partitions and detach, archive or drop
+partitions past the retention window. Run daily when `cust_usage` is partitioned.
+
+`--partition` converts `cust_usage` to monthly partitions on `observation_datetime`
+(PostgreSQL), rewriting the table in one transaction, `--unpartition` reverts it.
+
+Example usage:
+
+    manage.py manage_usage_partitions --partition
+    manage.py manage_usage_partitions --ahead 3 --retain 24 --archive-schema archive
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.customer.models import CustomerUsage
+from utils.yahp.datetime import beginning_of_month
+from utils.yahp.partitions import (
+    create_month_partition, is_partitioned, list_month_partitions, month_range, partition_table,
+    unpartition_table
+)
+
+from dateutil.relativedelta import relativedelta
+
+
+class Command(BaseCommand):
+    help = 'Create future monthly cust_usage partitions and detach, archive or drop expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partition', dest='partition', action='store_true',
+            help='Convert cust_usage to monthly partitions before managing them.',
+        )
+        parser.add_argument(
+            '--unpartition', dest='unpartition', action='store_true',
+            help='Convert cust_usage back to a plain table and exit.',
+        )
+        parser.add_argument(
+            '--ahead', dest='ahead', type=int, default=3,
+            help='Months of partitions created ahead of the current month.',
+        )
+        parser.add_argument(
+            '--retain', dest='retain', type=int, default=None,
+            help='Months of partitions kept attached, older partitions are detached. Defaults to keep all.',
+        )
+        parser.add_argument(
+            '--archive-schema', dest='archive_schema', type=str, default=None,
+            help='Schema detached partitions are moved to.',
+        )
+        parser.add_argument(
+            '--drop', dest='drop', action='store_true',
+            help='Drop detached partitions instead of keeping them.',
+        )
+
+    def handle(self, *args, **kwargs):
+        table = CustomerUsage._meta.db_table
+        current_month = beginning_of_month(timezone.localdate())
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if kwargs['unpartition']:
+                if is_partitioned(cursor, table):
+                    unpartition_table(cursor, table)
+                    self.stdout.write(f'Unpartitioned {table}\n')
+                return
+            if kwargs['partition'] and not is_partitioned(cursor, table):
+                partition_table(cursor, table, 'observation_datetime', ahead=kwargs['ahead'])
+                self.stdout.write(f'Partitioned {table}\n')
+            if not is_partitioned(cursor, table):
+                raise CommandError(f'`{table}` is not partitioned, run with --partition')
+
+            partitions = list_month_partitions(cursor, table)
+            for month in month_range(current_month, current_month + relativedelta(months=kwargs['ahead'])):
+                if month not in partitions:
+                    self.stdout.write(f'Created partition {create_month_partition(cursor, table, month)}\n')
+
+            if kwargs['retain'] is None:
+                return
+            if kwargs['archive_schema']:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {kwargs['archive_schema']}")
+
+            cutoff = current_month - relativedelta(months=kwargs['retain'])
+            for month, name in sorted(partitions.items()):
+                if month >= cutoff:
+                    continue
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                if kwargs['drop']:
+                    cursor.execute(f"DROP TABLE {name}")
+                    self.stdout.write(f'Dropped partition {name}\n')
+                elif kwargs['archive_schema']:
+                    cursor.execute(f"ALTER TABLE {name} SET SCHEMA {kwargs['archive_schema']}")
+                    self.stdout.write(f"Archived partition {name} to {kwargs['archive_schema']}\n")
+                else:
+                    self.stdout.write(f'Detached partition {name}\n')
@@ -0,0 +1,38 @@
+"""
+Bulk onboard customers and users from a CSV/JSON/Excel file, one row per user.
+See `apps.customer.app.command.onboard_customers` for the columns.
+
+Example usage:
+
+    manage.py onboard_customers customers.csv --batch-size 1000
+"""
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from apps.customer.app.command.onboard_customers import ONBOARD_BATCH_SIZE, onboard_customers
+
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Bulk onboard customers, users and auth tokens from a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str)
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=ONBOARD_BATCH_SIZE,
+            help='Rows per bulk insert.',
+        )
+
+    def handle(self, *args, **kwargs):
+        start = time.monotonic()
+        with open(kwargs['path'], 'rb') as f:
+            result = onboard_customers(
+                File(f, name=os.path.basename(kwargs['path'])), batch_size=kwargs['batch_size']
+            )
+        self.stdout.write(
+            f'Onboarded customers: created={result.customers_created} existing={result.customers_existing} | '
+            f'users: created={result.users_created} existing={result.users_existing} | '
+            f'runtime={time.monotonic() - start:.2f}s\n'
+        )
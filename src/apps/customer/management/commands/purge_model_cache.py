@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from utils.yahp.cache import purge_model_cache
+
+
+class Command(BaseCommand):
+    help = 'Purge CachedSerializer keys with an incremental SCAN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_name', type=str, nargs='?', default=None)
+        parser.add_argument('--id', dest='id', type=str, default=None)
+
+    def handle(self, *args, **kwargs):
+        model_name = kwargs['model_name']
+        result = purge_model_cache(model_name=model_name, id=kwargs['id'])
+        self.stdout.write(f'Purged cached objects for model: `{model_name or "*"}` | result: {result}\n')
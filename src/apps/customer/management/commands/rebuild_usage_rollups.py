@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.customer.app.command.rollup_usage import rebuild_usage_rollups
+from utils.yahp.datetime import date_to_tz_datetime
+
+from datetime import date
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly, daily and monthly CustomerUsage rollups from `cust_usage`'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start', dest='start', type=date.fromisoformat, default=None,
+            help='First month to rebuild, YYYY-MM-DD. Defaults to all usage.',
+        )
+        parser.add_argument(
+            '--end', dest='end', type=date.fromisoformat, default=None,
+            help='Last month to rebuild, YYYY-MM-DD. Defaults to all usage.',
+        )
+
+    def handle(self, *args, **kwargs):
+        start = date_to_tz_datetime(kwargs['start']) if kwargs['start'] else None
+        end = date_to_tz_datetime(kwargs['end']) if kwargs['end'] else None
+        rebuild_usage_rollups(start=start, end=end)
+        self.stdout.write(f'Rebuilt usage rollups: {kwargs["start"] or "*"} - {kwargs["end"] or "*"}\n')
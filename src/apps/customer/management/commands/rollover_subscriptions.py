@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.customer.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Refresh active subscription snapshots of customers whose active/deactive date boundary passed, run daily'
+
+    def handle(self, *args, **kwargs):
+        customers = Customer.objects.filter(active_subscription_refresh_date__lte=timezone.localdate())
+        count = 0
+        for customer in customers.iterator():
+            customer.refresh_active_subscription()
+            count += 1
+        self.stdout.write(f'Rolled over subscriptions for {count} customers\n')
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def backfill_active_subscription(apps, schema_editor):
+    Customer = apps.get_model('customer', 'Customer')
+    CustomerSubscription = apps.get_model('customer', 'CustomerSubscription')
+
+    today = timezone.localdate()
+    snapshots = {}
+    for subscription in CustomerSubscription.objects.order_by('pk').iterator():
+        active_subscription, boundaries = snapshots.setdefault(subscription.customer_id, [None, []])
+        active_on = timezone.localdate(subscription.active_date) if subscription.active_date else None
+        deactive_on = timezone.localdate(subscription.deactive_date) if subscription.deactive_date else None
+        if (
+            active_subscription is None and active_on is not None and active_on <= today
+            and (deactive_on is None or deactive_on > today)
+        ):
+            snapshots[subscription.customer_id][0] = subscription.pk
+        boundaries += [date for date in (active_on, deactive_on) if date is not None and date > today]
+
+    for customer_id, (active_subscription_id, boundaries) in snapshots.items():
+        Customer.objects.filter(pk=customer_id).update(
+            active_customer_subscription_id=active_subscription_id,
+            active_subscription_refresh_date=min(boundaries, default=None)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='active_customer_subscription',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='customer.customersubscription'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='active_subscription_refresh_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_active_subscription, migrations.RunPython.noop),
+    ]
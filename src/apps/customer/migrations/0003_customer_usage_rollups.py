@@ -0,0 +1,67 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0002_customer_active_subscription_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerUsageHourly',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('unit_type', models.CharField(choices=[('<>', 'Usage Unit')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('units', models.BigIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='customer.customer')),
+            ],
+            options={
+                'verbose_name': 'Customer Usage Hourly',
+                'verbose_name_plural': 'Customers Usage Hourly',
+                'db_table': 'cust_usage_hourly',
+                'ordering': ('period_start',),
+                'abstract': False,
+                'unique_together': {('customer', 'unit_type', 'period_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerUsageDaily',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('unit_type', models.CharField(choices=[('<>', 'Usage Unit')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('units', models.BigIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='customer.customer')),
+            ],
+            options={
+                'verbose_name': 'Customer Usage Daily',
+                'verbose_name_plural': 'Customers Usage Daily',
+                'db_table': 'cust_usage_daily',
+                'ordering': ('period_start',),
+                'abstract': False,
+                'unique_together': {('customer', 'unit_type', 'period_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerUsageMonthly',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('unit_type', models.CharField(choices=[('<>', 'Usage Unit')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('units', models.BigIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='customer.customer')),
+            ],
+            options={
+                'verbose_name': 'Customer Usage Monthly',
+                'verbose_name_plural': 'Customers Usage Monthly',
+                'db_table': 'cust_usage_monthly',
+                'ordering': ('period_start',),
+                'abstract': False,
+                'unique_together': {('customer', 'unit_type', 'period_start')},
+            },
+        ),
+    ]
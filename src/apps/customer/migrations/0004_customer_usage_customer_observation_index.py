@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0003_customer_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerusage',
+            index=models.Index(fields=['customer', 'observation_datetime'], name='cust_usage_customer_obs_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0004_customer_usage_customer_observation_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerUsageFlush',
+            fields=[
+                ('id', models.CharField(editable=False, max_length=32, primary_key=True, serialize=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Customer Usage Flush',
+                'verbose_name_plural': 'Customers Usage Flushes',
+                'db_table': 'cust_usage_flush',
+                'ordering': ('created_on',),
+            },
+        ),
+    ]
@@ -1,10 +1,8 @@
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
 from django.db import models
-from django.db.models import Q
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
@@ -12,6 +10,7 @@ from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 from services.customer import CustomerIntegration
+from utils.yahp.local_cache import TWO_TIER_CACHE
 
 
 CUSTOMER_INTEGRATION_OPTIONS = (
@@ -39,6 +38,12 @@ class Customer(models.Model):
 	integration_payment_active = models.BooleanField(default=False) # Customer has active integration payment method
 
 	demo_account = models.BooleanField(default=False) # Internal Demo Account
+
+	# Active Subscription Snapshot, maintained by CustomerSubscription signals and `rollover_subscriptions`
+	active_customer_subscription = models.ForeignKey(
+		'CustomerSubscription', on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+	)
+	active_subscription_refresh_date = models.DateField(blank=True, null=True) # Next active/deactive date boundary
 	
 	created_on = models.DateTimeField(auto_now_add=True)
 	updated_on = models.DateTimeField(auto_now=True)
@@ -49,6 +54,18 @@ class Customer(models.Model):
 		verbose_name_plural = 'Customers'
 		ordering = ('pk',)
 
+	# Written only by `refresh_active_subscription`
+	ACTIVE_SUBSCRIPTION_FIELDS = ('active_customer_subscription', 'active_subscription_refresh_date')
+
+	def save(self, *args, **kwargs):
+		# A full save of a stale instance must not overwrite the snapshot
+		if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+			kwargs['update_fields'] = [
+				field.name for field in self._meta.concrete_fields
+				if not field.primary_key and field.name not in self.ACTIVE_SUBSCRIPTION_FIELDS
+			]
+		super().save(*args, **kwargs)
+
 	def get_or_create_integration_key(self) -> str:
 		if self.integration_key is not None:
 			return self.integration_key
@@ -61,12 +78,45 @@ class Customer(models.Model):
 		# return integration.create_customer()
 		return 'key'
 		
+	def refresh_active_subscription(self, commit: bool = True):
+		"""
+		Refresh the active subscription snapshot and the next date boundary it
+		changes at, a subscription is active from its active date until its
+		deactive date (local dates)
+		"""
+		today = timezone.localdate()
+		active_subscription = None
+		boundaries = []
+		for subscription in self.subscriptions.order_by('pk'):
+			active_on = timezone.localdate(subscription.active_date) if subscription.active_date else None
+			deactive_on = timezone.localdate(subscription.deactive_date) if subscription.deactive_date else None
+			if (
+				active_subscription is None and active_on is not None and active_on <= today
+				and (deactive_on is None or deactive_on > today)
+			):
+				active_subscription = subscription
+			boundaries += [date for date in (active_on, deactive_on) if date is not None and date > today]
+
+		self.active_customer_subscription = active_subscription
+		self.active_subscription_refresh_date = min(boundaries, default=None)
+		if commit:
+			Customer.objects.filter(pk=self.pk).update(
+				active_customer_subscription=active_subscription,
+				active_subscription_refresh_date=self.active_subscription_refresh_date
+			)
+			TWO_TIER_CACHE.delete(f'customer_config:{self.pk}')
+		return active_subscription
+
+	def _check_active_subscription(self):
+		# Lazy rollover when a date boundary passed before the scheduled rollover
+		refresh_date = self.active_subscription_refresh_date
+		if refresh_date is not None and refresh_date <= timezone.localdate():
+			self.refresh_active_subscription()
+
 	@property
 	def _active_subscription(self):
-		return self.subscriptions.filter(
-			Q(Q(deactive_date=None) | Q(deactive_date__date__gt=timezone.now().date())),
-			active_date__date__lte=timezone.now().date(),
-		).first()
+		self._check_active_subscription()
+		return self.active_customer_subscription
 
 	@property
 	def active_subscription(self):
@@ -82,7 +132,8 @@ class Customer(models.Model):
 	
 	@property
 	def has_active_subscription(self):
-		return self._active_subscription is not None
+		self._check_active_subscription()
+		return self.active_customer_subscription_id is not None
 
 	def __str__(self):
 		return str(self.name)
@@ -90,12 +141,12 @@ class Customer(models.Model):
 
 @receiver(post_save, sender=Customer)
 def customer_post_save_handler(sender, instance, **kwargs):
-	cache.delete(f'customer_config:{instance.pk}')
+	TWO_TIER_CACHE.delete(f'customer_config:{instance.pk}')
 
 
 @receiver(post_delete, sender=Customer)
 def customer_post_delete_handler(sender, instance, **kwargs):
-	cache.delete(f'customer_config:{instance.pk}')
+	TWO_TIER_CACHE.delete(f'customer_config:{instance.pk}')
 
 
 # User Manager
@@ -326,12 +377,12 @@ class CustomerSubscription(models.Model):
 
 @receiver(post_save, sender=CustomerSubscription)
 def customer_subscription_post_save_handler(sender, instance, **kwargs):
-	cache.delete(f'customer_config:{instance.customer_id}')
+	Customer(pk=instance.customer_id).refresh_active_subscription()
 
 
 @receiver(post_delete, sender=CustomerSubscription)
 def customer_subscription_post_delete_handler(sender, instance, **kwargs):
-	cache.delete(f'customer_config:{instance.customer_id}')
+	Customer(pk=instance.customer_id).refresh_active_subscription()
 
 
 class CustomerUsage(models.Model):
@@ -354,6 +405,61 @@ class CustomerUsage(models.Model):
 		verbose_name = 'Customer Usage'
 		verbose_name_plural = 'Customers Usage'
 		ordering = ('pk',)
+		indexes = [
+			models.Index(fields=['customer', 'observation_datetime'], name='cust_usage_customer_obs_idx'),
+		]
 
 	def __str__(self):
-		return f"{str(self.observation_datetime)}: {str(self.units)} ({str(self.unit_type)})"
\ No newline at end of file
+		return f"{str(self.observation_datetime)}: {str(self.units)} ({str(self.unit_type)})"
+
+class CustomerUsageRollup(models.Model):
+	"""Usage units summed per customer, unit type and period, maintained as usage is flushed"""
+	# ID Override to align with rest of structure
+	id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+	customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='+')
+	unit_type = models.CharField(max_length=10, choices=CustomerUsage.USAGE_UNIT_TYPE_OPTIONS)
+	period_start = models.DateTimeField() # Local timezone period start
+	units = models.BigIntegerField(default=0)
+
+	class Meta:
+		abstract = True
+		ordering = ('period_start',)
+
+	def __str__(self):
+		return f"{str(self.period_start)}: {str(self.units)} ({str(self.unit_type)})"
+
+
+class CustomerUsageHourly(CustomerUsageRollup):
+	class Meta(CustomerUsageRollup.Meta):
+		db_table = 'cust_usage_hourly'
+		verbose_name = 'Customer Usage Hourly'
+		verbose_name_plural = 'Customers Usage Hourly'
+		unique_together = (('customer', 'unit_type', 'period_start'),)
+
+
+class CustomerUsageDaily(CustomerUsageRollup):
+	class Meta(CustomerUsageRollup.Meta):
+		db_table = 'cust_usage_daily'
+		verbose_name = 'Customer Usage Daily'
+		verbose_name_plural = 'Customers Usage Daily'
+		unique_together = (('customer', 'unit_type', 'period_start'),)
+
+
+class CustomerUsageMonthly(CustomerUsageRollup):
+	class Meta(CustomerUsageRollup.Meta):
+		db_table = 'cust_usage_monthly'
+		verbose_name = 'Customer Usage Monthly'
+		verbose_name_plural = 'Customers Usage Monthly'
+		unique_together = (('customer', 'unit_type', 'period_start'),)
+
+
+class CustomerUsageFlush(models.Model):
+	"""Usage buffer batches written to `cust_usage`, a retried batch is only written once"""
+	id = models.CharField(primary_key=True, max_length=32, editable=False) # Flush batch id
+	created_on = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		db_table = 'cust_usage_flush'
+		verbose_name = 'Customer Usage Flush'
+		verbose_name_plural = 'Customers Usage Flushes'
+		ordering = ('created_on',)
@@ -1,3 +1,379 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from django_redis import get_redis_connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.appadmin.api import OnboardCustomers
+from apps.customer.app.command.create_customer import get_name_hash
+from apps.customer.app.command.onboard_customers import OnboardError, onboard_customers
+from apps.customer.app.command.rollup_usage import ROLLUPS, rebuild_usage_rollups
+from apps.customer.app.query.get_usage import get_monthly_usage
+from apps.customer.config import load_request_config
+
+from apps.customer.app.command.record_usage import (
+    USAGE_BATCH_KEY, USAGE_BATCHES_KEY, USAGE_BUFFER_KEY, USAGE_FLUSH_LOCK, USAGE_FLUSHING_KEY,
+    _parse_batch, _stage_batches, flush_usage, record_usage, write_usage
+)
+from utils.yahp.local_cache import TWO_TIER_CACHE
+from utils.yahp.partitions import create_month_partition, is_partitioned, list_month_partitions
+from apps.customer.models import (
+    Customer, CustomerSubscription, CustomerUsage, CustomerUsageFlush, Subscription, User
+)
+
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import io
+import importlib
+import os
+from unittest import mock
+
+# The command package re-exports the `record_usage` function over the module name
+usage_command = importlib.import_module('apps.customer.app.command.record_usage')
+
+
+class FlushUsageTests(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection('default')
+        self.redis.flushdb()
+        self.customer = Customer.objects.create(
+            name='Usage', name_hash='cust_usage', customer_primary_email='usage@example.com'
+        )
+        self.minute = datetime(2024, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+
+    def record(self, units, minute=0):
+        record_usage(
+            str(self.customer.pk), '<>', units=units,
+            observation_datetime=self.minute.replace(minute=minute)
+        )
+
+    def units(self):
+        return dict(CustomerUsage.objects.values_list('observation_datetime__minute', 'units'))
+
+    def assertBufferEmpty(self):
+        for key in (USAGE_BUFFER_KEY, USAGE_FLUSHING_KEY, USAGE_BATCHES_KEY):
+            self.assertFalse(self.redis.exists(cache.make_key(key)), key)
+
+    def test_flush_coalesced_usage(self):
+        self.record(2)
+        self.record(3)
+        self.record(1, minute=1)
+        self.assertEqual(flush_usage(), 2)
+        self.assertEqual(self.units(), {0: 5, 1: 1})
+        self.assertBufferEmpty()
+
+        self.record(4)
+        self.assertEqual(flush_usage(), 1)
+        self.assertEqual(self.units(), {0: 9, 1: 1})
+
+    def test_batch_written_before_crash_not_counted_twice(self):
+        self.record(5)
+        # Batch committed, process died before the staged batch was removed
+        batch_id = next(_stage_batches(self.redis, batch_size=10))
+        batch_key = cache.make_key(USAGE_BATCH_KEY.format(batch_id))
+        write_usage(_parse_batch(self.redis.hgetall(batch_key)), batch_id=batch_id)
+
+        self.record(1, minute=1)
+        self.assertEqual(flush_usage(), 1)
+        self.assertEqual(self.units(), {0: 5, 1: 1})
+        self.assertTrue(CustomerUsageFlush.objects.filter(id=batch_id).exists())
+        self.assertBufferEmpty()
+        self.assertFalse(self.redis.exists(batch_key))
+
+    def test_staged_batch_resumed(self):
+        self.record(5)
+        next(_stage_batches(self.redis, batch_size=10))
+        self.assertEqual(flush_usage(), 1)
+        self.assertEqual(self.units(), {0: 5})
+        self.assertBufferEmpty()
+
+    def test_lock_held(self):
+        lock_key = cache.make_key(USAGE_FLUSH_LOCK)
+        self.redis.set(lock_key, 'other')
+        self.record(5)
+        self.assertEqual(flush_usage(), 0)
+        self.assertEqual(self.redis.get(lock_key), b'other')
+        self.assertEqual(self.units(), {})
+
+    def test_lock_lost_keeps_other_owner_lock(self):
+        lock_key = cache.make_key(USAGE_FLUSH_LOCK)
+        self.record(1)
+        self.record(2, minute=1)
+        flush_batch = usage_command._flush_batch
+
+        def _flush_batch(*args, **kwargs):
+            # Lock expired and taken over by another consumer
+            self.redis.set(lock_key, 'other')
+            return flush_batch(*args, **kwargs)
+
+        with mock.patch.object(usage_command, '_flush_batch', side_effect=_flush_batch):
+            self.assertEqual(flush_usage(batch_size=1), 1)
+        self.assertEqual(self.redis.get(lock_key), b'other')
+        self.assertEqual(self.redis.scard(cache.make_key(USAGE_BATCHES_KEY)), 1)
+
+        self.redis.delete(lock_key)
+        self.assertEqual(flush_usage(), 1)
+        self.assertEqual(self.units(), {0: 1, 1: 2})
+
+
+class ActiveSubscriptionSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            name='Snapshot', name_hash='cust_snapshot', customer_primary_email='snapshot@example.com'
+        )
+        self.subscription = Subscription.objects.create(code='pro', name='Pro')
+
+    def subscribe(self, **kwargs):
+        return CustomerSubscription.objects.create(
+            customer=self.customer, subscription=self.subscription, **kwargs
+        )
+
+    def test_snapshot_refreshed_by_subscription_signals(self):
+        customer_subscription = self.subscribe(active_date=timezone.now() - timedelta(days=1))
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual(customer.active_customer_subscription_id, customer_subscription.pk)
+        self.assertTrue(customer.has_active_subscription)
+
+    def test_full_save_keeps_snapshot(self):
+        stale = Customer.objects.get(pk=self.customer.pk)
+        customer_subscription = self.subscribe(
+            active_date=timezone.now() - timedelta(days=1), deactive_date=timezone.now() + timedelta(days=30)
+        )
+
+        stale.name = 'Snapshot Renamed'
+        stale.save()
+        customer = Customer.objects.get(pk=self.customer.pk)
+        self.assertEqual(customer.name, 'Snapshot Renamed')
+        self.assertEqual(customer.active_customer_subscription_id, customer_subscription.pk)
+        self.assertEqual(
+            customer.active_subscription_refresh_date, timezone.localdate(customer_subscription.deactive_date)
+        )
+
+
+class UsagePartitionTests(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            name='Partition', name_hash='cust_partition', customer_primary_email='partition@example.com'
+        )
+        self.usage(datetime(2020, 1, 15, tzinfo=dt_timezone.utc), 1)
+        self.usage(timezone.now(), 2)
+
+    def usage(self, observation_datetime, units):
+        CustomerUsage.objects.create(
+            customer=self.customer, unit_type='<>', units=units, observation_datetime=observation_datetime
+        )
+        # Fire the deferred foreign key checks before altering the table
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def manage(self, **kwargs):
+        call_command('manage_usage_partitions', stdout=io.StringIO(), **kwargs)
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT SUM(units) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def test_partition_and_unpartition(self):
+        self.manage(partition=True)
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor, 'cust_usage'))
+            self.assertIn(date(2020, 1, 1), list_month_partitions(cursor, 'cust_usage'))
+        self.assertEqual(self.count('cust_usage_p2020_01'), 1)
+        self.assertEqual(sorted(CustomerUsage.objects.values_list('units', flat=True)), [1, 2])
+
+        self.manage(unpartition=True)
+        with connection.cursor() as cursor:
+            self.assertFalse(is_partitioned(cursor, 'cust_usage'))
+        self.assertEqual(sorted(CustomerUsage.objects.values_list('units', flat=True)), [1, 2])
+
+    def test_month_partition_moves_default_rows(self):
+        self.manage(partition=True)
+        self.usage(datetime(2040, 1, 15, tzinfo=dt_timezone.utc), 4)
+        self.usage(datetime(2040, 2, 15, tzinfo=dt_timezone.utc), 8)
+        self.assertEqual(self.count('cust_usage_default'), 12)
+
+        with connection.cursor() as cursor:
+            create_month_partition(cursor, 'cust_usage', date(2040, 1, 1))
+        self.assertEqual(self.count('cust_usage_p2040_01'), 4)
+        self.assertEqual(self.count('cust_usage_default'), 8)
+        self.assertEqual(CustomerUsage.objects.count(), 4)
+
+    def test_not_partitioned(self):
+        with self.assertRaises(CommandError):
+            self.manage()
+
+
+class OnboardCustomersTests(TestCase):
+
+    header = 'customer_name,customer_primary_email,email\n'
+
+    def setUp(self):
+        self.existing = Customer.objects.create(
+            name='Existing', name_hash=get_name_hash('Existing'), customer_primary_email='owner@existing.com'
+        )
+
+    def file(self, rows: str):
+        return SimpleUploadedFile('customers.csv', (self.header + rows).encode())
+
+    def onboard(self, rows: str):
+        return onboard_customers(self.file(rows))
+
+    def assertRejected(self, rows: str, error_rows):
+        with self.assertRaises(OnboardError) as context:
+            self.onboard(rows)
+        self.assertEqual([row['row'] for row in context.exception.rows], error_rows)
+        self.assertEqual(Customer.objects.count(), 1)
+        self.assertEqual(User.objects.count(), 0)
+        return context.exception
+
+    def test_onboard(self):
+        result = self.onboard(
+            'Acme,ops@acme.com,a@acme.com\n'
+            'Acme,ops@acme.com,b@acme.com\n'
+            'Globex,ops@globex.com,a@globex.com\n'
+        )
+        self.assertEqual(result.customers_created, 2)
+        self.assertEqual(result.users_created, 3)
+        self.assertEqual(Customer.objects.get(name='Acme').users.count(), 2)
+        self.assertEqual(Token.objects.filter(user__customer__name='Globex').count(), 1)
+
+    def test_existing_customer_and_user_kept(self):
+        self.onboard('Existing,other@existing.com,a@existing.com\n')
+        result = self.onboard(
+            'Existing,,a@existing.com\n'
+            'Existing,,b@existing.com\n'
+        )
+        self.assertEqual((result.customers_created, result.customers_existing), (0, 1))
+        self.assertEqual((result.users_created, result.users_existing), (1, 1))
+        self.assertEqual(self.existing.users.count(), 2)
+
+    def test_missing_primary_email(self):
+        error = self.assertRejected('Acme,,a@acme.com\nGlobex, ,a@globex.com\n', [1, 2])
+        self.assertIn('required', error.rows[0]['message'])
+
+    def test_invalid_emails(self):
+        self.assertRejected('Acme,ops,a@acme.com\nGlobex,ops@globex.com,not an email\n', [1, 2])
+
+    def test_duplicate_primary_email_in_file(self):
+        self.assertRejected('Acme,ops@acme.com,a@acme.com\nGlobex,ops@acme.com,a@globex.com\n', [2])
+
+    def test_primary_email_of_existing_customer(self):
+        self.assertRejected('Acme,owner@existing.com,a@acme.com\n', [1])
+
+    def test_api_rejected_rows(self):
+        admin = User.objects.create_superuser(email='admin@example.com', password='x')
+        request = APIRequestFactory().post(
+            '/onboard_customers/', {'file': self.file('Acme,,a@acme.com\n')}, format='multipart'
+        )
+        force_authenticate(request, user=admin)
+        response = OnboardCustomers.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['rows'][0]['row'], 1)
+
+
+class RequestConfigTests(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            name='Acme', name_hash=get_name_hash('Acme'), integration_key='key'
+        )
+        self.user = User.objects.create_user(email='a@acme.com', customer_id=self.customer.pk)
+        self.cache_keys = [f'customer_config:{self.customer.pk}', f'user_config:{self.user.pk}']
+        TWO_TIER_CACHE.delete_many(self.cache_keys)
+        self.addCleanup(TWO_TIER_CACHE.delete_many, self.cache_keys)
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        return request
+
+    def test_config_miss(self):
+        request = self.request()
+        # The customer, the user is not reloaded
+        with self.assertNumQueries(1):
+            app_config = load_request_config(request)
+            self.assertEqual(request.customer, self.customer)
+        self.assertEqual(app_config.customer_integration_key, 'key')
+        self.assertFalse(app_config.user_customer_admin)
+
+    def test_config_hit(self):
+        load_request_config(self.request())
+        request = self.request()
+        with self.assertNumQueries(0):
+            app_config = load_request_config(request)
+            self.assertIs(load_request_config(request), app_config)
+        self.assertEqual(app_config.customer_integration_key, 'key')
+        # Loaded once when used
+        with self.assertNumQueries(1):
+            self.assertEqual(request.customer.pk, self.customer.pk)
+            self.assertEqual(request.customer.name, 'Acme')
+
+
+class UsageRollupTests(TestCase):
+
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.customer = Customer.objects.create(
+            name='Rollup', name_hash='cust_rollup', customer_primary_email='rollup@example.com'
+        )
+        # UTC observations around the local (America/Chicago) month boundaries
+        observations = [
+            (datetime(2024, 1, 31, 12, 0), 1),
+            (datetime(2024, 2, 1, 5, 30), 2),
+            (datetime(2024, 2, 1, 6, 30), 4),
+            (datetime(2024, 2, 29, 23, 0), 8),
+            (datetime(2024, 3, 1, 2, 0), 16),
+        ]
+        for observation, units in observations:
+            record_usage(
+                str(self.customer.pk), '<>', units=units,
+                observation_datetime=observation.replace(tzinfo=dt_timezone.utc)
+            )
+        flush_usage()
+
+    def assertRollupsMatchUsage(self):
+        for model, period_start, _ in ROLLUPS:
+            expected = {}
+            for usage in CustomerUsage.objects.all():
+                period = period_start(usage.observation_datetime)
+                expected[period] = expected.get(period, 0) + usage.units
+            rollups = {rollup.period_start: rollup.units for rollup in model.objects.all()}
+            self.assertEqual(rollups, expected, model.__name__)
+
+    def test_rollups(self):
+        self.assertRollupsMatchUsage()
+        rebuild_usage_rollups()
+        self.assertRollupsMatchUsage()
+
+    def test_monthly_usage_local_months(self):
+        # Already March in UTC, still February locally
+        now = datetime(2024, 3, 1, 3, 0, tzinfo=dt_timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            usage = get_monthly_usage(str(self.customer.pk), lookback_months=2)
+        self.assertEqual(usage, {
+            date(2023, 12, 1): {},
+            date(2024, 1, 1): {'<>': 3},
+            date(2024, 2, 1): {'<>': 28},
+        })
+
+
+class ConsumeTasksCommandTests(TestCase):
+
+    def consume(self, *args):
+        with mock.patch('apps.customer.management.commands.consume_tasks.QUEUE_CONNECTION') as queue_connection:
+            call_command('consume_tasks', *args)
+        return queue_connection.consume.call_args.kwargs
+
+    def test_workers(self):
+        self.assertEqual(self.consume()['workers'], os.cpu_count() or 1)
+        self.assertEqual(self.consume('--workers', '3')['workers'], 3)
+        with self.assertRaises(CommandError):
+            self.consume('--workers', '0')
@@ -32,6 +32,7 @@ THIRD_PARTY_APPS = [
     'corsheaders',
     'crispy_forms',
     'rest_framework',
+    'rest_framework.authtoken',
 ]
 
 INSTALLED_APPS = PREREQUISITES_APPS + PROJECT_APPS + THIRD_PARTY_APPS
@@ -169,6 +170,17 @@ CACHES = {
     }
 }
 
+# In process L1 cache in front of Redis (see utils.yahp.local_cache)
+LOCAL_CACHE_MAX_SIZE = config('LOCAL_CACHE_MAX_SIZE', cast=int, default=10000)
+LOCAL_CACHE_TTL = config('LOCAL_CACHE_TTL', cast=float, default=5)
+
+# Per customer overrides of the CustomerEventRateThrottle daily rate {customer_id: rate}
+EVENT_THROTTLE_CUSTOMER_RATES = {}
+# Throttle lease mode, counts requests in process against a budget leased from Redis
+EVENT_THROTTLE_LEASE_MODE = config('EVENT_THROTTLE_LEASE_MODE', cast=bool, default=False)
+EVENT_THROTTLE_LEASE_TOLERANCE = config('EVENT_THROTTLE_LEASE_TOLERANCE', cast=float, default=0.01) # Lease size, share of the rate
+EVENT_THROTTLE_LEASE_FLUSH_MS = config('EVENT_THROTTLE_LEASE_FLUSH_MS', cast=int, default=1000)
+
 # RabbitMQ
 RABBITMQ_HOST = config('RABBITMQ_HOST', cast=str, default='localhost')
 RABBITMQ_PORT = config('RABBITMQ_PORT', cast=int, default=5672)
@@ -176,6 +188,17 @@ RABBITMQ_VHOST = config('RABBITMQ_VHOST', cast=str, default='webhookk')
 RABBITMQ_USER = config('RABBITMQ_USER', cast=str, default='guest')
 RABBITMQ_PASS = config('RABBITMQ_PASS', cast=str, default='guest')
 RABBITMQ_QUEUES = []
+# Task handlers run by `consume_tasks`, task name to the dotted path of a `handler(params)`
+RABBITMQ_TASKS = {
+    'refresh_pagination_count': 'utils.yahp.pagination.refresh_pagination_count',
+}
+RABBITMQ_PUBLISHER_POOL_SIZE = config('RABBITMQ_PUBLISHER_POOL_SIZE', cast=int, default=10)
+# Task message codec: `json` or `msgpack`, optional `gzip` or `zstd` compression
+RABBITMQ_MESSAGE_SERIALIZER = config('RABBITMQ_MESSAGE_SERIALIZER', cast=str, default='json')
+RABBITMQ_MESSAGE_COMPRESSION = config('RABBITMQ_MESSAGE_COMPRESSION', cast=str, default='')
+RABBITMQ_MESSAGE_COMPRESSION_THRESHOLD = config(
+    'RABBITMQ_MESSAGE_COMPRESSION_THRESHOLD', cast=int, default=4096
+)
 
 # Logging
 LOGGING_FORMATTERS = {
@@ -8,7 +8,9 @@ from rest_framework.exceptions import NotFound, ParseError
 
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
-from apps.customer.config import get_or_set_customer_user_config, Config
+from apps.customer.config import load_request_config
+from utils.throttles import set_rate_limit_headers
+from utils.yahp.api.pagination import KeysetPagination
 
 import logging
 import sys
@@ -23,6 +25,13 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 1000
 
 
+class StandardResultsSetKeysetPagination(KeysetPagination):
+    """StandardResultsSetPagination page sizes without OFFSET, for large tables"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 class UserApiMixin:
     authentication_classes = [
         SessionAuthentication, TokenAuthentication, JSONWebTokenAuthentication
@@ -40,14 +49,11 @@ class UserApiMixin:
         super().initial(request, *args, **kwargs)
         # API Processing Additional Permissions per User
         if self.request.user.is_authenticated:
-            self.request.customer = self.request.user.customer
-            customer_config, user_config = get_or_set_customer_user_config(
-                customer_id=self.request.customer.id,
-                user_id=self.request.user.id
-            )
-            self.request.app_config = Config(
-                customer_config=customer_config, user_config=user_config
-            )
+            load_request_config(self.request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return set_rate_limit_headers(request, response)
 
     def handle_invalid_request(self, message, error_code):
         raise ParseError(detail={'message': message, 'code': error_code})
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Asyncio queue client sharing the `RABBITMQ_*` settings and task message format
+of `utils.queue`, for async views and service code.
+
+    await publish_task(task='task_name', params={...})
+"""
+from django.conf import settings
+
+from utils.queue import MAX_FAIL, RECONNECT_BACKOFF_BASE, RECONNECT_BACKOFF_MAX
+from utils.queue_codec import DEFAULT_CODEC, MessageCodec
+
+import aio_pika
+from aio_pika.pool import Pool
+import asyncio
+import logging
+import signal
+from typing import Union
+
+logger = logging.getLogger('service')
+
+# Connections and channels per event loop
+ASYNC_CONNECTION_POOL_SIZE = 2
+ASYNC_CHANNEL_POOL_SIZE = 20
+
+
+class AsyncQueueConnection(object):
+    """
+    Non blocking RabbitMQ connection with pooled robust (auto reconnecting)
+    connections and publisher confirm channels. Pools are bound to the running
+    event loop and re-created when used from a new loop.
+    """
+
+    def __init__(self,
+                 queues: list = settings.RABBITMQ_QUEUES,
+                 channel_pool_size: int = ASYNC_CHANNEL_POOL_SIZE,
+                 codec: MessageCodec = DEFAULT_CODEC):
+        self.host = settings.RABBITMQ_HOST
+        self.port = settings.RABBITMQ_PORT
+        self.virtual_host = settings.RABBITMQ_VHOST
+        self.user = settings.RABBITMQ_USER
+        self.password = settings.RABBITMQ_PASS
+        self.queues = queues
+        self.channel_pool_size = channel_pool_size
+        self.codec = codec
+        self.declared_queues = set()
+        self._loop = None
+        self._connection_pool = None
+        self._channel_pool = None
+
+    async def _get_connection(self) -> aio_pika.abc.AbstractRobustConnection:
+        logger.info(
+            f'Establishing async connection with RabbitMQ host: {self.host}:{self.port}',
+            extra={'task': 'AsyncQueueConnection'}
+        )
+        return await aio_pika.connect_robust(
+            host=self.host, port=self.port, virtualhost=self.virtual_host,
+            login=self.user, password=self.password
+        )
+
+    async def _get_channel(self) -> aio_pika.abc.AbstractChannel:
+        async with self.connection_pool.acquire() as connection:
+            return await connection.channel(publisher_confirms=True)
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.declared_queues = set()
+            self._connection_pool = Pool(self._get_connection, max_size=ASYNC_CONNECTION_POOL_SIZE)
+            self._channel_pool = Pool(self._get_channel, max_size=self.channel_pool_size)
+
+    @property
+    def connection_pool(self) -> Pool:
+        self._check_loop()
+        return self._connection_pool
+
+    @property
+    def channel_pool(self) -> Pool:
+        self._check_loop()
+        return self._channel_pool
+
+    async def _declare_queue(self, channel: aio_pika.abc.AbstractChannel, queue: str):
+        if queue not in self.declared_queues:
+            await channel.declare_queue(queue, durable=True)
+            self.declared_queues.add(queue)
+
+    def encode_task(self, task: str, params: dict) -> aio_pika.Message:
+        """Encode a task envelope with the codec advertised in the message properties"""
+        body, content_type, content_encoding = self.codec.encode({"task": task, "params": params})
+        return aio_pika.Message(
+            body=body,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+        )
+
+    async def _send_message(self, queue: str, message: aio_pika.Message):
+        async with self.channel_pool.acquire() as channel:
+            await self._declare_queue(channel=channel, queue=queue)
+            # Awaits the publisher confirm, concurrent publishes are pipelined
+            await channel.default_exchange.publish(message, routing_key=queue)
+
+    async def publish(self, queue: str, message: Union[str, bytes, aio_pika.Message]) -> bool:
+        if not isinstance(message, aio_pika.Message):
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+            message = aio_pika.Message(body=message, delivery_mode=aio_pika.DeliveryMode.PERSISTENT)
+
+        fail_count = 0
+        while True:
+            try:
+                await self._send_message(queue=queue, message=message)
+                logger.info(
+                    f'Queue=`{queue}` Submitted message: {len(message.body)} bytes',
+                    extra={'task': 'AsyncQueueConnection'}
+                )
+                return True
+            except Exception:
+                logger.error(
+                    'Failed to publish message', exc_info=True,
+                    extra={'task': 'AsyncQueueConnection'}
+                )
+                if fail_count >= MAX_FAIL:
+                    raise
+                fail_count += 1
+                await asyncio.sleep(min(RECONNECT_BACKOFF_BASE * 2 ** fail_count, RECONNECT_BACKOFF_MAX))
+
+    async def consume(self, callback, queue: str = 'default', prefetch_count: int = 1, decode: bool = False):
+        """
+        Consume messages until cancelled or SIGTERM, in flight messages are
+        drained before the channel closes
+
+        callback coroutine function
+            `await callback(message)` with an `aio_pika.IncomingMessage`, up to
+            `prefetch_count` callbacks run concurrently. Use `message.ack()` or
+            `async with message.process()` to acknowledge. Unacknowledged
+            messages of failed callbacks are rejected without requeue.
+        decode bool
+            Call `await callback(message, envelope)` with the decoded task envelope
+        """
+        connection = await self._get_connection()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Signal handlers are only supported on the main thread unix loops
+            pass
+
+        in_flight = 0
+        idle = asyncio.Event()
+        idle.set()
+
+        async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+            nonlocal in_flight
+            in_flight += 1
+            idle.clear()
+            try:
+                if decode:
+                    await callback(message, MessageCodec.decode(
+                        message.body, content_type=message.content_type,
+                        content_encoding=message.content_encoding
+                    ))
+                else:
+                    await callback(message)
+            except Exception:
+                logger.error(
+                    f'Queue=`{queue}` Failed to process message', exc_info=True,
+                    extra={'task': 'AsyncQueueConnection'}
+                )
+                if not message.processed:
+                    try:
+                        await message.reject(requeue=False)
+                    except Exception:
+                        logger.error(
+                            f'Queue=`{queue}` Failed to reject message', exc_info=True,
+                            extra={'task': 'AsyncQueueConnection'}
+                        )
+            finally:
+                in_flight -= 1
+                if in_flight == 0:
+                    idle.set()
+
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=prefetch_count)
+            declared_queue = await channel.declare_queue(queue, durable=True)
+            consumer_tag = await declared_queue.consume(on_message)
+            await stop.wait()
+
+            # Stop deliveries, then drain in flight messages
+            await declared_queue.cancel(consumer_tag)
+            await idle.wait()
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except (NotImplementedError, RuntimeError):
+                pass
+            await connection.close()
+
+    async def close(self):
+        if self._channel_pool is not None:
+            await self._channel_pool.close()
+        if self._connection_pool is not None:
+            await self._connection_pool.close()
+        self._loop = None
+
+
+ASYNC_QUEUE_CONNECTION = AsyncQueueConnection()
+
+
+async def publish_task(task: str,
+                       params: dict,
+                       queue: str = 'default',
+                       connection: AsyncQueueConnection = ASYNC_QUEUE_CONNECTION) -> bool:
+    # Build Message
+    message = connection.encode_task(task=task, params=params)
+
+    # Publish Message
+    return await connection.publish(queue=queue, message=message)
@@ -2,7 +2,7 @@ from django.http import HttpResponseRedirect
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 
-from apps.customer.config import get_or_set_customer_user_config, Config
+from apps.customer.config import load_request_config
 
 from re import compile
 
@@ -33,11 +33,4 @@ class UserCustomerMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.user.is_authenticated:
             if not request.user.is_admin:
-                request.customer = request.user.customer
-                customer_config, user_config = get_or_set_customer_user_config(
-                    customer_id=request.customer.id,
-                    user_id=request.user.id
-                )
-                request.app_config = Config(
-                    customer_config=customer_config, user_config=user_config
-                )
+                load_request_config(request)
@@ -5,19 +5,25 @@ from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
 
 from utils.cache import WEEK
+from utils.yahp.pagination import (
+    COUNT_STRATEGY_ESTIMATE, COUNT_STRATEGY_EXACT, ESTIMATE_EXACT_THRESHOLD, get_count
+)
 
 
 class CachedDjangoPaginator(Paginator):
     pagination_default_count = 1000
+    count_strategy = COUNT_STRATEGY_EXACT
+    estimate_threshold = ESTIMATE_EXACT_THRESHOLD
 
     @cached_property
     def count(self):
-        # Internal Cache pagination
+        # Internal Cache pagination, planner estimates replace the default count
         cache_key = f"pagination:{self.object_list.model.__name__}"
-        count = cache.get(cache_key, self.pagination_default_count)
+        default_count = None if self.count_strategy == COUNT_STRATEGY_ESTIMATE else self.pagination_default_count
+        count = cache.get(cache_key, default_count)
         if count is not None:
             return count
-        count = self.object_list.count()
+        count = get_count(self.object_list, strategy=self.count_strategy, threshold=self.estimate_threshold)
         cache.set(cache_key, count, WEEK)
         return count
 
@@ -1,27 +1,252 @@
 #!/usr/bin/env python
 from django.conf import settings
-from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
 
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 import logging
+import os
 import pika
-from pika.exceptions import ConnectionClosed, NoFreeChannels
+from pika.exceptions import AMQPConnectionError, AMQPError, ConnectionClosed, NoFreeChannels
+import signal
+import threading
 import time
+from typing import Dict, List, Tuple, Union
+
+from utils.queue_codec import DEFAULT_CODEC, MessageCodec
 
 logger = logging.getLogger('service')
 
 MAX_FAIL = 2
 
+# Publisher connection heartbeat (seconds), idle pooled connections are
+# serviced on checkout and replaced when the broker closed them
+PUBLISHER_HEARTBEAT = 600
+
+# Reconnect backoff (seconds) for publisher connections
+RECONNECT_MAX_ATTEMPTS = 5
+RECONNECT_BACKOFF_BASE = 0.25
+RECONNECT_BACKOFF_MAX = 8
+
+# Publisher confirms, messages per confirm batch and max wait (seconds) per batch
+PUBLISH_BATCH_SIZE = 500
+PUBLISH_CONFIRM_TIMEOUT = 30
+
+
+class PublisherChannel(object):
+    """
+    Long lived publisher connection and channel, remembers which queues were
+    already declared on the connection
+    """
+
+    def __init__(self, connection_params: pika.ConnectionParameters):
+        self.connection = pika.BlockingConnection(connection_params)
+        self.channel = self.connection.channel()
+        self.declared_queues = set()
+        # Publisher confirms channel, opened on first batch publish
+        self.confirm_channel = None
+        self._delivery_tag = 0
+        self._unconfirmed = set()
+        self._confirmations = {}
+
+    @property
+    def is_open(self) -> bool:
+        return self.connection.is_open and self.channel.is_open
+
+    def declare_queue(self, queue: str):
+        if queue not in self.declared_queues:
+            self.channel.queue_declare(queue=queue, durable=True)
+            self.declared_queues.add(queue)
+
+    def _on_delivery_confirmation(self, method_frame):
+        method = method_frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            delivery_tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+        for delivery_tag in delivery_tags:
+            self._unconfirmed.discard(delivery_tag)
+            self._confirmations[delivery_tag] = acked
+
+    def _get_confirm_channel(self):
+        """
+        Channel in confirm mode with asynchronous ack/nack tracking. The blocking
+        channel confirm mode waits on every publish, so confirms are tracked on
+        the underlying channel to allow confirming in batches.
+        """
+        if self.confirm_channel is not None and self.confirm_channel.is_open:
+            return self.confirm_channel
+
+        channel = self.connection.channel()
+        selected = []
+        channel._impl.confirm_delivery(
+            ack_nack_callback=self._on_delivery_confirmation,
+            callback=lambda frame: selected.append(True)
+        )
+        deadline = time.monotonic() + PUBLISH_CONFIRM_TIMEOUT
+        while not selected:
+            if time.monotonic() > deadline:
+                raise AMQPError('Timed out enabling publisher confirms')
+            self.connection.process_data_events(time_limit=0.1)
+
+        self.confirm_channel = channel
+        self._delivery_tag = 0
+        self._unconfirmed = set()
+        self._confirmations = {}
+        return channel
+
+    def publish_confirmed(self,
+                          queue: str,
+                          messages: List[Tuple[bytes, pika.BasicProperties]],
+                          timeout: float = PUBLISH_CONFIRM_TIMEOUT) -> List[bool]:
+        """
+        Publish a batch of `(body, properties)` messages and wait for the broker confirms
+
+        Returns
+        ---------
+            results List[bool]
+                Per message ack (True) or nack/unconfirmed (False), in input order
+        """
+        channel = self._get_confirm_channel()
+        delivery_tags = []
+        for body, properties in messages:
+            channel._impl.basic_publish(
+                exchange='', routing_key=queue, body=body, properties=properties
+            )
+            self._delivery_tag += 1
+            self._unconfirmed.add(self._delivery_tag)
+            delivery_tags.append(self._delivery_tag)
+
+        deadline = time.monotonic() + timeout
+        while self._unconfirmed and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.1)
+
+        results = [self._confirmations.pop(tag, False) for tag in delivery_tags]
+        if self._unconfirmed:
+            # Late confirms can not be matched to a batch, start a new channel
+            logger.warning(
+                f'Queue=`{queue}` {len(self._unconfirmed)} messages unconfirmed after {timeout}s',
+                extra={'task': 'QueueConnection'}
+            )
+            try:
+                self.confirm_channel.close()
+            except Exception:
+                pass
+            self.confirm_channel = None
+        return results
+
+    def process_data_events(self) -> bool:
+        """Service heartbeats of an idle connection, returns if still usable"""
+        try:
+            self.connection.process_data_events(time_limit=0)
+        except AMQPError:
+            return False
+        return self.is_open
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+
+class PublisherPool(object):
+    """
+    Thread safe, per process pool of long lived publisher connections/channels.
+
+    `pika.BlockingConnection` is not thread safe, so each publisher is checked
+    out by a single thread at a time. Pools are reset after a fork (gunicorn
+    workers) as connections can not be shared across processes.
+
+    with pool.channel() as publisher:
+        publisher.declare_queue(queue)
+        publisher.channel.basic_publish(...)
+    """
+
+    def __init__(self, get_connection_params: callable, max_size: int = 10):
+        self.get_connection_params = get_connection_params
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._publishers = []
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                # Drop references to the parent process connections without closing them
+                self._publishers = []
+                self._pid = os.getpid()
+
+    def _connect(self) -> PublisherChannel:
+        for attempt in range(RECONNECT_MAX_ATTEMPTS):
+            try:
+                return PublisherChannel(self.get_connection_params())
+            except AMQPConnectionError:
+                if attempt + 1 >= RECONNECT_MAX_ATTEMPTS:
+                    raise
+                delay = min(RECONNECT_BACKOFF_BASE * 2 ** attempt, RECONNECT_BACKOFF_MAX)
+                logger.warning(
+                    f'Failed to connect publisher, retrying in {delay}s', exc_info=True,
+                    extra={'task': 'QueueConnection'}
+                )
+                time.sleep(delay)
+
+    def acquire(self) -> PublisherChannel:
+        self._check_pid()
+        while True:
+            with self._lock:
+                publisher = self._publishers.pop() if self._publishers else None
+            if publisher is None:
+                return self._connect()
+            if publisher.process_data_events():
+                return publisher
+            publisher.close()
+
+    def release(self, publisher: PublisherChannel, discard: bool = False):
+        if not discard and publisher.is_open and self._pid == os.getpid():
+            with self._lock:
+                if len(self._publishers) < self.max_size:
+                    self._publishers.append(publisher)
+                    return
+        publisher.close()
+
+    @contextmanager
+    def channel(self):
+        publisher = self.acquire()
+        try:
+            yield publisher
+        except Exception:
+            # Connection/channel state unknown after a failure
+            self.release(publisher, discard=True)
+            raise
+        self.release(publisher)
+
+    def close(self):
+        with self._lock:
+            publishers, self._publishers = self._publishers, []
+        for publisher in publishers:
+            publisher.close()
+
 
 class QueueConnection(object):
-    def __init__(self, queues: list = settings.RABBITMQ_QUEUES):
+    def __init__(self, queues: list = settings.RABBITMQ_QUEUES, codec: MessageCodec = DEFAULT_CODEC):
         self.host = settings.RABBITMQ_HOST
         self.port = settings.RABBITMQ_PORT
         self.virtual_host = settings.RABBITMQ_VHOST
         self.user = settings.RABBITMQ_USER
         self.password = settings.RABBITMQ_PASS
         self.queues = queues
+        self.codec = codec
         self.connection = None
+        self.publisher_pool = PublisherPool(
+            get_connection_params=lambda: self._get_connection_params(
+                connection_attempts=1, heartbeat=PUBLISHER_HEARTBEAT
+            ),
+            max_size=settings.RABBITMQ_PUBLISHER_POOL_SIZE
+        )
     
     def _get_connection_params(self, connection_attempts: int = 5, heartbeat: int = None):
         credentials = pika.PlainCredentials(self.user, self.password)
@@ -80,27 +305,38 @@ class QueueConnection(object):
             self._establish_connection()
             return self.connection.channel()
 
-    def _send_message(self, queue: str, message: str) -> bool:
-        # Establish Connection
-        connection = pika.BlockingConnection(self._get_connection_params())
-        channel = connection.channel()
-        # Declare Queue
-        channel.queue_declare(queue=queue, durable=True)
-        channel.basic_publish(
-            exchange='', 
-            routing_key=queue, 
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode = pika.spec.PERSISTENT_DELIVERY_MODE
-        ))
-        connection.close()
-
-    def publish(self, queue: str, message: str, fail_count: int = 0) -> bool:
+    def encode_task(self, task: str, params: dict) -> Tuple[bytes, pika.BasicProperties]:
+        """Encode a task envelope with the codec advertised in the message properties"""
+        body, content_type, content_encoding = self.codec.encode({"task": task, "params": params})
+        return body, pika.BasicProperties(
+            content_type=content_type,
+            content_encoding=content_encoding,
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
+        )
+
+    def _send_message(self, queue: str, message: Union[str, bytes], properties: pika.BasicProperties = None) -> bool:
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE)
+        # Pooled long lived connection, queue declared once per connection
+        with self.publisher_pool.channel() as publisher:
+            publisher.declare_queue(queue=queue)
+            publisher.channel.basic_publish(
+                exchange='', 
+                routing_key=queue, 
+                body=message,
+                properties=properties
+            )
+
+    def publish(self,
+                queue: str,
+                message: Union[str, bytes],
+                fail_count: int = 0,
+                properties: pika.BasicProperties = None) -> bool:
         try:
             # Send Message
-            self._send_message(queue=queue, message=message)
+            self._send_message(queue=queue, message=message, properties=properties)
             logger.info(
-                f'Queue=`{queue}` Submitted message: {message[0:100]}',
+                f'Queue=`{queue}` Submitted message: {len(message)} bytes',
                 extra={'task': 'QueueConnection'}
             )
             return True
@@ -113,13 +349,49 @@ class QueueConnection(object):
                 raise e
             # Increment Fail Count
             fail_count += 1
-            self.publish(queue=queue, message=message, fail_count=fail_count)
+            self.publish(queue=queue, message=message, fail_count=fail_count, properties=properties)
             return False
 
-    def consume(self, callback, queue: str = 'default'):
+    def consume(self,
+                callback,
+                queue: str = 'default',
+                prefetch_count: int = None,
+                workers: int = None,
+                worker_type: str = 'thread',
+                decode: bool = False):
+        """
+        Consume messages from a queue
+
+        Parameters
+        ---------
+            callback callable
+                `callback(channel, method, properties, body)`, for process
+                workers `callback(body)` (see `QueueConsumer`)
+            prefetch_count int
+                Max unacknowledged messages delivered to this consumer, defaults
+                to 1 inline or twice the number of workers
+            workers int
+                Dispatch callbacks to a pool of workers, by default callbacks run
+                inline on the connection thread
+            worker_type str
+                `thread` or `process` pool
+            decode bool
+                Pass the decoded task envelope (see `decode_task_message`) to the
+                callback in place of the raw body
+        """
+        if workers is not None:
+            return QueueConsumer(
+                queue_connection=self, callback=callback, queue=queue,
+                prefetch_count=prefetch_count, workers=workers, worker_type=worker_type,
+                decode=decode
+            ).start()
+
+        if decode:
+            callback = partial(_call_with_decoded_message, callback)
+
         self._establish_connection(initial=True, wait=False)
         channel = self.get_channel()
-        channel.basic_qos(prefetch_count=1)
+        channel.basic_qos(prefetch_count=prefetch_count or 1)
         channel.queue_declare(queue=queue, durable=True)
         channel.basic_consume(queue=queue, on_message_callback=callback)
 
@@ -130,25 +402,264 @@ class QueueConnection(object):
 
         self.connection.close()
 
+    def publish_tasks(self,
+                      tasks: List[Union[Tuple[str, Dict], Dict]],
+                      queue: str = 'default',
+                      batch_size: int = PUBLISH_BATCH_SIZE) -> List[bool]:
+        """
+        Publish many task messages over one channel with publisher confirms
+
+        Parameters
+        ---------
+            tasks List[Tuple[str, Dict] | Dict]
+                `(task, params)` tuples or `{"task": ..., "params": ...}` dicts
+            queue str
+                Queue to publish to
+            batch_size int
+                Messages published before waiting on the broker confirms
+        Returns
+        ---------
+            results List[bool]
+                Per task ack (True) or nack/failure (False) in input order, retry
+                only the failed tasks
+        """
+        messages = [
+            self.encode_task(**task) if isinstance(task, dict) else self.encode_task(*task)
+            for task in tasks
+        ]
+
+        results = []
+        for i in range(0, len(messages), batch_size):
+            batch = messages[i:i + batch_size]
+            try:
+                with self.publisher_pool.channel() as publisher:
+                    publisher.declare_queue(queue=queue)
+                    results.extend(publisher.publish_confirmed(queue=queue, messages=batch))
+            except Exception:
+                logger.error(
+                    f'Queue=`{queue}` Failed to publish batch of {len(batch)} messages', exc_info=True,
+                    extra={'task': 'QueueConnection'}
+                )
+                results.extend([False] * len(batch))
+
+        logger.info(
+            f'Queue=`{queue}` Submitted {sum(results)}/{len(results)} messages',
+            extra={'task': 'QueueConnection'}
+        )
+        return results
+
     def queue_declare(self, queue: str) -> bool:
-        # Establish Connection
-        connection = pika.BlockingConnection(self._get_connection_params())
-        channel = connection.channel()
-        # Declare Queue
-        channel.queue_declare(queue=queue, durable=True)
+        with self.publisher_pool.channel() as publisher:
+            publisher.declare_queue(queue=queue)
+
+
+class ThreadSafeChannel(object):
+    """
+    Channel proxy handed to worker thread callbacks, acks are scheduled on the
+    connection thread as pika connections are not thread safe. `settled` marks
+    a message acked, nacked or rejected by the callback.
+    """
+
+    def __init__(self, connection: pika.BlockingConnection, channel):
+        self.connection = connection
+        self.channel = channel
+        self.settled = False
+
+    def _threadsafe(self, method, **kwargs):
+        self.settled = True
+        self.connection.add_callback_threadsafe(partial(method, **kwargs))
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        self._threadsafe(self.channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True):
+        self._threadsafe(
+            self.channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue
+        )
+
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True):
+        self._threadsafe(self.channel.basic_reject, delivery_tag=delivery_tag, requeue=requeue)
+
+
+class QueueConsumer(object):
+    """
+    Consumer runtime dispatching message callbacks to a thread or process pool
+    while the connection thread keeps servicing heartbeats and acks.
+
+    Thread workers keep the pika callback contract, `callback(channel, method,
+    properties, body)`, with a `ThreadSafeChannel` to ack from the worker. A
+    message not settled by a raising callback is rejected (not requeued, dead
+    lettered when the queue has a DLX).
+
+    Process workers call a picklable `callback(body)`, the message is acked when
+    it returns and rejected (not requeued) when it raises.
+
+    SIGTERM stops consuming new messages and drains in flight messages before
+    closing the connection.
+    """
+
+    def __init__(self,
+                 queue_connection: QueueConnection,
+                 callback,
+                 queue: str = 'default',
+                 prefetch_count: int = None,
+                 workers: int = None,
+                 worker_type: str = 'thread',
+                 decode: bool = False):
+        assert worker_type in ('thread', 'process'), "worker_type must be `thread` or `process`"
+        self.queue_connection = queue_connection
+        self.callback = callback
+        self.queue = queue
+        self.workers = workers or os.cpu_count() or 1
+        self.prefetch_count = prefetch_count or self.workers * 2
+        self.worker_type = worker_type
+        self.decode = decode
+        self.channel = None
+        self.executor = None
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> pika.BlockingConnection:
+        return self.queue_connection.connection
+
+    def _on_message(self, channel, method, properties, body):
+        worker_channel = None
+        if self.worker_type == 'thread':
+            callback = self.callback
+            if self.decode:
+                callback = partial(_call_with_decoded_message, callback)
+            worker_channel = ThreadSafeChannel(self.connection, channel)
+            future = self.executor.submit(callback, worker_channel, method, properties, body)
+        elif self.decode:
+            # Decode in the worker process, the properties are not picklable
+            future = self.executor.submit(
+                _call_with_decoded_body, self.callback, body,
+                properties.content_type, properties.content_encoding
+            )
+        else:
+            future = self.executor.submit(self.callback, body)
+        with self._lock:
+            self._in_flight.add(future)
+        future.add_done_callback(partial(self._on_done, method.delivery_tag, worker_channel))
+
+    def _on_done(self, delivery_tag: int, worker_channel: ThreadSafeChannel, future):
+        with self._lock:
+            self._in_flight.discard(future)
+
+        exc = future.exception()
+        if exc is not None:
+            logger.error(
+                f'Queue=`{self.queue}` Failed to process message', exc_info=exc,
+                extra={'task': 'QueueConsumer'}
+            )
+        if self.worker_type == 'process':
+            if exc is None:
+                ack = partial(self.channel.basic_ack, delivery_tag=delivery_tag)
+            else:
+                ack = partial(self.channel.basic_reject, delivery_tag=delivery_tag, requeue=False)
+            self.connection.add_callback_threadsafe(ack)
+        elif exc is not None and not worker_channel.settled:
+            # Release the prefetch slot of a failed message
+            worker_channel.basic_reject(delivery_tag=delivery_tag, requeue=False)
+
+    def _on_sigterm(self, signum, frame):
+        logger.info(
+            f'Queue=`{self.queue}` Received SIGTERM, draining consumer',
+            extra={'task': 'QueueConsumer'}
+        )
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+
+    def _drain(self):
+        """Wait on in flight messages while sending their acks"""
+        while True:
+            with self._lock:
+                in_flight = len(self._in_flight)
+            if in_flight == 0:
+                break
+            self.connection.process_data_events(time_limit=0.5)
+        self.executor.shutdown(wait=True)
+        # Flush acks scheduled by the final callbacks
+        self.connection.process_data_events(time_limit=0)
+
+    def start(self):
+        self.queue_connection._establish_connection(initial=True, wait=False)
+        self.channel = self.queue_connection.get_channel()
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.queue_declare(queue=self.queue, durable=True)
+        self.channel.basic_consume(queue=self.queue, on_message_callback=self._on_message)
+
+        if self.worker_type == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        # Signal handlers can only be installed from the main thread
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+
+        logger.info(
+            f'Queue=`{self.queue}` Consuming with {self.workers} {self.worker_type} workers '
+            f'prefetch={self.prefetch_count}',
+            extra={'task': 'QueueConsumer'}
+        )
+        try:
+            self.channel.start_consuming()
+        except KeyboardInterrupt:
+            self.channel.stop_consuming()
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+
+        self._drain()
+        self.connection.close()
 
 
 QUEUE_CONNECTION = QueueConnection()
 
 
+def decode_task_message(body: bytes, properties: pika.BasicProperties) -> dict:
+    """Decode a task envelope of any supported codec, see `utils.queue_codec`"""
+    return MessageCodec.decode(
+        body, content_type=properties.content_type, content_encoding=properties.content_encoding
+    )
+
+
+def get_task_handler(task: str):
+    """Import the handler of a task from `settings.RABBITMQ_TASKS`"""
+    path = settings.RABBITMQ_TASKS.get(task)
+    if path is None:
+        raise KeyError(f"No handler registered for task `{task}`")
+    return import_string(path)
+
+
+def run_task(message: dict):
+    """Process worker callback, runs a decoded task envelope with its registered handler"""
+    return get_task_handler(message['task'])(message['params'])
+
+
+def _call_with_decoded_message(callback, channel, method, properties, body):
+    return callback(channel, method, properties, decode_task_message(body, properties))
+
+
+def _call_with_decoded_body(callback, body: bytes, content_type: str, content_encoding: str):
+    return callback(MessageCodec.decode(body, content_type=content_type, content_encoding=content_encoding))
+
+
 def publish_task(task: str,
                  params: dict,
                  queue: str = 'default',
                  connection: QueueConnection = QUEUE_CONNECTION) -> bool:
     # Build Message
-    message = json.dumps({
-        "task": task, "params": params}, cls=DjangoJSONEncoder
-    )
+    message, properties = connection.encode_task(task=task, params=params)
 
     # Publish Message
-    return connection.publish(queue=queue, message=message)
+    return connection.publish(queue=queue, message=message, properties=properties)
+
+
+def publish_tasks(tasks: List[Union[Tuple[str, Dict], Dict]],
+                  queue: str = 'default',
+                  connection: QueueConnection = QUEUE_CONNECTION) -> List[bool]:
+    # Publish Messages with Publisher Confirms
+    return connection.publish_tasks(tasks=tasks, queue=queue)
@@ -0,0 +1,149 @@
+"""
+Task envelope codecs for queue messages.
+
+Messages are serialized with compact JSON or msgpack and compressed with gzip or
+zstd above a size threshold. The codec is advertised in the AMQP `content_type`
+and `content_encoding` properties, messages without them are decoded as the
+legacy JSON envelope so old and new publishers/consumers interoperate during a
+rollout. Upgrade consumers before switching publishers to msgpack or compression,
+the default (compact JSON, no compression) is readable by legacy consumers.
+
+msgpack and zstd use the `msgpack` and `zstandard` packages, a codec configured
+without them installed fails at startup with `ImproperlyConfigured`.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+
+import gzip
+import json
+from typing import Any, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+GZIP_ENCODING = 'gzip'
+ZSTD_ENCODING = 'zstd'
+
+# Compress messages larger than this number of bytes
+DEFAULT_COMPRESSION_THRESHOLD = 4096
+
+
+def _json_encode(obj: Any) -> bytes:
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+def _json_decode(body: bytes) -> Any:
+    return json.loads(body)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    # Same representation as the JSON envelope for dates, decimals, UUIDs etc.
+    return DjangoJSONEncoder().default(obj)
+
+
+def _msgpack_encode(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def _msgpack_decode(body: bytes) -> Any:
+    return msgpack.unpackb(body, raw=False)
+
+
+def _zstd_compress(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(body)
+
+
+def _zstd_decompress(body: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(body)
+
+
+SERIALIZERS = {
+    'json': (JSON_CONTENT_TYPE, _json_encode, _json_decode),
+    'msgpack': (MSGPACK_CONTENT_TYPE, _msgpack_encode, _msgpack_decode),
+}
+
+DECODERS = {
+    JSON_CONTENT_TYPE: _json_decode,
+    MSGPACK_CONTENT_TYPE: _msgpack_decode,
+}
+
+COMPRESSORS = {
+    GZIP_ENCODING: (gzip.compress, gzip.decompress),
+    ZSTD_ENCODING: (_zstd_compress, _zstd_decompress),
+}
+
+
+class MessageCodec(object):
+    """
+    Encode/decode task envelopes `{"task", "params"}`
+
+    codec = MessageCodec(serializer='msgpack', compression='zstd')
+    body, content_type, content_encoding = codec.encode(envelope)
+    envelope = codec.decode(body, content_type, content_encoding)
+    """
+
+    def __init__(self,
+                 serializer: str = 'json',
+                 compression: str = None,
+                 compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD):
+        if serializer not in SERIALIZERS:
+            raise ImproperlyConfigured(f"Unsupported message serializer `{serializer}`")
+        if compression is not None and compression not in COMPRESSORS:
+            raise ImproperlyConfigured(f"Unsupported message compression `{compression}`")
+        if serializer == 'msgpack' and msgpack is None:
+            raise ImproperlyConfigured("msgpack serializer requires the `msgpack` package")
+        if compression == ZSTD_ENCODING and zstandard is None:
+            raise ImproperlyConfigured("zstd compression requires the `zstandard` package")
+        self.serializer = serializer
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.content_type, self._encode, _ = SERIALIZERS[serializer]
+
+    def encode(self, obj: Any) -> Tuple[bytes, str, str]:
+        """
+        Returns
+        ---------
+            body bytes
+                Serialized and optionally compressed message
+            content_type str
+                AMQP content type of the serializer
+            content_encoding str
+                AMQP content encoding, None when not compressed
+        """
+        body = self._encode(obj)
+        if self.compression is not None and len(body) > self.compression_threshold:
+            compress, _ = COMPRESSORS[self.compression]
+            return compress(body), self.content_type, self.compression
+        return body, self.content_type, None
+
+    @staticmethod
+    def decode(body: bytes, content_type: str = None, content_encoding: str = None) -> Any:
+        """Decode any supported message, legacy messages without headers are JSON"""
+        if content_encoding:
+            if content_encoding not in COMPRESSORS:
+                raise ValueError(f"Unsupported message content encoding `{content_encoding}`")
+            _, decompress = COMPRESSORS[content_encoding]
+            body = decompress(body)
+        decoder = DECODERS.get(content_type or JSON_CONTENT_TYPE, None)
+        if decoder is None:
+            raise ValueError(f"Unsupported message content type `{content_type}`")
+        return decoder(body)
+
+
+DEFAULT_CODEC = MessageCodec(
+    serializer=settings.RABBITMQ_MESSAGE_SERIALIZER,
+    compression=settings.RABBITMQ_MESSAGE_COMPRESSION or None,
+    compression_threshold=settings.RABBITMQ_MESSAGE_COMPRESSION_THRESHOLD
+)
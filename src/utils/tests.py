@@ -0,0 +1,483 @@
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models.fields.files import FieldFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from apps.customer.models import Customer, CustomerUsage
+from utils.async_queue import AsyncQueueConnection
+from utils.queue import QueueConnection, QueueConsumer, run_task
+from utils.throttles import EventRateThrottle, ThrottleLease, ThrottleLeases
+from utils.yahp.api.pagination import KeysetPagination
+from utils.yahp.pagination import PAGINATION_COUNT_TASK, CachedDjangoPaginator
+from utils.yahp.cache import get_entry_value
+from utils.yahp.file_io import (
+    FileException, iter_json_array, read_csv_file, sniff_csv_dialect, stream_file_to_df, write_file_from_df
+)
+from utils.yahp.parser import parse_date, parse_date_series, parse_integer_series, parse_time_series
+
+from base64 import urlsafe_b64encode
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+import io
+import json
+import pandas as pd
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReadCsvFileTests(SimpleTestCase):
+
+    def read(self, content: bytes, **kwargs):
+        return read_csv_file(io.BytesIO(content), **kwargs)
+
+    def test_header_row_kept(self):
+        df = self.read(b'a,b,c\n1,2,3\n4,5,6\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(df.values.tolist(), [['1', '2', '3'], ['4', '5', '6']])
+
+    def test_trailing_delimiters_keep_header(self):
+        df = self.read(b'a,b,c\n1,2,3,\n4,5,6,\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(df.values.tolist(), [['1', '2', '3'], ['4', '5', '6']])
+
+    def test_missing_trailing_fields_keep_header(self):
+        df = self.read(b'a,b,c\n1,2\n4,5\n7,8,9\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(len(df), 3)
+
+    def test_two_row_file(self):
+        df = self.read(b'a,b,c\n1,2\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(len(df), 1)
+
+    def test_single_column_file(self):
+        df = self.read(b'email\na@example.com\nb@example.com\n')
+        self.assertEqual(list(df.columns), ['email'])
+        self.assertEqual(len(df), 2)
+
+    def test_tab_delimited(self):
+        df = self.read(b'a\tb\tc\n1\t2\t3\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+
+    def test_preamble_skipped(self):
+        self.assertEqual(sniff_csv_dialect(b'Exported Report\n\na,b,c\n1,2,3\n').header, 2)
+        df = self.read(b'Exported Report\n\na,b,c\n1,2,3\n')
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(df.values.tolist(), [['1', '2', '3']])
+
+    def test_latin1_fallback_not_cached(self):
+        from django.core.cache import cache
+
+        # Valid utf-8 sample, latin1 byte after the sniffed sample
+        content = b'a,b\n' + b'1,2\n' * 20000 + b'caf\xe9,3\n'
+        df = self.read(content, source='test_source')
+        self.assertEqual(df['a'].iloc[-1], 'caf\xe9')
+        self.assertEqual(cache.get('csv_dialect:test_source')[0], 'utf-8')
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            name='Keyset', name_hash='cust_keyset', customer_primary_email='keyset@example.com'
+        )
+        # Sub millisecond timestamps, several rows per millisecond
+        start = timezone.now().replace(microsecond=0)
+        CustomerUsage.objects.bulk_create([
+            CustomerUsage(
+                customer=self.customer, unit_type='<>', units=i,
+                observation_datetime=start + timedelta(microseconds=100 * i)
+            )
+            for i in range(25)
+        ])
+        self.queryset = CustomerUsage.objects.all()
+        self.view = type('View', (), {'keyset_ordering': '-observation_datetime'})()
+
+    def paginate(self, url, ordering):
+        self.view.keyset_ordering = ordering
+        paginator = KeysetPagination()
+        paginator.page_size = 4
+        request = Request(APIRequestFactory().get(url))
+        page = paginator.paginate_queryset(self.queryset, request, view=self.view)
+        return page, paginator.get_next_link(), paginator.get_previous_link()
+
+    def page_through(self, ordering):
+        url, units = '/usage/', []
+        # Bounded, repeated rows must not page forever
+        for _ in range(10):
+            if url is None:
+                break
+            page, url, _ = self.paginate(url, ordering)
+            units += [usage.units for usage in page]
+        return units
+
+    def test_descending_pages_cover_all_rows(self):
+        self.assertEqual(self.page_through('-observation_datetime'), list(range(24, -1, -1)))
+
+    def test_ascending_pages_cover_all_rows(self):
+        self.assertEqual(self.page_through('observation_datetime'), list(range(25)))
+
+    def test_previous_page(self):
+        _, next_url, _ = self.paginate('/usage/', 'observation_datetime')
+        page, _, previous_url = self.paginate(next_url, 'observation_datetime')
+        self.assertEqual([usage.units for usage in page], [4, 5, 6, 7])
+        page, _, _ = self.paginate(previous_url, 'observation_datetime')
+        self.assertEqual([usage.units for usage in page], [0, 1, 2, 3])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            self.paginate('/usage/?cursor=invalid', 'observation_datetime')
+
+    def test_invalid_cursor_values(self):
+        pk = str(CustomerUsage.objects.first().pk)
+        for cursor in (
+            {'v': 'abc', 'pk': pk, 'r': False},
+            {'v': None, 'pk': pk, 'r': False},
+            {'v': timezone.now().isoformat(), 'pk': 'x', 'r': False},
+            {'v': timezone.now().isoformat(), 'pk': pk, 'r': 'yes'},
+        ):
+            encoded = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                self.paginate(f'/usage/?cursor={encoded}', 'observation_datetime')
+
+    def test_nullable_ordering_field(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.paginate('/usage/', 'units')
+
+
+class QueueConsumerTests(SimpleTestCase):
+
+    def consumer(self, callback, **kwargs):
+        queue_connection = mock.Mock()
+        # Run connection thread callbacks inline
+        queue_connection.connection.add_callback_threadsafe.side_effect = lambda method: method()
+        consumer = QueueConsumer(queue_connection, callback, **kwargs)
+        consumer.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(consumer.executor.shutdown)
+        return consumer
+
+    def deliver(self, consumer, delivery_tag=1):
+        channel = mock.Mock()
+        consumer.channel = channel
+        consumer._on_message(channel, SimpleNamespace(delivery_tag=delivery_tag), None, b'{}')
+        consumer.executor.shutdown(wait=True)
+        return channel
+
+    def test_prefetch_defaults_to_twice_the_workers(self):
+        with mock.patch.object(QueueConsumer, 'start', autospec=True, side_effect=lambda self: self):
+            consumer = QueueConnection().consume(mock.Mock(), workers=3)
+        self.assertEqual(consumer.prefetch_count, 6)
+
+    def test_explicit_prefetch(self):
+        with mock.patch.object(QueueConsumer, 'start', autospec=True, side_effect=lambda self: self):
+            consumer = QueueConnection().consume(mock.Mock(), prefetch_count=1, workers=3)
+        self.assertEqual(consumer.prefetch_count, 1)
+
+    def test_thread_worker_exception_rejects(self):
+        def callback(channel, method, properties, body):
+            raise ValueError('boom')
+
+        channel = self.deliver(self.consumer(callback), delivery_tag=7)
+        channel.basic_reject.assert_called_once_with(delivery_tag=7, requeue=False)
+        channel.basic_ack.assert_not_called()
+
+    def test_thread_worker_exception_after_ack(self):
+        def callback(channel, method, properties, body):
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            raise ValueError('boom')
+
+        channel = self.deliver(self.consumer(callback), delivery_tag=7)
+        channel.basic_ack.assert_called_once_with(delivery_tag=7, multiple=False)
+        channel.basic_reject.assert_not_called()
+
+    def test_thread_worker_success_left_to_callback(self):
+        channel = self.deliver(self.consumer(lambda *args: None))
+        channel.basic_ack.assert_not_called()
+        channel.basic_reject.assert_not_called()
+
+
+class AsyncQueueConnectionTests(SimpleTestCase):
+
+    def consume(self, callback, *messages):
+        """Deliver `messages` to `AsyncQueueConnection.consume`, then cancel it"""
+        queue_connection = AsyncQueueConnection(queues=[])
+        connection = mock.AsyncMock()
+        channel = connection.channel.return_value
+        declared_queue = channel.declare_queue.return_value
+
+        async def run():
+            consumer = asyncio.ensure_future(queue_connection.consume(callback))
+            while not declared_queue.consume.await_count:
+                await asyncio.sleep(0)
+            on_message = declared_queue.consume.await_args.args[0]
+            for message in messages:
+                await on_message(message)
+            consumer.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await consumer
+
+        with mock.patch.object(queue_connection, '_get_connection', mock.AsyncMock(return_value=connection)):
+            asyncio.run(run())
+        connection.close.assert_awaited_once()
+
+    def test_callback_exception_rejects(self):
+        async def callback(message):
+            raise ValueError('boom')
+
+        message = mock.Mock(processed=False, reject=mock.AsyncMock())
+        self.consume(callback, message)
+        message.reject.assert_awaited_once_with(requeue=False)
+
+    def test_callback_exception_after_ack(self):
+        async def callback(message):
+            message.processed = True
+            raise ValueError('boom')
+
+        message = mock.Mock(processed=False, reject=mock.AsyncMock())
+        self.consume(callback, message)
+        message.reject.assert_not_awaited()
+
+    def test_publish_retry_delay(self):
+        queue_connection = AsyncQueueConnection(queues=[])
+        send_message = mock.AsyncMock(side_effect=[ValueError('boom'), ValueError('boom'), None])
+        with mock.patch.object(queue_connection, '_send_message', send_message), \
+                mock.patch('utils.async_queue.asyncio.sleep', mock.AsyncMock()) as sleep:
+            self.assertTrue(asyncio.run(queue_connection.publish('default', b'{}')))
+        self.assertEqual([call.args[0] for call in sleep.await_args_list], [0.5, 1.0])
+
+
+class ParseSeriesTests(SimpleTestCase):
+
+    def test_date_mixed_offsets(self):
+        values = ['2020-01-01T23:00+01:00', '2020-01-01T23:00-05:00', None]
+        dates, fallback_count = parse_date_series(pd.Series(values))
+        self.assertEqual(dates.tolist(), [date(2020, 1, 1), date(2020, 1, 1), None])
+        self.assertEqual(fallback_count, 0)
+        self.assertEqual(dates.tolist()[:2], [parse_date(x) for x in values[:2]])
+
+    def test_date_mixed_offsets_local_tz(self):
+        values = ['2020-01-01T23:00+01:00', '2020-01-02T03:00+00:00']
+        dates, _ = parse_date_series(pd.Series(values), local_tz=True)
+        self.assertEqual(dates.tolist(), [parse_date(x, local_tz=True) for x in values])
+
+    def test_date_aware_and_naive(self):
+        dates, fallback_count = parse_date_series(pd.Series(['2020-01-01T23:00-05:00', '2020-01-02 00:00', 'x']))
+        self.assertEqual(dates.tolist(), [date(2020, 1, 1), date(2020, 1, 2), None])
+        self.assertEqual(fallback_count, 1)
+
+    def test_aware_naive_and_empty(self):
+        values = pd.Series(['', '2021-01-05T10:00:00+02:00', '2021-01-06'])
+        dates, _ = parse_date_series(values)
+        self.assertEqual(dates.tolist(), [None, date(2021, 1, 5), date(2021, 1, 6)])
+        times, _ = parse_time_series(values)
+        self.assertEqual(times.tolist(), [None, None, time(0, 0)])
+
+    def test_time_aware_and_naive(self):
+        times, fallback_count = parse_time_series(pd.Series(['2020-01-01T23:00-05:00', '2020-01-02 10:30']))
+        self.assertEqual(times.tolist(), [None, time(10, 30)])
+        self.assertEqual(fallback_count, 1)
+
+    def test_integer_out_of_range(self):
+        values = pd.Series(['1', '9223372036854775807', '-9223372036854775809', '-5.5', None])
+        integers, fallback_count = parse_integer_series(values)
+        self.assertEqual(integers.tolist(), [1, None, None, -5, None])
+        self.assertEqual(fallback_count, 2)
+
+    def test_integer_out_of_range_default(self):
+        integers, fallback_count = parse_integer_series(pd.Series([1e19, 2.0]), nullable=False, default=0)
+        self.assertEqual(integers.tolist(), [0, 2])
+        self.assertEqual(fallback_count, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PaginationCountRefreshTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Customer.objects.bulk_create([
+            Customer(name=f'Count {i}', name_hash=f'cust_count_{i}', customer_primary_email=f'count{i}@example.com')
+            for i in range(3)
+        ])
+        self.paginator = CachedDjangoPaginator(Customer.objects.filter(name__startswith='Count'), 10)
+
+    def schedule(self, **kwargs):
+        with mock.patch('utils.yahp.pagination.publish_task', **kwargs) as publish_task:
+            return self.paginator.schedule_count_refresh(), publish_task
+
+    def test_refresh_task_counts_queryset(self):
+        scheduled, publish_task = self.schedule()
+        self.assertTrue(scheduled)
+        task = publish_task.call_args.kwargs
+        self.assertEqual(task['task'], PAGINATION_COUNT_TASK)
+        # Queued once per cache key
+        self.assertEqual(self.schedule()[0], False)
+
+        self.assertEqual(run_task({'task': task['task'], 'params': task['params']}), 3)
+        self.assertEqual(get_entry_value(cache.get(self.paginator.cache_key)), 3)
+        self.assertIsNone(cache.get(f"refresh:{self.paginator.cache_key}"))
+
+    def test_refresh_task_rejects_tampered_query(self):
+        _, publish_task = self.schedule()
+        params = publish_task.call_args.kwargs['params']
+        params['query'] = params['query'][:-1] + ('A' if params['query'][-1] != 'A' else 'B')
+        with self.assertRaises(signing.BadSignature):
+            run_task({'task': PAGINATION_COUNT_TASK, 'params': params})
+        self.assertIsNone(cache.get(self.paginator.cache_key))
+
+    def test_publish_failure_releases_refresh_key(self):
+        scheduled, _ = self.schedule(side_effect=ConnectionError)
+        self.assertFalse(scheduled)
+        self.assertIsNone(cache.get(f"refresh:{self.paginator.cache_key}"))
+
+    def test_publish_retry_keeps_refresh_key(self):
+        # `publish_task` returns False when a retry succeeded
+        scheduled, _ = self.schedule(return_value=False)
+        self.assertTrue(scheduled)
+        self.assertIsNotNone(cache.get(f"refresh:{self.paginator.cache_key}"))
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            run_task({'task': 'unknown', 'params': {}})
+
+
+class StreamJsonFileTests(SimpleTestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileSystemStorage(location=location)
+        self.df = pd.DataFrame({'a': ['x', 'y', 'z'], 'b': ['1', '2', '3']})
+
+    def field_file(self, file):
+        name = self.storage.save(file.name, file)
+        return FieldFile(None, SimpleNamespace(storage=self.storage), name)
+
+    def stream(self, file, **kwargs):
+        return list(stream_file_to_df(self.field_file(file), **kwargs))
+
+    def test_json_array_read_back(self):
+        chunks = self.stream(write_file_from_df(self.df, 'records.json'), chunksize=2)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(pd.concat(chunks).values.tolist(), self.df.values.tolist())
+
+    def test_json_array_nrows(self):
+        chunks = self.stream(write_file_from_df(self.df, 'records.json'), nrows=2)
+        self.assertEqual(pd.concat(chunks).values.tolist(), self.df.head(2).values.tolist())
+
+    def test_json_lines(self):
+        content = self.df.to_json(orient='records', lines=True).encode()
+        chunks = self.stream(File(io.BytesIO(b'  ' + content), name='lines.json'), chunksize=2)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(pd.concat(chunks).values.tolist(), self.df.values.tolist())
+
+    def test_json_array_decoded_incrementally(self):
+        content = json.dumps([{'a': str(i), 'b': i * 1000} for i in range(100)]).encode()
+        file_bytes = io.BytesIO(content)
+        items = iter_json_array(file_bytes, read_size=64)
+        self.assertEqual(next(items), {'a': '0', 'b': 0})
+        self.assertLess(file_bytes.tell(), len(content) // 10)
+        self.assertEqual([item['b'] for item in items], [i * 1000 for i in range(1, 100)])
+
+    def test_json_array_numbers_split_across_reads(self):
+        items = iter_json_array(io.BytesIO(b' [12345, 67890,\n3.25e2, "x", null, [1], {}] '), read_size=3)
+        self.assertEqual(list(items), [12345, 67890, 325.0, 'x', None, [1], {}])
+
+    def test_json_array_empty(self):
+        self.assertEqual(list(iter_json_array(io.BytesIO(b'[ ]'))), [])
+
+    def test_json_array_invalid(self):
+        for content in (b'[1, 2', b'[1 2]', b'[1,]', b'{"a": 1}'):
+            with self.subTest(content=content), self.assertRaises(FileException):
+                list(iter_json_array(io.BytesIO(content), read_size=2))
+
+    def test_not_json(self):
+        with self.assertRaises(FileException):
+            self.stream(File(io.BytesIO(b'a,b\n1,2\n'), name='table.json'))
+
+
+class ThrottleLeaseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.takes = []
+
+    def take(self, returned, requested):
+        self.takes.append((returned, requested))
+        return requested, 0
+
+    def test_lease_release(self):
+        lease = ThrottleLease()
+        for _ in range(3):
+            self.assertTrue(lease.acquire(window=1, take=self.take, lease_size=10, flush_interval=60)[0])
+        self.assertEqual(self.takes, [(0, 10)])
+
+        # Recently renewed leases are kept
+        self.assertEqual(lease.release(idle=60), 0)
+        self.assertEqual(lease.release(), 7)
+        self.assertEqual(self.takes, [(0, 10), (7, 0)])
+        self.assertEqual(lease.release(), 0)
+
+    def test_window_change_returns_budget(self):
+        lease = ThrottleLease()
+        lease.acquire(window=1, take=self.take, lease_size=10, flush_interval=60)
+        lease.acquire(window=2, take=self.take, lease_size=10, flush_interval=60)
+        self.assertEqual(self.takes, [(0, 10), (9, 0), (0, 10)])
+
+    def test_evicted_and_idle_leases_release(self):
+        leases = ThrottleLeases(max_size=1, flush_interval=60)
+        leases.get('a').acquire(window=1, take=self.take, lease_size=10, flush_interval=60)
+        leases.get('b').acquire(window=1, take=self.take, lease_size=10, flush_interval=60)
+        self.assertEqual(self.takes, [(0, 10), (9, 0), (0, 10)])
+
+        self.assertEqual(leases.flush(), 0)
+        self.assertEqual(leases.flush(idle=0), 9)
+
+
+class EventRateThrottleTests(SimpleTestCase):
+
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.request = SimpleNamespace(user=SimpleNamespace(pk=1, is_authenticated=True))
+        self.leases = ThrottleLeases(max_size=10, flush_interval=60)
+
+    def allow_requests(self, n, **attrs):
+        with mock.patch.multiple(EventRateThrottle, rate=3, leases=self.leases, **attrs):
+            return [EventRateThrottle().allow_request(self.request, None) for _ in range(n)]
+
+    def test_sliding_window(self):
+        self.assertEqual(self.allow_requests(4, lease_mode=False), [True, True, True, False])
+        self.assertEqual(self.request.rate_limit[:2], (3, 0))
+
+    def test_lease_mode(self):
+        self.assertEqual(
+            self.allow_requests(4, lease_mode=True, lease_tolerance=0.5), [True, True, True, False]
+        )
+        throttle = EventRateThrottle()
+        throttle.key = throttle.get_cache_key(self.request, None)
+        current_key = throttle.get_window_keys(timezone.now().timestamp())[0]
+        self.assertEqual(int(get_redis_connection('default').get(current_key)), 3)
+
+    def test_idle_lease_returns_budget(self):
+        self.allow_requests(1, lease_mode=True, lease_tolerance=1)
+        throttle = EventRateThrottle()
+        throttle.key = throttle.get_cache_key(self.request, None)
+        current_key = throttle.get_window_keys(timezone.now().timestamp())[0]
+        redis = get_redis_connection('default')
+        self.assertEqual(int(redis.get(current_key)), 3)
+
+        self.leases.flush(idle=0)
+        self.assertEqual(int(redis.get(current_key)), 1)
@@ -1,20 +1,216 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
 from rest_framework.throttling import UserRateThrottle
 
-from time import time
+import atexit
+from collections import OrderedDict
+import logging
+import os
+import threading
+from time import monotonic, sleep, time
+
+logger = logging.getLogger('service')
+
+# Sliding window over the current and previous fixed window counters, the previous
+# window is weighted by its overlap with the sliding window. Single round trip.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local limit = tonumber(ARGV[1])
+local count = math.floor(previous * tonumber(ARGV[2])) + current
+if count >= limit then
+    return {0, count}
+end
+if redis.call('INCR', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+end
+return {1, count + 1}
+"""
+
+# Lease mode, reserves a budget of the global quota in one round trip and returns
+# the unused budget (delta) when renewing the lease. ARGV[4] returned, ARGV[5] requested
+LEASE_SCRIPT = """
+local returned = tonumber(ARGV[4])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0') - returned
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local limit = tonumber(ARGV[1])
+local count = math.floor(previous * tonumber(ARGV[2])) + current
+local granted = math.max(math.min(tonumber(ARGV[5]), limit - count), 0)
+if granted ~= returned then
+    redis.call('INCRBY', KEYS[1], granted - returned)
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+end
+return {granted, count + granted}
+"""
+
+RATE_LIMIT_HEADERS = ('X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset')
+
+
+class ThrottleLease(object):
+    """
+    In process budget leased from a global throttle quota. Requests are counted
+    locally and the lease is renewed, returning the unused budget, when it is
+    used up or on the first request after `flush_interval` seconds. The unused
+    budget of an idle lease is returned by `release`, see `ThrottleLeases`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.window = None
+        self.granted = 0
+        self.used = 0
+        self.count = 0
+        self.renewed_at = None
+        self.take = None # Renewal of the current window
+
+    def acquire(self, window: int, take: callable, lease_size: int, flush_interval: float):
+        """
+        Use one unit of the lease, `take(returned, requested)` renews the lease
+        and returns the granted budget and global count. Returns allowed, count
+        """
+        with self._lock:
+            now = monotonic()
+            if window != self.window:
+                # Unused budget is returned to the window it was taken from
+                self._release()
+                self.window = window
+            elif self.renewed_at is not None and now - self.renewed_at < flush_interval:
+                # Quota exhausted until the next renewal
+                if self.granted == 0:
+                    return False, self.count
+                if self.used < self.granted:
+                    self.used += 1
+                    return True, self.count
+
+            self.granted, self.count = take(self.granted - self.used, lease_size)
+            self.take = take
+            self.used = 0
+            self.renewed_at = now
+            if self.granted == 0:
+                return False, self.count
+            self.used = 1
+            return True, self.count
+
+    def _release(self):
+        unused = self.granted - self.used
+        if unused > 0 and self.take is not None:
+            self.take(unused, 0)
+        self.granted, self.used, self.renewed_at = 0, 0, None
+
+    def release(self, idle: float = 0) -> int:
+        """Return the unused budget of a lease not renewed for `idle` seconds, returns the budget"""
+        with self._lock:
+            if self.renewed_at is None or monotonic() - self.renewed_at < idle:
+                return 0
+            unused = self.granted - self.used
+            try:
+                self._release()
+            except RedisError as e:
+                logger.warning(f"Throttle lease release failed: {e}", extra={'task': 'ThrottleLease'})
+                return 0
+            return unused
+
+
+class ThrottleLeases(object):
+    """
+    Bounded LRU registry of the throttle leases of a process. A daemon thread
+    returns the unused budget of leases idle for `flush_interval`, evicted leases
+    and leases held at interpreter exit return their budget as well.
+    """
+
+    def __init__(self, max_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._leases = OrderedDict()
+        self._flusher_pid = None
+
+    def get(self, key: str) -> ThrottleLease:
+        self._ensure_flusher()
+        with self._lock:
+            lease = self._leases.get(key, None)
+            if lease is None:
+                lease = self._leases[key] = ThrottleLease()
+            self._leases.move_to_end(key)
+            evicted = []
+            while len(self._leases) > self.max_size:
+                evicted.append(self._leases.popitem(last=False)[1])
+        for evicted_lease in evicted:
+            evicted_lease.release()
+        return lease
+
+    def flush(self, idle: float = None) -> int:
+        """Return the unused budget of leases idle for `idle` seconds (default `flush_interval`)"""
+        idle = self.flush_interval if idle is None else idle
+        with self._lock:
+            leases = list(self._leases.values())
+        return sum(lease.release(idle=idle) for lease in leases)
+
+    def _ensure_flusher(self):
+        # One flusher thread per process, restarted after a fork
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._leases.clear()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+            if self._flusher_pid is None:
+                atexit.register(self.flush, idle=0)
+            self._flusher_pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Throttle lease flush failed', exc_info=True, extra={'task': 'ThrottleLeases'})
 
 
 class EventRateThrottle(UserRateThrottle):
+    """
+    Atomic sliding window throttle per user, counted in Redis by a Lua script.
+    Remaining quota is set on `request.rate_limit` for the rate limit headers.
+
+    With `lease_mode` requests are counted against an in process budget leased
+    from the global quota, a lease of `lease_tolerance` of the rate is taken
+    per Redis round trip. Leases never exceed the global quota. Unused budget is
+    returned on renewal, or by the `ThrottleLeases` flusher once the lease is idle
+    for `lease_flush_interval`.
+    """
+    scope = 'user'
     rate = 2500
     duration = 86400
+    lease_mode = settings.EVENT_THROTTLE_LEASE_MODE
+    lease_tolerance = settings.EVENT_THROTTLE_LEASE_TOLERANCE
+    lease_flush_interval = settings.EVENT_THROTTLE_LEASE_FLUSH_MS / 1000
+    leases = ThrottleLeases(max_size=settings.LOCAL_CACHE_MAX_SIZE, flush_interval=lease_flush_interval)
 
     def __init__(self):
         pass
 
+    def get_ident(self, request):
+        return request.user.pk
+
+    def get_rate(self, request):
+        return self.rate
+
     def get_cache_key(self, request, view):
         if request.user.is_authenticated:
-            user_key = request.user.pk
-            day_ley = int(time() // 86400)
-            return f"throttle_event:{day_ley}:{user_key}"
+            ident = self.get_ident(request)
+            if ident is not None:
+                return f"throttle_event:{self.scope}:{ident}"
+
+    def get_window_keys(self, now: float):
+        window = int(now // self.duration)
+        return (
+            cache.make_key(f"{self.key}:{window}"),
+            cache.make_key(f"{self.key}:{window - 1}"),
+        )
 
     def allow_request(self, request, view):
         """
@@ -29,26 +225,85 @@ class EventRateThrottle(UserRateThrottle):
         if self.key is None:
             return True
 
-        self.history = self.cache.get(self.key, {})
-        self.history_count = self.history.get("count", 0)
+        limit = self.get_rate(request)
+        now = time()
+        elapsed = now % self.duration
+        keys = self.get_window_keys(now)
+        args = [limit, 1 - elapsed / self.duration, self.duration * 2]
+        try:
+            if self.lease_mode:
+                allowed, count = self.get_lease().acquire(
+                    window=int(now // self.duration),
+                    take=lambda returned, requested: self.take_lease(keys, args, returned, requested),
+                    lease_size=max(int(limit * self.lease_tolerance), 1),
+                    flush_interval=self.lease_flush_interval
+                )
+            else:
+                script = get_redis_connection('default').register_script(SLIDING_WINDOW_SCRIPT)
+                allowed, count = script(keys=keys, args=args)
+        except RedisError as e:
+            # Fail open, throttling must not take the API down
+            logger.warning(f"Throttle unavailable `{self.key}`: {e}", extra={'task': 'EventRateThrottle'})
+            return True
+
+        self.history_count = count
         request.history_count = self.history_count
-        
-        # Set Headers
-        if self.history_count > self.rate:
+        self.set_rate_limit(request, limit, count, self.duration - elapsed)
+
+        if not allowed:
             return self.throttle_failure()
         return self.throttle_success()
 
+    def get_lease(self) -> ThrottleLease:
+        return self.leases.get(self.key)
+
+    def take_lease(self, keys, args, returned: int, requested: int):
+        script = get_redis_connection('default').register_script(LEASE_SCRIPT)
+        granted, count = script(keys=keys, args=args + [returned, requested])
+        return granted, count
+
+    def set_rate_limit(self, request, limit: int, count: int, reset: float):
+        """Keep the most restrictive throttle quota for the rate limit headers"""
+        self.reset = reset
+        remaining = max(limit - count, 0)
+        current = getattr(request, 'rate_limit', None)
+        if current is None or remaining < current[1]:
+            request.rate_limit = (limit, remaining, int(reset))
+
     def throttle_success(self):
-        """
-        Inserts the current request's timestamp along with the key
-        into the cache.
-        """
-        self.history.update({"count": self.history.get("count", 0) + 1})
-        self.cache.set(self.key, self.history, self.duration)
         return True
 
     def throttle_failure(self):
         """
         Called when a request to the API has failed due to throttling.
         """
-        return False
\ No newline at end of file
+        return False
+
+    def wait(self):
+        return getattr(self, 'reset', None)
+
+
+class CustomerEventRateThrottle(EventRateThrottle):
+    """
+    Atomic sliding window throttle shared by all users of a customer, limits
+    per customer are overridden by `settings.EVENT_THROTTLE_CUSTOMER_RATES`
+    """
+    scope = 'customer'
+    rate = 25000
+
+    def get_ident(self, request):
+        return request.user.customer_id
+
+    def get_rate(self, request):
+        return getattr(settings, 'EVENT_THROTTLE_CUSTOMER_RATES', {}).get(
+            str(request.user.customer_id), self.rate
+        )
+
+
+def set_rate_limit_headers(request, response):
+    """Set the rate limit headers of the throttles run on the request"""
+    rate_limit = getattr(request, 'rate_limit', None)
+    if rate_limit is not None:
+        for header, value in zip(RATE_LIMIT_HEADERS, rate_limit):
+            response[header] = str(value)
+    return response
@@ -1,6 +1,17 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
 
-from utils.yahp.pagination import CachedDjangoPaginator
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from utils.yahp.pagination import CachedDjangoPaginator, estimate_count
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import binascii
+import json
 
 
 class CachedDjangoPagination(PageNumberPagination):
@@ -9,3 +20,125 @@ class CachedDjangoPagination(PageNumberPagination):
 	page_size = 20
 	page_size_query_param = 'page_size'
 	max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+	"""
+	Keyset (cursor) Django Rest Paginator for large tables, pages are filtered on the
+	sortable column and UUID primary key of the last row instead of an OFFSET.
+
+	Cursors are opaque and no COUNT query is run, `count` is the planner estimate.
+	The response keeps the `count`, `next`, `previous` and `results` shape. Set the
+	ordering with `keyset_ordering` on the view, e.g. `-observation_datetime`, the
+	ordering field must be a non nullable field of the model.
+	"""
+	page_size = 20
+	page_size_query_param = 'page_size'
+	max_page_size = 100
+	cursor_query_param = 'cursor'
+	ordering = '-created_on'
+	invalid_cursor_message = 'Invalid cursor'
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.request = request
+		self.page_size = self.get_page_size(request)
+		self.base_url = request.build_absolute_uri()
+		self.field, self.descending = self.get_ordering(view)
+		if queryset.model._meta.get_field(self.field).null:
+			raise ImproperlyConfigured(f"Keyset ordering field `{self.field}` can not be nullable")
+		self.count = estimate_count(queryset)
+
+		cursor = self.decode_cursor(request, queryset.model)
+		reverse = cursor is not None and cursor['r']
+		# Descending pages forward are before the cursor, flipped when paging backward
+		before = self.descending != reverse
+		order_prefix = '-' if before else ''
+		queryset = queryset.order_by(f"{order_prefix}{self.field}", f"{order_prefix}pk")
+
+		if cursor is not None:
+			lookup = 'lt' if before else 'gt'
+			queryset = queryset.filter(
+				Q(**{f"{self.field}__{lookup}": cursor['v']})
+				| Q(**{self.field: cursor['v'], f"pk__{lookup}": cursor['pk']})
+			)
+
+		results = list(queryset[:self.page_size + 1])
+		has_more = len(results) > self.page_size
+		results = results[:self.page_size]
+		if reverse:
+			results.reverse()
+			self.has_next, self.has_previous = True, has_more
+		else:
+			self.has_next, self.has_previous = has_more, cursor is not None
+
+		self.page = results
+		return results
+
+	def get_paginated_response(self, data):
+		return Response(OrderedDict([
+			('count', self.count),
+			('next', self.get_next_link()),
+			('previous', self.get_previous_link()),
+			('results', data)
+		]))
+
+	def get_paginated_response_schema(self, schema):
+		return {
+			'type': 'object',
+			'properties': {
+				'count': {'type': 'integer', 'nullable': True},
+				'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+				'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+				'results': schema,
+			},
+		}
+
+	def get_page_size(self, request):
+		if self.page_size_query_param:
+			try:
+				return _positive_int(
+					request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size
+				)
+			except (KeyError, ValueError):
+				pass
+		return self.page_size
+
+	def get_ordering(self, view):
+		ordering = getattr(view, 'keyset_ordering', None) or self.ordering
+		return ordering.lstrip('-'), ordering.startswith('-')
+
+	def get_next_link(self):
+		if not self.has_next or not self.page:
+			return None
+		return self.encode_cursor(self.page[-1], reverse=False)
+
+	def get_previous_link(self):
+		if not self.has_previous or not self.page:
+			return None
+		return self.encode_cursor(self.page[0], reverse=True)
+
+	def encode_cursor(self, instance, reverse: bool):
+		# Full precision (microsecond) values, truncated values skip or repeat rows
+		value = getattr(instance, self.field)
+		if hasattr(value, 'isoformat'):
+			value = value.isoformat()
+		cursor = {'v': value, 'pk': str(instance.pk), 'r': reverse}
+		encoded = urlsafe_b64encode(json.dumps(cursor, default=str).encode()).decode()
+		return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+	def decode_cursor(self, request, model):
+		"""Decode and validate a cursor, values are converted with the model fields"""
+		encoded = request.query_params.get(self.cursor_query_param)
+		if encoded is None:
+			return None
+		try:
+			cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+			if not isinstance(cursor, dict) or not {'v', 'pk', 'r'} <= set(cursor):
+				raise ValueError
+			if not isinstance(cursor['r'], bool) or cursor['v'] is None or cursor['pk'] is None:
+				raise ValueError
+			cursor['v'] = model._meta.get_field(self.field).to_python(cursor['v'])
+			cursor['pk'] = model._meta.pk.to_python(cursor['pk'])
+		except (TypeError, ValueError, ValidationError, binascii.Error, UnicodeDecodeError):
+			raise NotFound(self.invalid_cursor_message)
+		return cursor
@@ -1,6 +1,15 @@
 from django.core.cache import cache
 
-from typing import Dict
+from django_redis import get_redis_connection
+
+from utils.yahp.local_cache import TWO_TIER_CACHE
+
+from collections import namedtuple
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, List, Tuple
 
 # Cache items
 MINUTE = 60
@@ -10,6 +19,86 @@ WEEK = DAY*7
 MONTH = DAY*30
 
 
+# Stampede protection
+STAMPEDE_LOCK_TIMEOUT = 10 # Max seconds a single worker holds a rebuild lock
+STAMPEDE_WAIT = 2 # Max seconds waiting on another worker rebuilding a key
+STAMPEDE_POLL_INTERVAL = 0.05
+STALE_DURATION = MINUTE*5 # Seconds an expired value is kept to serve while rebuilding
+EARLY_REFRESH_BETA = 1.0 # Probabilistic early refresh, > 1 favours earlier refresh
+
+# Cached value with the recompute time (delta), logical expiry and computed at (epoch seconds)
+CacheEntry = namedtuple("CacheEntry", ['value', 'delta', 'expires_at', 'computed_at'], defaults=(None,))
+
+
+def get_entry_value(entry: Any) -> Any:
+    """Value of a CacheEntry, values cached before entries were introduced are returned as is"""
+    if isinstance(entry, CacheEntry):
+        return entry.value
+    return entry
+
+
+def should_refresh(entry: Any, beta: float = EARLY_REFRESH_BETA) -> bool:
+    """
+    Probabilistic early refresh (XFetch), entries are renewed before they expire
+    with a probability increasing with the recompute time and the time to expiry
+    """
+    if entry is None:
+        return True
+    if not isinstance(entry, CacheEntry):
+        return False
+    return time.time() - entry.delta * beta * math.log(random.random() or 1e-12) >= entry.expires_at
+
+
+def make_entry(value: Any, delta: float, duration: int) -> CacheEntry:
+    now = time.time()
+    return CacheEntry(value=value, delta=delta, expires_at=now + duration, computed_at=now)
+
+
+def get_or_recompute(cache_key: str,
+                     recompute: callable,
+                     duration: int,
+                     backend=cache,
+                     beta: float = EARLY_REFRESH_BETA) -> Any:
+    """
+    Get a cached value, recomputing it with single flight stampede protection.
+
+    Only the worker acquiring a short Redis lock recomputes a missing, expired or
+    early refreshed key. Other workers serve the stale value when there is one,
+    else wait briefly for the rebuild, falling back to recomputing themselves.
+    Values are kept `STALE_DURATION` past their logical expiry to serve stale.
+    """
+    entry = backend.get(cache_key, None)
+    if not should_refresh(entry, beta=beta):
+        return get_entry_value(entry)
+
+    lock_key = f"lock:{cache_key}"
+    if cache.add(lock_key, 1, STAMPEDE_LOCK_TIMEOUT):
+        try:
+            start = time.time()
+            value = recompute()
+            backend.set(cache_key, make_entry(value, time.time() - start, duration), duration + STALE_DURATION)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # Another worker is rebuilding the key
+    if entry is not None:
+        return get_entry_value(entry)
+
+    deadline = time.monotonic() + STAMPEDE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(STAMPEDE_POLL_INTERVAL)
+        entry = cache.get(cache_key, None)
+        if entry is not None:
+            return get_entry_value(entry)
+
+    # Rebuild did not complete in time
+    start = time.time()
+    value = recompute()
+    backend.set(cache_key, make_entry(value, time.time() - start, duration), duration + STALE_DURATION)
+    return value
+
+
 def get_user_state(request, state_key):
     return cache.get(f'{request.user.pk}:state:{state_key}', None)
 
@@ -18,14 +107,62 @@ def set_user_state(request, state_key, obj):
     cache.set(f'{request.user.pk}:state:{state_key}', obj, DAY*5)
 
 
-def delete_model_cache(model_name: str, id: int = None):
-    """ Helper function to clear out keys for CachedSerializer"""
-    prefix = f"cached_obj:{model_name}:"
-    prefix = f"{prefix}{id}:*" if id is not None else f"{prefix}*"
+def get_generation_key(model_name: str, id=None) -> str:
+    """Generation counter key for a model or a model object"""
+    if id is None:
+        return f"cached_obj_gen:{model_name}"
+    return f"cached_obj_gen:{model_name}:{id}"
 
-    keys = cache.keys(prefix)
-    for cache_key in keys:
-        cache.delete(cache_key)
+
+def get_generations(model_name: str, ids: List) -> Dict[str, Tuple[int, int]]:
+    """
+    Model and per id generation counters for CachedSerializer keys in one
+    `get_many`, keyed by `str(id)`. Counters not yet incremented are 0.
+
+    Counters are held in the local L1 cache and invalidated across processes
+    when incremented.
+    """
+    model_key = get_generation_key(model_name)
+    id_keys = {str(id): get_generation_key(model_name, id) for id in ids}
+    keys = [model_key, *id_keys.values()]
+    values = TWO_TIER_CACHE.get_many(keys)
+
+    # Hold counters not yet incremented locally as well
+    TWO_TIER_CACHE.local_cache.set_many({key: 0 for key in keys if key not in values})
+    model_generation = values.get(model_key, 0)
+    return {id: (model_generation, values.get(key, 0)) for id, key in id_keys.items()}
+
+
+def purge_model_cache(model_name: str = None, id=None) -> int:
+    """
+    Physically delete CachedSerializer keys with an incremental SCAN, which does
+    not block Redis like KEYS. Invalidation does not require a purge, stale
+    generations expire with the serializer duration. All models are purged when
+    no model name is provided.
+    """
+    if model_name is None:
+        return cache.delete_pattern("cached_obj:*", itersize=1000)
+    pattern = f"cached_obj:{model_name}:"
+    pattern = f"{pattern}{id}:*" if id is not None else f"{pattern}*"
+    return cache.delete_pattern(pattern, itersize=1000)
+
+
+def delete_model_cache(model_name: str, id: int = None, purge: bool = False):
+    """
+    Helper function to invalidate keys for CachedSerializer with a single INCR
+    of the model, or model object, generation embedded in the cache keys.
+
+    purge bool
+        Also delete the stale keys with a SCAN in a background thread
+    """
+    generation_key = get_generation_key(model_name, id)
+    get_redis_connection('default').incr(cache.make_key(generation_key))
+    TWO_TIER_CACHE.invalidate([generation_key])
+
+    if purge:
+        threading.Thread(
+            target=purge_model_cache, kwargs={'model_name': model_name, 'id': id}, daemon=True
+        ).start()
 
 
 class CachedSerializer(object):
@@ -61,21 +198,85 @@ class CachedSerializer(object):
         if self.id is None and self.instance is not None:
             self.id = self.instance.pk
 
+    @classmethod
+    def get_model_name(cls) -> str:
+        return cls.model_name or cls.model_class.__name__.lower()
+
+    @classmethod
+    def get_cache_key(cls, id, generation: Tuple[int, int]) -> str:
+        # `cached_obj`:<obj_name>:<id>:<serialized_type>:<model_gen>.<id_gen>`
+        return f"cached_obj:{cls.get_model_name()}:{id}:{cls.serializer_name}:{generation[0]}.{generation[1]}"
+
+    @classmethod
+    def many(cls, ids: List = None, instances: List = None, context: Dict = None) -> List[Dict]:
+        """
+        Serialized data for many objects with one `get_many` for the generations,
+        one `get_many` for the data, one `filter(pk__in=...)` for the misses and
+        one `set_many`, in the order of the ids/instances provided. Ids not found
+        in the database are omitted.
+
+        CachedUserSerializer.many(ids=[...])
+        CachedUserSerializer.many(instances=queryset)
+        """
+        assert ids is not None or instances is not None, "Must provide ids or instances"
+        assert cls.model_class is not None and cls.serializer_class is not None, "Improperly configured"
+
+        if ids is None:
+            instances = list(instances)
+            ids = [instance.pk for instance in instances]
+
+        generations = get_generations(cls.get_model_name(), ids)
+        key_map = {str(id): cls.get_cache_key(id, generations[str(id)]) for id in ids}
+        cache_keys = [key_map[str(id)] for id in ids]
+
+        entries = TWO_TIER_CACHE.get_many(cache_keys)
+        # Expired entries are kept to serve stale, refresh them with the misses
+        results = {
+            cache_key: get_entry_value(entry) for cache_key, entry in entries.items()
+            if not should_refresh(entry)
+        }
+
+        # Load and Serialize Misses
+        missing_ids = [id for id, cache_key in zip(ids, cache_keys) if cache_key not in results]
+        if missing_ids:
+            if instances is not None:
+                missing_instances = [
+                    instance for instance in instances if key_map[str(instance.pk)] not in results
+                ]
+            else:
+                missing_instances = cls.model_class.objects.filter(pk__in=missing_ids)
+
+            start = time.time()
+            missing_results = {
+                key_map[str(instance.pk)]: cls.serializer_class(instance, context=context).data
+                for instance in missing_instances
+            }
+            delta = (time.time() - start) / max(len(missing_results), 1)
+            TWO_TIER_CACHE.set_many(
+                {
+                    cache_key: make_entry(value, delta, cls.duration)
+                    for cache_key, value in missing_results.items()
+                },
+                cls.duration + STALE_DURATION
+            )
+            results.update(missing_results)
+
+        return [results[cache_key] for cache_key in cache_keys if cache_key in results]
+
     @property
     def data(self):
-        # `cached_obj`:<obj_name>:<id>:<serialized_type>`
-        cache_key = f"cached_obj:{self.model_name}:{self.id}:{self.serializer_name}"
-
-        # Get Cache or Update
-        result = cache.get(cache_key, None)
-
-        # Get Update
-        if result is None:
-            if self.instance is None:
-                self.instance = self.model_class.objects.get(pk=self.id)
-            result = self.serializer_class(
-                self.instance, context=self.context
-            ).data
-            cache.set(cache_key, result, self.duration)
-
-        return result
+        generation = get_generations(self.model_name, [self.id])[str(self.id)]
+        cache_key = self.get_cache_key(self.id, generation)
+
+        # Get Cache or Update, single worker recomputes on expiry
+        return get_or_recompute(
+            cache_key=cache_key, recompute=self._serialize, duration=self.duration,
+            backend=TWO_TIER_CACHE
+        )
+
+    def _serialize(self):
+        if self.instance is None:
+            self.instance = self.model_class.objects.get(pk=self.id)
+        return self.serializer_class(
+            self.instance, context=self.context
+        ).data
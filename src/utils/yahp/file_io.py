@@ -1,91 +1,264 @@
+from django.core.cache import cache
 from django.core.files import File
 from django.db.models import FileField
 
+from utils.yahp.cache import WEEK
+
+from collections import namedtuple
+import codecs
+import csv
 import io
+from itertools import islice
+import json
 import numpy as np
 import pandas as pd
+import shutil
+import tempfile
+from typing import Iterator
+
+# Default rows per chunk when streaming files
+DEFAULT_STREAM_CHUNKSIZE = 50000
+
+# Bytes per read when copying remote files to spooled temporary files
+STREAM_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Max bytes of a spooled temporary file kept in memory before rolling to disk
+STREAM_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+# Bytes read from the start of a CSV file to detect its dialect
+CSV_SNIFF_SIZE = 64 * 1024
+
+# Supported CSV delimiters: comma, tab, pipe and semicolon
+CSV_DELIMITERS = ',\t|;'
+
+CSV_DIALECT_CACHE_DURATION = WEEK
+
+# Bytes per read when looking for the first non whitespace byte of a JSON file
+JSON_SNIFF_SIZE = 4 * 1024
+
+# Characters per read when decoding JSON arrays incrementally
+JSON_READ_SIZE = 64 * 1024
+
+CsvDialect = namedtuple("CsvDialect", ['encoding', 'delimiter', 'quotechar', 'header'])
 
 
 class FileException(Exception):
     pass
 
 
-def read_csv_file(file_bytes, nrows=None, chunksize=None):
+class StreamingBodyReader(io.RawIOBase):
+    """
+    Raw IO adapter for streaming bodies (botocore StreamingBody) which only
+    implement `read(amt)`, allows wrapping in a buffered reader for Pandas
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.body.close()
+        super().close()
+
+
+class PrefixedReader(io.RawIOBase):
+    """
+    Raw IO adapter returning already consumed leading bytes before the remainder
+    of a non seekable stream
+    """
+
+    def __init__(self, prefix: bytes, stream):
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if len(self.prefix) > 0:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+def open_file_stream(file_field: FileField) -> io.BufferedIOBase:
+    """
+    Open a binary stream of a FileField without reading the file into memory.
+
+    S3 backed storages (`PrivateMediaStorage` etc.) stream the object body
+    directly, as the storage file object downloads the whole object on first read.
+    """
+    storage = file_field.storage
+    if hasattr(storage, 'bucket') and hasattr(storage, '_normalize_name'):
+        name = storage._normalize_name(storage._clean_name(file_field.name))
+        body = storage.bucket.Object(name).get()['Body']
+        return io.BufferedReader(StreamingBodyReader(body), buffer_size=STREAM_COPY_BUFFER_SIZE)
+
+    file_field.open('rb')
+    file_field.seek(0, 0)
+    return file_field.file
+
+
+def spool_file_stream(stream) -> tempfile.SpooledTemporaryFile:
+    """
+    Copy a stream into a seekable spooled temporary file in bounded size reads,
+    small files stay in memory, large files roll over to disk
+    """
+    spooled_file = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MAX_SIZE)
+    shutil.copyfileobj(stream, spooled_file, STREAM_COPY_BUFFER_SIZE)
+    spooled_file.seek(0, 0)
+    return spooled_file
+
+
+def sniff_csv_dialect(sample: bytes) -> CsvDialect:
+    """
+    Detect encoding, delimiter, quoting and header row from the first bytes of
+    a CSV file in a single pass
+
+    Parameters
+    -----------
+        sample bytes
+            Leading bytes of the file, see `CSV_SNIFF_SIZE`
+    Returns
+    -----------
+        dialect CsvDialect
+            Dialect to pass to `pd.read_csv`, header is the number of leading
+            preamble lines, which do not parse as delimited rows, before the header row
+    """
+    # Encoding, a truncated multi byte character at the end of the sample is allowed
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
+        encoding = 'utf-8'
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        encoding = 'latin1'
+        text = sample.decode(encoding)
+
+    lines = text.splitlines()
+    # Drop the last, possibly partial, line of a truncated sample
+    if len(sample) >= CSV_SNIFF_SIZE and len(lines) > 1:
+        lines = lines[:-1]
+    if len(lines) == 0:
+        return CsvDialect(encoding=encoding, delimiter=',', quotechar='"', header=0)
+
+    # Delimiter and quoting
+    try:
+        sniffed = csv.Sniffer().sniff('\n'.join(lines), delimiters=CSV_DELIMITERS)
+        delimiter, quotechar = sniffed.delimiter, sniffed.quotechar or '"'
+    except csv.Error:
+        first_line = next((line for line in lines if line.strip()), '')
+        delimiter = max(CSV_DELIMITERS, key=first_line.count)
+        if first_line.count(delimiter) == 0:
+            delimiter = ','
+        quotechar = '"'
+
+    # Header is the first row, unless leading preamble lines do not parse as delimited rows
+    field_counts = [
+        len(row) for row in csv.reader(lines, delimiter=delimiter, quotechar=quotechar)
+    ]
+    header = next((index for index, count in enumerate(field_counts) if count > 1), 0)
+    body_counts = [count for count in field_counts[header + 1:] if count > 0]
+    if header > 0 and not (body_counts and all(count > 1 for count in body_counts)):
+        header = 0
+
+    return CsvDialect(encoding=encoding, delimiter=delimiter, quotechar=quotechar, header=header)
+
+
+def get_csv_dialect(file_bytes, source: str = None):
+    """
+    Get the CSV dialect for a file, cached per upload source when provided
+
+    Returns
+    -----------
+        dialect CsvDialect
+            Detected or cached dialect
+        file_bytes io.BufferedIOBase
+            Stream positioned at the start of the file
+    """
+    cache_key = f"csv_dialect:{source}" if source is not None else None
+    if cache_key is not None:
+        dialect = cache.get(cache_key, None)
+        if dialect is not None:
+            return CsvDialect(*dialect), file_bytes
+
+    sample = file_bytes.read(CSV_SNIFF_SIZE)
+    if file_bytes.seekable():
+        file_bytes.seek(0, 0)
+    else:
+        # Re-attach the sample to non seekable (S3) streams
+        file_bytes = io.BufferedReader(PrefixedReader(sample, file_bytes))
+
+    dialect = sniff_csv_dialect(sample)
+    if cache_key is not None:
+        cache.set(cache_key, tuple(dialect), CSV_DIALECT_CACHE_DURATION)
+    return dialect, file_bytes
+
+
+def read_csv_file(file_bytes, nrows=None, chunksize=None, source: str = None, engine: str = 'c'):
     """
     Helper function to read in CSV Files
+
+    The dialect (encoding, delimiter, quoting and header row) is sniffed from the
+    first bytes of the file and passed into a single `pd.read_csv` call.
+
+    source str
+        Optional customer upload source, detected dialects are cached per source
+    engine str
+        Pandas parser engine, `pyarrow` is only used when reading the whole file
     """
     try:
-        # Get columns - pandas does not allow access to columns for chunked dataframe, so read the top row
-        temp_df = pd.read_csv(
+        dialect, file_bytes = get_csv_dialect(file_bytes=file_bytes, source=source)
+    except Exception as e:
+        raise FileException(e)
+
+    # Pyarrow engine does not support reading in chunks or partial files
+    if engine == 'pyarrow' and (chunksize is not None or nrows is not None):
+        engine = 'c'
+
+    def _read_csv(encoding):
+        return pd.read_csv(
             file_bytes,
+            encoding=encoding,
+            sep=dialect.delimiter,
+            quotechar=dialect.quotechar,
+            skiprows=dialect.header or None,
             on_bad_lines='skip',
             index_col=False,
             dtype=str,
-            nrows=1,
+            nrows=nrows,
+            chunksize=chunksize,
+            engine=engine,
         )
-        columns = temp_df.columns
 
-        # Check if the file is tab separated
-        if len(columns) == 1 and (columns or [''])[0].count('\t') > 1:
-            file_bytes.seek(0, 0)
-            df = pd.read_csv(
-                file_bytes,
-                on_bad_lines='skip',
-                index_col=False,
-                dtype=str,
-                nrows=nrows,
-                chunksize=chunksize,
-                sep='\t'
-            )
-        else:
-            file_bytes.seek(0, 0)
-            df = pd.read_csv(
-                file_bytes,
-                on_bad_lines='skip',
-                index_col=False,
-                dtype=str,
-                nrows=nrows,
-                chunksize=chunksize,
-            )
-
-    except UnicodeDecodeError:
-        # Repeat logic with latin1 encoding
+    try:
+        df = _read_csv(encoding=dialect.encoding)
+    except UnicodeDecodeError as e:
+        # Invalid bytes after the sniffed sample, repeat with latin1 when possible
+        if dialect.encoding == 'latin1' or not file_bytes.seekable():
+            raise FileException(e)
+        # Fallback is per file, the cached source dialect is kept
+        dialect = dialect._replace(encoding='latin1')
         try:
-            # Update the read position of the file bytes back to start
             file_bytes.seek(0, 0)
-            temp_df = pd.read_csv(
-                file_bytes,
-                encoding='latin1',
-                on_bad_lines='skip',
-                index_col=False,
-                dtype=str,
-                nrows=1,
-            )
-            columns = temp_df.columns
-            # Check if the file is tab separated
-            if len(temp_df.columns) == 1 and (temp_df.columns or [''])[0].count('\t') > 1:
-                file_bytes.seek(0, 0)
-                df = pd.read_csv(
-                    file_bytes,
-                    encoding='latin1',
-                    on_bad_lines='skip',
-                    index_col=False,
-                    dtype=str,
-                    nrows=nrows,
-                    chunksize=chunksize,
-                    sep='\t'
-                )
-            else:
-                file_bytes.seek(0, 0)
-                df = pd.read_csv(
-                    file_bytes,
-                    encoding='latin1',
-                    on_bad_lines='skip',
-                    index_col=False,
-                    dtype=str,
-                    nrows=nrows,
-                    chunksize=chunksize,
-                )
+            df = _read_csv(encoding=dialect.encoding)
         except Exception as e:
             raise FileException(e)
     except Exception as e:
@@ -112,6 +285,89 @@ def read_excel_file(file_bytes, nrows=None, *args, **kwargs):
             raise FileException(e)
 
 
+def get_json_lines(file_bytes):
+    """
+    Detect a JSON array (`[`) or JSON lines (`{`) file from its first non whitespace
+    byte, returns `(lines, file_bytes)` with the stream positioned at the start
+
+    Parameters
+    -----------
+        file_bytes io.BufferedIOBase
+            Stream positioned at the start of the file
+    """
+    sample = b''
+    while True:
+        chunk = file_bytes.read(JSON_SNIFF_SIZE)
+        sample += chunk
+        leading = sample.lstrip()
+        if leading.startswith(codecs.BOM_UTF8):
+            leading = leading[len(codecs.BOM_UTF8):].lstrip()
+        if leading or not chunk:
+            break
+
+    if file_bytes.seekable():
+        file_bytes.seek(0, 0)
+    else:
+        # Re-attach the sample to non seekable (S3) streams
+        file_bytes = io.BufferedReader(PrefixedReader(sample, file_bytes))
+
+    if leading[:1] == b'[':
+        return False, file_bytes
+    if leading[:1] == b'{':
+        return True, file_bytes
+    raise FileException(f"Not a JSON array or JSON lines file, starts with {leading[:1]!r}")
+
+
+def iter_json_array(file_bytes, read_size: int = JSON_READ_SIZE) -> Iterator:
+    """
+    Yield the items of a top level JSON array decoding the stream incrementally,
+    memory is bounded by the largest item rather than the file size
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8-sig')(file_bytes)
+    buffer, eof = '', False
+
+    def _read_more():
+        nonlocal buffer, eof
+        chunk = reader.read(read_size)
+        eof = not chunk
+        buffer += chunk
+
+    state = 'open' # open -> first -> (separator -> item)*
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                raise FileException('Unexpected end of JSON array')
+            _read_more()
+            continue
+
+        if state == 'open':
+            if buffer[0] != '[':
+                raise FileException('Not a JSON array')
+            buffer, state = buffer[1:], 'first'
+        elif state in ('first', 'separator') and buffer[0] == ']':
+            return
+        elif state == 'separator':
+            if buffer[0] != ',':
+                raise FileException(f"Expected `,` in JSON array, found {buffer[0]!r}")
+            buffer, state = buffer[1:], 'item'
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer)
+                # A number at the end of the buffer may continue in the next read
+                rest = buffer[end:].lstrip()
+                if not eof and (not rest or rest[0] in '0123456789.eE+-'):
+                    raise ValueError
+            except ValueError as e:
+                if eof:
+                    raise FileException(e)
+                _read_more()
+                continue
+            yield item
+            buffer, state = buffer[end:], 'separator'
+
+
 def read_json_file(file_bytes, nrows=None, chunksize=None, *args, **kwargs):
     try:
         return pd.read_json(
@@ -139,13 +395,125 @@ def read_json_file(file_bytes, nrows=None, chunksize=None, *args, **kwargs):
         raise FileException(e)
 
 
-def read_file_to_df(file_field: FileField, nrows=None, chunksize=None):
+def stream_excel_file(file_handle, chunksize=DEFAULT_STREAM_CHUNKSIZE, nrows=None) -> Iterator[pd.DataFrame]:
+    """
+    Stream xlsx rows in chunks with the openpyxl read only row iterator, the
+    first row of the active sheet is used as the header
+    """
+    import openpyxl
+
+    # xlsx files are zip archives that require a seekable file
+    spooled_file = None
+    if not file_handle.seekable():
+        file_handle = spooled_file = spool_file_stream(file_handle)
+
+    try:
+        workbook = openpyxl.load_workbook(file_handle, read_only=True, data_only=True)
+    except Exception as e:
+        if spooled_file is not None:
+            spooled_file.close()
+        raise FileException(e)
+
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(column) if column is not None else f'Unnamed: {i}'
+            for i, column in enumerate(header)
+        ]
+
+        row_count = 0
+        chunk = []
+        for row in rows:
+            if nrows is not None and row_count >= nrows:
+                break
+            chunk.append([None if value is None else str(value) for value in row[:len(columns)]])
+            row_count += 1
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=columns, dtype=str)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns, dtype=str)
+    finally:
+        workbook.close()
+        if spooled_file is not None:
+            spooled_file.close()
+
+
+def stream_file_to_df(file_field: FileField,
+                      chunksize=DEFAULT_STREAM_CHUNKSIZE,
+                      nrows=None,
+                      source: str = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream File into bounded size Pandas DataFrame chunks, accepts in a File Field.
+
+    Chunks are read directly from the storage file handle (including S3 backed
+    storages), so peak memory depends on `chunksize` rather than the file size.
+    xlsx files are read with a read only row iterator, from a spooled temporary
+    file for non seekable (S3) streams. JSON arrays are decoded incrementally,
+    legacy xls files are read in memory.
+    """
+    if file_field is None:
+        raise ValueError('file_field can not be null')
+
+    extension = file_field.name.split('.')[-1].lower()
+    file_handle = open_file_stream(file_field)
+    try:
+        if extension == 'csv':
+            yield from read_csv_file(
+                file_bytes=file_handle, nrows=nrows, chunksize=chunksize, source=source
+            )
+        elif extension == 'xlsx':
+            yield from stream_excel_file(file_handle=file_handle, chunksize=chunksize, nrows=nrows)
+        elif extension == 'json':
+            lines, file_handle = get_json_lines(file_handle)
+            try:
+                if lines:
+                    yield from pd.read_json(
+                        file_handle, dtype=str, lines=True, nrows=nrows, chunksize=chunksize
+                    )
+                else:
+                    # JSON arrays of records, e.g. from `write_file_from_df`
+                    records = islice(iter_json_array(file_handle), nrows)
+                    while True:
+                        chunk = list(islice(records, chunksize))
+                        if not chunk:
+                            break
+                        yield pd.DataFrame(chunk, dtype=str)
+            except ValueError as e:
+                raise FileException(e)
+        elif extension == 'xls':
+            # Legacy Excel files can not be read in rows, read in memory
+            df = read_excel_file(file_bytes=io.BytesIO(file_handle.read()), nrows=nrows)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+        else:
+            raise NotImplementedError(f"File type `{extension}` not supported for streaming")
+    finally:
+        file_handle.close()
+
+
+def read_file_to_df(file_field: FileField, nrows=None, chunksize=None, stream=False, source=None):
     """
     Read File into Pandas DataFrame, accepts in a File Field
+
+    stream bool
+        Stream chunks from the storage file handle without buffering the whole
+        file, see `stream_file_to_df`
+    source str
+        Optional customer upload source, CSV dialects are cached per source
     """
     if file_field is None:
         raise ValueError('file_field can not be null')
 
+    if stream:
+        return stream_file_to_df(
+            file_field=file_field, chunksize=chunksize or DEFAULT_STREAM_CHUNKSIZE, nrows=nrows,
+            source=source
+        )
+
     # File Bytes into Memory to avoid opening file connection multiple times
     file_field.seek(0,0)
     file_bytes = io.BytesIO(file_field.read())
@@ -153,7 +521,7 @@ def read_file_to_df(file_field: FileField, nrows=None, chunksize=None):
     # Looks for file extension (TODO: Add Compression Option)
     extension = file_field.name.split('.')[-1].lower()
     if extension == 'csv':
-        return read_csv_file(file_bytes=file_bytes, nrows=nrows, chunksize=chunksize)
+        return read_csv_file(file_bytes=file_bytes, nrows=nrows, chunksize=chunksize, source=source)
     elif extension in ('xls', 'xlsx'):
         df = read_excel_file(file_bytes=file_bytes, nrows=nrows)
         # Chunk dataframe post load
@@ -196,6 +564,6 @@ def write_file_from_df(df: pd.DataFrame, file_name: str, compress=False) -> File
         return File(file_bytes, name=file_name)
     
     elif extension == 'json':
-        return File(io.BytesIO(df.to_json(index=False, orient='records').encode('utf-8')), name=file_name)
+        return File(io.BytesIO(df.to_json(orient='records').encode('utf-8')), name=file_name)
     else:
         raise NotImplementedError(f"File type `{extension}` not supported")
\ No newline at end of file
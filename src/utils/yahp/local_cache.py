@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from django_redis import get_redis_connection
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+logger = logging.getLogger('service')
+
+# Redis pub/sub channel broadcasting local cache invalidations across processes
+INVALIDATION_CHANNEL = 'local_cache_invalidation'
+
+
+class LocalCache(object):
+    """
+    Bounded, thread safe, in process LRU cache with a short per entry TTL.
+    Values are shared between callers and should be treated as read only.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        results = {}
+        for key in keys:
+            value = self.get(key, None)
+            if value is not None:
+                results[key] = value
+        return results
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            # Evict least recently used
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set_many(self, data: Dict[str, Any], ttl: float = None):
+        for key, value in data.items():
+            self.set(key, value, ttl=ttl)
+
+    def delete_many(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def delete(self, key: str):
+        self.delete_many([key])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TwoTierCache(object):
+    """
+    In process L1 (`LocalCache`) in front of the Django (Redis) cache.
+
+    Reads are served from L1 when present, misses read through to Redis and fill
+    L1. Deletes and invalidations are broadcast over Redis pub/sub, every process
+    runs a listener thread dropping the keys from its L1. The short L1 TTL bounds
+    staleness if an invalidation message is missed.
+    """
+
+    def __init__(self, local_cache: LocalCache, channel: str = INVALIDATION_CHANNEL):
+        self.local_cache = local_cache
+        self.channel = channel
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # One listener per process, restarted after a fork
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self.local_cache.clear()
+            threading.Thread(target=self._listen, daemon=True).start()
+            self._listener_pid = os.getpid()
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                backoff = 1
+                while True:
+                    # Poll rather than block on the socket, which has a read timeout
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    keys = json.loads(message['data'])
+                    if keys is None:
+                        self.local_cache.clear()
+                    else:
+                        self.local_cache.delete_many(keys)
+            except Exception:
+                logger.warning(
+                    'Local cache invalidation listener disconnected', exc_info=True,
+                    extra={'task': 'TwoTierCache'}
+                )
+                # Invalidations may have been missed while disconnected
+                self.local_cache.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self._ensure_listener()
+        value = self.local_cache.get(key, None)
+        if value is not None:
+            return value
+        value = cache.get(key, None)
+        if value is None:
+            return default
+        self.local_cache.set(key, value)
+        return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        self._ensure_listener()
+        results = self.local_cache.get_many(keys)
+        missing_keys = [key for key in keys if key not in results]
+        if missing_keys:
+            missing_results = cache.get_many(missing_keys)
+            self.local_cache.set_many(missing_results)
+            results.update(missing_results)
+        return results
+
+    def set(self, key: str, value: Any, timeout: int = None):
+        cache.set(key, value, timeout)
+        self.local_cache.set(key, value)
+
+    def set_many(self, data: Dict[str, Any], timeout: int = None):
+        cache.set_many(data, timeout)
+        self.local_cache.set_many(data)
+
+    def invalidate(self, keys: List[str]):
+        """Drop keys from L1 in every process, without touching Redis"""
+        self.local_cache.delete_many(keys)
+        try:
+            get_redis_connection('default').publish(self.channel, json.dumps(keys))
+        except Exception:
+            logger.error(
+                'Failed to publish local cache invalidation', exc_info=True,
+                extra={'task': 'TwoTierCache'}
+            )
+
+    def delete_many(self, keys: List[str]):
+        cache.delete_many(keys)
+        self.invalidate(keys)
+
+    def delete(self, key: str):
+        self.delete_many([key])
+
+
+TWO_TIER_CACHE = TwoTierCache(
+    local_cache=LocalCache(max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+)
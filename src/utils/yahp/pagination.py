@@ -1,14 +1,67 @@
+from django.apps import apps
 from django.core.cache import cache
+from django.core import signing
+from django.core.exceptions import EmptyResultSet
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import connections
+from django.db.models import QuerySet
 from django.db.models.sql.query import Query
 from django.db.models.sql.where import WhereNode
 from django.utils.functional import cached_property
 
-from utils.yahp.cache import WEEK
+from utils.queue import publish_task
+from utils.yahp.cache import (
+	STALE_DURATION, WEEK, get_entry_value, get_or_recompute, make_entry, should_refresh
+)
+
+import base64
+import hashlib
+import json
+import logging
+import pickle
+import re
+import time
+from typing import Optional
+
+logger = logging.getLogger('service')
+
+PAGINATION_COUNT_TASK = 'refresh_pagination_count'
+PAGINATION_REFRESH_TIMEOUT = 60*10 # Seconds a key waits on a queued refresh before re-queueing
+PAGINATION_QUERY_SALT = 'utils.yahp.pagination.query' # Signing salt of the queued queryset query
+
+# Count strategies, set `count_strategy` on the paginator or map a filter key to
+# `COUNT_STRATEGY_ESTIMATE` in the model `_meta.default_pagination_count`
+COUNT_STRATEGY_EXACT = 'exact'
+COUNT_STRATEGY_ESTIMATE = 'estimate'
+ESTIMATE_EXACT_THRESHOLD = 10000 # Estimates below the threshold are replaced by an exact count
+
+
+def query_fingerprint(queryset: QuerySet) -> str:
+	"""
+	Canonical fingerprint of a queryset for count caching, the sha1 of the compiled
+	SQL and params without ordering. Covers negation, joins, annotations and
+	expressions, cached on the queryset object.
+	"""
+	fingerprint = getattr(queryset, '_query_fingerprint', None)
+	if fingerprint is not None:
+		return fingerprint
+
+	query = queryset.query.clone()
+	query.clear_ordering(force_empty=True)
+	try:
+		sql, params = query.get_compiler(using=queryset.db).as_sql()
+	except EmptyResultSet:
+		sql, params = 'EMPTY', ()
+	sql = re.sub(r'\s+', ' ', sql).strip()
+	normalized = f"{sql}|{params!r}"
+
+	fingerprint = hashlib.sha1(normalized.encode()).hexdigest()
+	queryset._query_fingerprint = fingerprint
+	return fingerprint
 
 
 def query_filter_key(query: Query):
-	"""Helper function to key Queryset Filter Key to Cache"""
+	"""Helper function to key Queryset Filter Key, readable key for `default_pagination_count` matching"""
 	return f"|{query.where.connector}|".join([get_child_filter(child) for child in query.where.children])
 
 
@@ -21,39 +74,177 @@ def get_child_filter(child: object) -> str:
 	return f"{child.lhs.field.name}|{child.lookup_name}|{child.rhs}"
 
 
+def dump_query(query: Query) -> str:
+	"""Pickle and sign a queryset query for a task message, see `load_query`"""
+	return signing.Signer(salt=PAGINATION_QUERY_SALT).sign(base64.b64encode(pickle.dumps(query)).decode())
+
+
+def load_query(value: str) -> Query:
+	"""Unpickle a query signed by `dump_query`, raises `signing.BadSignature` on tampered messages"""
+	return pickle.loads(base64.b64decode(signing.Signer(salt=PAGINATION_QUERY_SALT).unsign(value)))
+
+
+def estimate_count(queryset: QuerySet) -> Optional[int]:
+	"""
+	PostgreSQL planner row estimate of a queryset, `pg_class.reltuples` for unfiltered
+	tables else the `EXPLAIN` plan rows. None when no estimate is available.
+	"""
+	connection = connections[queryset.db]
+	if connection.vendor != 'postgresql':
+		return None
+
+	query = queryset.query
+	with connection.cursor() as cursor:
+		if not query.where.children and not query.distinct and not query.low_mark and query.high_mark is None:
+			cursor.execute(
+				"SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)",
+				[connection.ops.quote_name(queryset.model._meta.db_table)]
+			)
+			row = cursor.fetchone()
+			# reltuples is -1 for tables never vacuumed or analyzed
+			if row is not None and row[0] >= 0:
+				return int(row[0])
+
+		sql, params = query.sql_with_params()
+		cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+		plan = cursor.fetchone()[0]
+	if isinstance(plan, str):
+		plan = json.loads(plan)
+	return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count(queryset: QuerySet,
+			  strategy: str = COUNT_STRATEGY_EXACT,
+			  threshold: int = ESTIMATE_EXACT_THRESHOLD) -> int:
+	"""Count a queryset exactly or by planner estimate, exact below the threshold"""
+	if strategy == COUNT_STRATEGY_ESTIMATE:
+		count = estimate_count(queryset)
+		if count is not None and count >= threshold:
+			return count
+	return queryset.count()
+
+
 class CachedDjangoPaginator(Paginator):
 	"""
 	Internal Cached Paginator allows for caching query set count based on 
 	filter conditions for slow changing datasets such as Carrier Master List
 	"""
 	cache_duration = WEEK
+	refresh_queue = 'default'
+	count_strategy = None # Defaults to the model `_meta.default_pagination_count` strategy else exact
+	estimate_threshold = ESTIMATE_EXACT_THRESHOLD
+
+	# Epoch seconds the returned count was computed at, None for default counts
+	count_computed_at = None
+
+	@cached_property
+	def cache_key(self):
+		return f"pagination:{self.object_list.model.__name__}:{query_fingerprint(self.object_list)}"
+
+	@cached_property
+	def filter_key(self):
+		return query_filter_key(self.object_list.query)
+
+	def get_default_count(self):
+		# Default to Pagination Count for pre-defined model
+		if not hasattr(self.object_list.model._meta, 'default_pagination_count'):
+			return 0
+		return min([
+			value for key, value in self.object_list.model._meta.default_pagination_count.items() 
+			if key in self.filter_key and isinstance(value, int)
+		] or [0])
+
+	def get_count_strategy(self):
+		if self.count_strategy is not None:
+			return self.count_strategy
+		default_pagination_count = getattr(self.object_list.model._meta, 'default_pagination_count', {})
+		if any(
+			value == COUNT_STRATEGY_ESTIMATE for key, value in default_pagination_count.items() 
+			if key in self.filter_key
+		):
+			return COUNT_STRATEGY_ESTIMATE
+		return COUNT_STRATEGY_EXACT
+
+	def get_count(self):
+		return get_count(self.object_list, strategy=self.get_count_strategy(), threshold=self.estimate_threshold)
 
 	@cached_property
 	def count(self):
 		# Internal Cache pagination
-		filter_key = query_filter_key(self.object_list.query)
-		cache_key = f"pagination:{self.object_list.model.__name__}:{filter_key}"
+		cache_key = self.cache_key
+		entry = cache.get(cache_key)
+		if not should_refresh(entry):
+			self.count_computed_at = getattr(entry, 'computed_at', None)
+			return get_entry_value(entry)
 
-		# Attempt to get cache key
-		count = cache.get(cache_key)
-		if count is not None:
+		# Stale while revalidate, serve last known or default count and refresh in background
+		count = get_entry_value(entry) if entry is not None else self.get_default_count()
+		if count:
+			self.count_computed_at = getattr(entry, 'computed_at', None)
+			self.schedule_count_refresh()
 			return count
 
-		# Default to Pagination Count for pre-defined model
-		if hasattr(self.object_list.model._meta, 'default_pagination_count'):
-			count = min([
-				value for key, value in self.object_list.model._meta.default_pagination_count.items() 
-				if key in cache_key
-			] or [0])
-			# TODO: Attempt to perform background cache set
-			if count != 0:
-				return count
-
-		# Else get the count and continue
-		count = self.object_list.count()
-		cache.set(cache_key, count, self.cache_duration)
+		# Else get the count, single worker recomputes on expiry
+		count = get_or_recompute(
+			cache_key=cache_key, recompute=self.get_count, duration=self.cache_duration
+		)
+		self.count_computed_at = time.time()
 		return count
 
+	def schedule_count_refresh(self) -> bool:
+		"""Queue an exact count refresh, at most one queued refresh per cache key"""
+		refresh_key = f"refresh:{self.cache_key}"
+		if not cache.add(refresh_key, 1, PAGINATION_REFRESH_TIMEOUT):
+			return False
+
+		# `publish_task` retries and raises once retries are exhausted, its False
+		# return may follow a successful retry
+		try:
+			publish_task(
+				task=PAGINATION_COUNT_TASK,
+				params={
+					'cache_key': self.cache_key,
+					'model': self.object_list.model._meta.label,
+					'query': dump_query(self.object_list.query),
+					'duration': self.cache_duration,
+					'strategy': self.get_count_strategy(),
+					'threshold': self.estimate_threshold,
+				},
+				queue=self.refresh_queue
+			)
+		except Exception:
+			cache.delete(refresh_key)
+			logger.warning(
+				f"Failed to queue pagination count refresh `{self.cache_key}`", exc_info=True,
+				extra={'task': PAGINATION_COUNT_TASK}
+			)
+			return False
+		return True
+
+
+def refresh_pagination_count(params: dict) -> int:
+	"""
+	Task handler for `refresh_pagination_count` (see `settings.RABBITMQ_TASKS`),
+	computes the exact count of the signed queryset query, or its estimate, and
+	caches it for `CachedDjangoPaginator.count`
+	"""
+	try:
+		queryset = QuerySet(model=apps.get_model(params['model']))
+		queryset.query = load_query(params['query'])
+		start = time.time()
+		count = get_count(
+			queryset,
+			strategy=params.get('strategy', COUNT_STRATEGY_EXACT),
+			threshold=params.get('threshold', ESTIMATE_EXACT_THRESHOLD)
+		)
+		duration = params.get('duration', WEEK)
+		cache.set(
+			params['cache_key'], make_entry(count, time.time() - start, duration), duration + STALE_DURATION
+		)
+	finally:
+		cache.delete(f"refresh:{params['cache_key']}")
+	return count
+
 
 def get_pagination_context(prefix, iterable, page_number, paginate_by):
 	'''
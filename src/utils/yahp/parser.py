@@ -183,30 +183,152 @@ def required_parse_bool(x, default=False):
 	return parse_bool(x=x, nullable=False, default=default)
 
 
-def try_parsing_date(x: str) -> datetime.datetime:
+# Secondary known suboptimal formats attempted when the Pandas parser fails
+DATE_FORMATS = ('%m%d%y', '%m%d%Y', '%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y')
+
+# Candidate formats for column level inference, ordered by preference on ties
+INFERRED_DATE_FORMATS = (
+	'%Y-%m-%d',
+	'%Y-%m-%d %H:%M:%S',
+	'%Y-%m-%dT%H:%M:%S',
+	'%Y-%m-%d %H:%M',
+	'%Y/%m/%d',
+	'%m/%d/%Y',
+	'%m/%d/%Y %H:%M',
+	'%m/%d/%Y %H:%M:%S',
+	'%m/%d/%Y %I:%M %p',
+	'%m/%d/%y',
+	'%m-%d-%Y',
+	'%m%d%y',
+	'%m%d%Y',
+	'%Y%m%d',
+	'%d.%m.%Y',
+	'%d/%m/%Y',
+)
+DATE_FORMAT_SAMPLE_SIZE = 200
+DATE_FORMAT_MIN_MATCH_RATE = 0.9
+DATE_FORMAT_CACHE_SIZE = 1000
+
+# Inferred format per column or source `{cache_key: format}`
+_DATE_FORMAT_CACHE = {}
+
+
+def normalize_date_string(x: str) -> str:
 	"""
-	String to Datetime parser with default Pandas parser then secondary know suboptimal formats
+	Pad numeric dates missing a leading zero (72121 -> 072121, 1252021 -> 01252021)
 	"""
 	if x.isnumeric() and len(x) == 5:
-		x = x.zfill(6)
-
+		return x.zfill(6)
 	if x.isnumeric() and len(x) == 7:
-		x = x.zfill(8)
+		return x.zfill(8)
+	return x
+
+
+def try_parsing_date(x: str, fmt: str = None) -> datetime.datetime:
+	"""
+	String to Datetime parser with default Pandas parser then secondary know suboptimal formats
+
+	fmt str
+		Optional known format (see `get_date_format`) attempted before the default parsers
+	"""
+	x = normalize_date_string(x)
+	if fmt is not None:
+		try:
+			return datetime.datetime.strptime(x, fmt)
+		except ValueError:
+			pass
 	try:
 		return pd.to_datetime(x).to_pydatetime()
 	except:
-		for fmt in ('%m%d%y', '%m%d%Y', '%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y'):
+		for date_format in DATE_FORMATS:
 			try:
-				return datetime.datetime.strptime(x, fmt)
+				return datetime.datetime.strptime(x, date_format)
 			except ValueError:
 				pass
 		raise ValueError('no valid date format found')
 
 
+def infer_date_format(values,
+                      sample_size: int = DATE_FORMAT_SAMPLE_SIZE,
+                      min_match_rate: float = DATE_FORMAT_MIN_MATCH_RATE) -> str:
+	'''
+	Infer the date format of a column from a sample of its distinct values
+
+	Parameters
+	-----------
+	values : Iterable
+		Column values, missing values are ignored
+	sample_size : int
+		Max number of distinct values tested against each candidate format
+	min_match_rate : float
+		Share of the sample a format must parse to be selected
+
+	Returns
+	-----------
+	fmt : str
+		Winning format from `INFERRED_DATE_FORMATS` or None if no format qualifies
+	'''
+	sample = []
+	for x in pd.unique(pd.Series(values).dropna().astype(str)):
+		sample.append(normalize_date_string(x.strip()))
+		if len(sample) >= sample_size:
+			break
+	if len(sample) == 0:
+		return None
+
+	best_fmt, best_matches = None, 0
+	for fmt in INFERRED_DATE_FORMATS:
+		matches = 0
+		for x in sample:
+			try:
+				datetime.datetime.strptime(x, fmt)
+				matches += 1
+			except ValueError:
+				pass
+		if matches > best_matches:
+			best_fmt, best_matches = fmt, matches
+		if matches == len(sample):
+			break
+
+	if best_matches / len(sample) < min_match_rate:
+		return None
+	return best_fmt
+
+
+def get_date_format(values, cache_key: str = None, **kwargs) -> str:
+	'''
+	Get the memoized date format for a column or source, inferring it from
+	`values` on first use
+
+	cache_key str
+		Column or source key, e.g. `<upload source>:<column>`. The format is only
+		inferred when not provided.
+	'''
+	if cache_key is not None and cache_key in _DATE_FORMAT_CACHE:
+		return _DATE_FORMAT_CACHE[cache_key]
+
+	fmt = infer_date_format(values, **kwargs)
+	if cache_key is not None and fmt is not None:
+		# Bounded cache, evict the oldest entry
+		if len(_DATE_FORMAT_CACHE) >= DATE_FORMAT_CACHE_SIZE:
+			_DATE_FORMAT_CACHE.pop(next(iter(_DATE_FORMAT_CACHE)), None)
+		_DATE_FORMAT_CACHE[cache_key] = fmt
+	return fmt
+
+
+def clear_date_format_cache(cache_key: str = None):
+	'''Clear the memoized date format for a key, or all keys'''
+	if cache_key is None:
+		_DATE_FORMAT_CACHE.clear()
+	else:
+		_DATE_FORMAT_CACHE.pop(cache_key, None)
+
+
 def parse_date(x,
                nullable: bool = True,
                default: datetime.datetime = None,
-               local_tz: bool = False):
+               local_tz: bool = False,
+               fmt: str = None):
 	'''
 	Test Cases
 	----------
@@ -228,7 +350,7 @@ def parse_date(x,
 		x = str(x)
 
 	try:
-		dt = try_parsing_date(x)
+		dt = try_parsing_date(x, fmt=fmt)
 		# Make Timezone Aware if not already
 		if dt.tzinfo is None:
 			dt = timezone.make_aware(dt, pytz.timezone('UTC'))
@@ -246,7 +368,8 @@ def parse_date(x,
 def parse_datetime(x,
                    nullable: bool = True,
                    default: datetime.datetime = None,
-                   local_tz: bool = False):
+                   local_tz: bool = False,
+                   fmt: str = None):
 	'''
 	Test Cases
 	----------
@@ -268,8 +391,7 @@ def parse_datetime(x,
 		x = str(x)
 
 	try:
-		# TODO: Update Try Parsing Datetime function
-		dt = try_parsing_date(x)
+		dt = try_parsing_date(x, fmt=fmt)
 		# Make Timezone Aware if not already
 		if local_tz:
 			dt = dt.replace(tzinfo=None).astimezone(timezone.get_current_timezone())
@@ -284,7 +406,7 @@ def parse_datetime(x,
 		return default
 
 
-def parse_time(x, nullable=True, default=None):
+def parse_time(x, nullable=True, default=None, fmt=None):
 	'''
 	Test Cases
 	----------
@@ -304,7 +426,7 @@ def parse_time(x, nullable=True, default=None):
 		x = str(x)
 
 	try:
-		dt = try_parsing_date(x)
+		dt = try_parsing_date(x, fmt=fmt)
 		dt = timezone.make_aware(dt, pytz.timezone('UTC'))
 		return dt.time()
 	except:
@@ -414,3 +536,274 @@ def check_handle_numeric_precision(x,max_digits,decimal_places,on_size_error='se
 	else:
 		violates_decimal_places = False
 	return x,violates_max_digits,violates_decimal_places
+
+
+# Vectorized (column-wise) cleaning
+# ---------------------------------
+# Series counterparts of the scalar parsers above for bulk imports. Each returns
+# a tuple of (cleaned series, fallback count) where the fallback count is the
+# number of rows that were replaced by the null/default value because the value
+# could not be parsed, or was missing on a non nullable field. Object columns are
+# treated as text, as produced by `read_file_to_df` (dtype=str).
+
+BOOL_TRUE_VALUES = ['yes', 'y', 'true', 't', '1']
+BOOL_FALSE_VALUES = ['no', 'n', 'false', 'f', '0']
+
+
+def _fill_series(values: pd.Series, invalid: pd.Series, missing: pd.Series, nullable: bool, default):
+	'''
+	Apply scalar parser null/default semantics to a parsed Series
+
+	Parameters
+	-----------
+	values : pd.Series
+		Parsed values
+	invalid : pd.Series
+		Boolean mask of rows to replace with None (nullable) or default
+	missing : pd.Series
+		Boolean mask of rows missing in the raw Series
+
+	Returns
+	-----------
+	result : pd.Series
+		Object Series with None (nullable) or default for invalid rows
+	fallback_count : int
+		Number of rows which fell back to the null/default value, missing rows
+		are only counted for non nullable fields
+	'''
+	result = values.astype(object)
+	result[invalid] = None if nullable else default
+	if nullable:
+		return result, int((invalid & ~missing).sum())
+	return result, int(invalid.sum())
+
+
+def _numeric_series(s: pd.Series, alpha_strict: bool = False) -> pd.Series:
+	'''Coerce Series to float64 mirroring `parse_numeric` string handling'''
+	if pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+		return s.astype(float)
+	s = s.astype(str).where(s.notna())
+	if not alpha_strict:
+		s = s.str.replace('[^0-9.-]+', '', regex=True)
+	return pd.to_numeric(s, errors='coerce')
+
+
+def parse_varchar_series(s: pd.Series, nullable=True, default=''):
+	'''Series counterpart of `parse_varchar`'''
+	missing = s.isna()
+	return _fill_series(s.astype(str), missing, missing, nullable, default)
+
+
+def parse_numeric_series(s: pd.Series, nullable=True, default=0, alpha_strict=False):
+	'''Series counterpart of `parse_numeric`'''
+	missing = s.isna()
+	values = _numeric_series(s, alpha_strict=alpha_strict)
+	return _fill_series(values, values.isna(), missing, nullable, default)
+
+
+def parse_integer_series(s: pd.Series, nullable=True, default=0):
+	'''
+	Series counterpart of `parse_integer`, values are truncated like `int()`.
+	Values outside of the int64 range fall back to the null/default value.
+	'''
+	missing = s.isna()
+	values = _numeric_series(s)
+	bounds = np.iinfo(np.int64)
+	# float(bounds.max) rounds up to 2 ** 63
+	invalid = values.isna() | (values < bounds.min) | (values >= float(bounds.max))
+	values = np.trunc(values.where(~invalid, 0)).astype(np.int64)
+	return _fill_series(values, invalid, missing, nullable, default)
+
+
+def parse_bool_series(s: pd.Series, nullable=True, default=False):
+	'''
+	Series counterpart of `parse_bool`
+
+	Note missing float values (NaN) are parsed as False, in line with
+	`parse_bool(np.nan)`, while None falls back to the null/default value.
+	'''
+	if pd.api.types.is_bool_dtype(s):
+		return s.astype(object), 0
+	if pd.api.types.is_numeric_dtype(s):
+		return (s > 0).astype(object), 0
+
+	missing = s.isna()
+	lowered = s.astype(str).where(~missing).str.lower()
+	true_mask = lowered.isin(BOOL_TRUE_VALUES)
+	false_mask = lowered.isin(BOOL_FALSE_VALUES)
+
+	# Missing float values behave as numeric values (NaN > 0 is False)
+	nan_mask = pd.Series(False, index=s.index)
+	nan_mask[missing] = s[missing].map(lambda x: isinstance(x, (float, np.floating)))
+
+	invalid = ~(true_mask | false_mask | nan_mask)
+	return _fill_series(true_mask, invalid, missing, nullable, default)
+
+
+def required_parse_bool_series(s: pd.Series, default=False):
+	return parse_bool_series(s=s, nullable=False, default=default)
+
+
+def _datetime_series(s: pd.Series, cache_key: str = None) -> pd.Series:
+	'''
+	Parse Series to datetime64 mirroring `try_parsing_date`. The column format is
+	inferred once (memoized per `cache_key`) and applied to the whole column,
+	values which the vectorized parsers can not handle are passed to
+	`try_parsing_date` one by one.
+
+	Columns mixing UTC offsets, or aware and naive values, can not be held in a
+	datetime64 Series and are returned as an object Series of datetimes.
+	'''
+	if pd.api.types.is_datetime64_any_dtype(s):
+		return s
+
+	s = s.astype(str).where(s.notna())
+	# Pad numeric dates missing a leading zero (72121 -> 072121)
+	numeric_mask = s.str.isnumeric().fillna(False).astype(bool)
+	lengths = s.str.len()
+	s = s.mask(numeric_mask & (lengths == 5), s.str.zfill(6))
+	s = s.mask(numeric_mask & (lengths == 7), s.str.zfill(8))
+
+	fmt = get_date_format(s, cache_key=cache_key)
+	if fmt is not None:
+		values = pd.to_datetime(s, format=fmt, errors='coerce')
+	else:
+		values = pd.to_datetime(s, errors='coerce')
+		for fmt in DATE_FORMATS:
+			remaining = values.isna() & s.notna()
+			if not remaining.any():
+				break
+			values[remaining] = pd.to_datetime(s[remaining], format=fmt, errors='coerce')
+
+	# Outliers fall back to the per value parser
+	remaining = values.isna() & s.notna()
+	if remaining.any():
+		def _try_parsing_date(x):
+			try:
+				return try_parsing_date(x)
+			except ValueError:
+				return pd.NaT
+		values[remaining] = pd.to_datetime(s[remaining].map(_try_parsing_date), errors='coerce')
+
+	if not pd.api.types.is_datetime64_any_dtype(values):
+		# Object Series coerce unparsed values to the string 'NaT'
+		values = values.map(lambda x: x if isinstance(x, datetime.datetime) else pd.NaT)
+	return values
+
+
+def parse_date_series(s: pd.Series,
+                      nullable: bool = True,
+                      default: datetime.date = None,
+                      local_tz: bool = False,
+                      cache_key: str = None):
+	'''Series counterpart of `parse_date`'''
+	if not nullable and default is None:
+		default = timezone.now().date()
+	values = _datetime_series(s, cache_key=cache_key)
+	if not pd.api.types.is_datetime64_any_dtype(values):
+		# Mixed offsets, aware values keep their own offset like `parse_date`
+		def _date(x):
+			if pd.isna(x):
+				return None
+			if local_tz and x.tzinfo is not None:
+				x = x.astimezone(timezone.get_current_timezone())
+			return x.date()
+		return _fill_series(values.map(_date), values.isna(), s.isna(), nullable, default)
+	if local_tz and values.dt.tz is not None:
+		values = values.dt.tz_convert(timezone.get_current_timezone())
+	return _fill_series(values.dt.date, values.isna(), s.isna(), nullable, default)
+
+
+def parse_time_series(s: pd.Series, nullable=True, default=None, cache_key=None):
+	'''Series counterpart of `parse_time`'''
+	if not nullable and default is None:
+		default = timezone.now().time()
+	values = _datetime_series(s, cache_key=cache_key)
+	if not pd.api.types.is_datetime64_any_dtype(values):
+		# Mixed offsets, only naive values are valid (see below)
+		invalid = values.map(lambda x: pd.isna(x) or x.tzinfo is not None).astype(bool)
+		times = values.map(lambda x: None if pd.isna(x) else x.time())
+		return _fill_series(times, invalid, s.isna(), nullable, default)
+	if values.dt.tz is not None:
+		# `parse_time` fails to make already aware datetimes aware
+		invalid = pd.Series(True, index=s.index)
+	else:
+		invalid = values.isna()
+	return _fill_series(values.dt.time, invalid, s.isna(), nullable, default)
+
+
+def zip_code_regex_sub_series(z: pd.Series, nullable=True, default='unk', allow_aggregate_zip_code=False):
+	'''Series counterpart of `zip_code_regex_sub`'''
+	missing = z.isna()
+	if pd.api.types.is_numeric_dtype(z):
+		z = np.trunc(z.fillna(0)).astype(np.int64)
+	z = z.astype(str)
+	z = z.str.split('.', n=1).str[0].str.split('-', n=1).str[0]
+	z = z.str.replace('[^0-9a-zA-Z-]+', '', regex=True)
+
+	numeric_mask = z.str.isnumeric()
+	zip_codes = z.str.zfill(5).str[:5]
+	if allow_aggregate_zip_code:
+		zip_codes = zip_codes.mask(z.str.len() <= 3, z.str.zfill(3))
+	values = zip_codes.where(numeric_mask, z.str.upper())
+	return _fill_series(values, missing, missing, nullable, default)
+
+
+SERIES_CLEANING_ROUTER = {
+	django.db.models.fields.CharField.__name__ : parse_varchar_series,
+	django.db.models.fields.TextField.__name__ : parse_varchar_series,
+	django.db.models.fields.DecimalField.__name__ : parse_numeric_series,
+	django.db.models.fields.IntegerField.__name__ : parse_integer_series,
+	django.db.models.fields.NullBooleanField.__name__ : parse_bool_series,
+	django.db.models.fields.BooleanField.__name__ : required_parse_bool_series,
+	django.db.models.fields.DateField.__name__ : parse_date_series,
+	django.db.models.fields.TimeField.__name__ : parse_time_series,
+	None : None,
+}
+
+
+def clean_model_dataframe(df: pd.DataFrame, model_class, columns: List[str] = None, source: str = None):
+	'''
+	Clean DataFrame columns for a Django Model using `SERIES_CLEANING_ROUTER`
+
+	Columns are matched on the model field name, nullable semantics follow the
+	model field `null` attribute and non callable field defaults are used as the
+	fallback for non nullable fields.
+
+	Parameters
+	-----------
+	df : pd.DataFrame
+		Raw DataFrame, typically from `read_file_to_df`
+	model_class : django.db.models.Model
+		Model the DataFrame is loaded into
+	columns : List[str]
+		Optional subset of columns to clean, defaults to all model fields
+	source : str
+		Optional upload source key, date formats are memoized per source column
+
+	Returns
+	-----------
+	df : pd.DataFrame
+		Copy of the DataFrame with cleaned columns
+	fallback_counts : Dict[str, int]
+		Number of values per column which fell back to the null/default value
+	'''
+	df = df.copy()
+	fallback_counts = {}
+	for field in model_class._meta.concrete_fields:
+		if field.name not in df.columns or (columns is not None and field.name not in columns):
+			continue
+		cleaner = SERIES_CLEANING_ROUTER.get(field.__class__.__name__, None)
+		if cleaner is None:
+			continue
+
+		kwargs = {}
+		if cleaner is not required_parse_bool_series:
+			kwargs['nullable'] = field.null
+		if field.has_default() and not callable(field.default):
+			kwargs['default'] = field.default
+		if cleaner in (parse_date_series, parse_time_series) and source is not None:
+			kwargs['cache_key'] = f"{source}:{field.name}"
+
+		df[field.name], fallback_counts[field.name] = cleaner(df[field.name], **kwargs)
+	return df, fallback_counts
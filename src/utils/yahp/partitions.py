@@ -0,0 +1,151 @@
+"""
+PostgreSQL monthly declarative range partitioning helpers. Partitions are named
+`{table}_pYYYY_MM` and bounded by local timezone month starts, rows outside of
+the monthly partitions are kept in a `{table}_default` DEFAULT partition.
+Run the helpers in a transaction.
+"""
+from django.utils import timezone
+
+from utils.yahp.datetime import date_to_tz_datetime
+
+from datetime import date
+from dateutil.relativedelta import relativedelta
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+def month_partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table]
+    )
+    return cursor.fetchone() is not None
+
+
+def list_month_partitions(cursor, table: str) -> Dict[date, str]:
+    """Attached monthly partitions by month start"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)", [table]
+    )
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})_(\d{{2}})$")
+    partitions = {}
+    for name, in cursor.fetchall():
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def get_default_partition(cursor, table: str) -> Tuple[Optional[str], str]:
+    """DEFAULT partition name (None without one) and partition key column of a partitioned table"""
+    cursor.execute(
+        "SELECT NULLIF(p.partdefid, 0)::regclass::text, a.attname FROM pg_partitioned_table p "
+        "JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0] "
+        "WHERE p.partrelid = to_regclass(%s)", [table]
+    )
+    return cursor.fetchone()
+
+
+def create_month_partition(cursor, table: str, month: date) -> str:
+    """
+    Create the partition of a month. Rows of the month in the DEFAULT partition are
+    moved to it, a partition can not be created over rows held by DEFAULT.
+    """
+    name = month_partition_name(table, month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return name
+
+    start, end = date_to_tz_datetime(month), date_to_tz_datetime(month + relativedelta(months=1))
+    default, column = get_default_partition(cursor, table)
+    if default is not None:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+    cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", [start, end])
+    if default is not None:
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE {column} >= %s AND {column} < %s RETURNING *) "
+            f"INSERT INTO {table} SELECT * FROM moved", [start, end]
+        )
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    return name
+
+
+def month_range(start: date, end: date) -> List[date]:
+    """Month starts from the month of start to the month of end, inclusive"""
+    month, months = start.replace(day=1), []
+    while month <= end:
+        months.append(month)
+        month += relativedelta(months=1)
+    return months
+
+
+def get_index_definitions(cursor, table: str) -> List[str]:
+    """Index definitions of a table excluding the primary key"""
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ("
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+        [table, table]
+    )
+    return [indexdef for indexdef, in cursor.fetchall()]
+
+
+def get_foreign_key_definitions(cursor, table: str) -> List[str]:
+    """Foreign key `ADD CONSTRAINT` clauses of a table"""
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [table]
+    )
+    return [f"ADD CONSTRAINT {name} {definition}" for name, definition in cursor.fetchall()]
+
+
+def _rebuild_table(cursor, table: str, create_sql: str, primary_key: str, after_create=None):
+    # Swap in a new table definition keeping the data, indexes and foreign keys
+    indexes = get_index_definitions(cursor, table)
+    foreign_keys = get_foreign_key_definitions(cursor, table)
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_previous")
+    cursor.execute(create_sql.format(table=table, source=f"{table}_previous"))
+    if after_create is not None:
+        after_create()
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {table}_previous")
+    cursor.execute(f"DROP TABLE {table}_previous CASCADE")
+    cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({primary_key})")
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for foreign_key in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} {foreign_key}")
+
+
+def partition_table(cursor, table: str, column: str, ahead: int = 3):
+    """
+    Convert a table to monthly range partitions on `column` keeping its data,
+    indexes and foreign keys. Partitions are created from the month of the first
+    row to `ahead` months after the current month, plus the DEFAULT partition.
+    The primary key becomes (id, column) as required for partitioned tables.
+    """
+    def _create_partitions():
+        cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM {table}_previous")
+        first, last = cursor.fetchone()
+        today = timezone.localdate()
+        start = timezone.localdate(first) if first is not None else today
+        end = max(timezone.localdate(last) if last is not None else today, today) + relativedelta(months=ahead)
+        for month in month_range(start, end):
+            create_month_partition(cursor, table, month)
+        cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    _rebuild_table(
+        cursor, table,
+        f"CREATE TABLE {{table}} (LIKE {{source}} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})",
+        primary_key=f"id, {column}",
+        after_create=_create_partitions
+    )
+
+
+def unpartition_table(cursor, table: str):
+    """Convert a partitioned table back to a plain table keeping its data, indexes and foreign keys"""
+    _rebuild_table(
+        cursor, table, "CREATE TABLE {table} (LIKE {source} INCLUDING DEFAULTS)", primary_key='id'
+    )